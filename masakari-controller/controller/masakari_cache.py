@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-memory caches used to check duplicate notifications without scanning
+notification_list table.
+"""
+
+import bisect
+import collections
+import datetime
+import hashlib
+import math
+import struct
+import threading
+
+# Results of NotificationIdCache.lookup()
+FOUND = 'found'
+NOT_FOUND = 'not_found'
+UNKNOWN = 'unknown'
+
+
+class BloomFilter(object):
+
+    """
+    BloomFilter class:
+    A set of strings which may answer "contained" for a string that was
+    never added (with the probability of error_rate), but never answers
+    "not contained" for a string that was added.
+    """
+
+    def __init__(self, capacity, error_rate):
+        """
+        Constructor:
+        :param capacity: The number of strings expected to be added
+        :param error_rate: The false positive rate at the capacity
+        """
+        self.capacity = capacity
+        self.count = 0
+        self.bit_cnt = int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_cnt = max(1, int(round(
+            float(self.bit_cnt) / capacity * math.log(2))))
+        self._bits = bytearray((self.bit_cnt + 7) // 8)
+
+    def _positions(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        for i in range(self.hash_cnt):
+            yield (h1 + i * h2) % self.bit_cnt
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self._bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class NotificationIdCache(object):
+
+    """
+    NotificationIdCache class:
+    This class holds the notification ids registered to notification_list
+    table. The recent ids are kept in a bounded LRU and the ids are added to
+    a bloom filter.
+    When the bloom filter is full, it is kept as the old one and a new one is
+    started, and the ids of the filter older than that are forgotten. The
+    cache only answers NOT_FOUND for the notifications whose time is at or
+    after the floor, i.e. newer than any forgotten id.
+    It assumes that only this process registers notifications.
+    """
+
+    def __init__(self, lru_size, bloom_capacity, bloom_error_rate):
+        """
+        Constructor:
+        :param lru_size: The number of the recent ids kept in the LRU
+        :param bloom_capacity: The number of the ids kept in a bloom filter
+        :param bloom_error_rate: The false positive rate of a bloom filter
+        """
+        self.lru_size = lru_size
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self._lru = collections.OrderedDict()
+        self._bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+        self._old_bloom = None
+        # The latest notification time added to each bloom filter
+        self._bloom_max_time = None
+        self._old_bloom_max_time = None
+        # None means no id has been forgotten.
+        self._floor = None
+        self._lock = threading.Lock()
+        self._stats = {'found_cnt': 0, 'not_found_cnt': 0, 'unknown_cnt': 0,
+                       'rotate_cnt': 0}
+
+    def set_floor(self, floor):
+        """
+        Set the notification time from which the ids are added, e.g. the
+        start of the window loaded from notification_list table.
+        """
+        with self._lock:
+            self._floor = floor if self._floor is None \
+                else max(self._floor, floor)
+
+    def _rotate(self):
+        if self._old_bloom_max_time is not None:
+            # The ids up to this time are forgotten.
+            floor = self._old_bloom_max_time + \
+                datetime.timedelta(microseconds=1)
+            self._floor = floor if self._floor is None \
+                else max(self._floor, floor)
+        self._old_bloom = self._bloom
+        self._old_bloom_max_time = self._bloom_max_time
+        self._bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+        self._bloom_max_time = None
+        self._stats['rotate_cnt'] += 1
+
+    def add(self, notification_id, notification_time):
+        """
+        Add the notification id registered to notification_list table.
+        :param notification_id: The notification id
+        :param notification_time: The time of the notification
+        """
+        with self._lock:
+            if self._bloom.is_full():
+                self._rotate()
+            self._bloom.add(notification_id)
+            self._bloom_max_time = notification_time \
+                if self._bloom_max_time is None \
+                else max(self._bloom_max_time, notification_time)
+            self._lru.pop(notification_id, None)
+            self._lru[notification_id] = True
+            if len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def lookup(self, notification_id, notification_time):
+        """
+        Check whether the notification id is registered.
+        :param notification_id: The notification id
+        :param notification_time: The time of the notification
+        :returns: FOUND if it is registered, NOT_FOUND if it is not
+         registered, UNKNOWN if notification_list table has to be checked.
+        """
+        with self._lock:
+            if notification_id in self._lru:
+                # Mark as recently used
+                self._lru[notification_id] = self._lru.pop(notification_id)
+                result = FOUND
+            elif self._floor is not None and notification_time < self._floor:
+                result = UNKNOWN
+            elif notification_id not in self._bloom and (
+                    self._old_bloom is None or
+                    notification_id not in self._old_bloom):
+                result = NOT_FOUND
+            else:
+                result = UNKNOWN
+            self._stats[result + '_cnt'] += 1
+
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['lru_cnt'] = len(self._lru)
+            stats['bloom_cnt'] = self._bloom.count
+
+        return stats
+
+
+class NotificationTimeIndex(object):
+
+    """
+    NotificationTimeIndex class:
+    This class holds notification_time of the rscGroup notifications
+    registered to notification_list table, sorted for each host.
+    The index of a host is complete from its floor time. The times older
+    than the retention from the latest time of the host are dropped and
+    the floor is moved forward.
+    """
+
+    def __init__(self, retention):
+        """
+        Constructor:
+        :param retention: The seconds of notification_time kept for each host
+        """
+        self.retention = datetime.timedelta(seconds=retention)
+        self._times = {}
+        self._floors = {}
+        self._lock = threading.Lock()
+        self._stats = {'hit_cnt': 0, 'miss_cnt': 0}
+
+    def _prune(self, hostname):
+        times = self._times[hostname]
+        if not times:
+            return
+        limit = times[-1] - self.retention
+        pos = bisect.bisect_left(times, limit)
+        if pos:
+            del times[:pos]
+            self._floors[hostname] = max(self._floors[hostname], limit)
+
+    def load(self, hostname, since, times):
+        """
+        Register the times of the host read from notification_list table.
+        :param hostname: The host name
+        :param since: The time from which the times were read
+        :param times: notification_time read from notification_list table
+        """
+        with self._lock:
+            merged = set(self._times.get(hostname, []))
+            merged.update(times)
+            self._times[hostname] = sorted(merged)
+            floor = self._floors.get(hostname)
+            self._floors[hostname] = since if floor is None \
+                else min(floor, since)
+            self._prune(hostname)
+
+    def add(self, hostname, notification_time):
+        """
+        Add notification_time of the rscGroup notification registered to
+        notification_list table. The time is not kept if the host is not
+        loaded yet, because it is read from the table at the next load.
+        """
+        with self._lock:
+            if hostname not in self._floors:
+                return
+            bisect.insort(self._times[hostname], notification_time)
+            self._prune(hostname)
+
+    def exists_since(self, hostname, since):
+        """
+        Check whether the host has a notification at or after the time.
+        :returns: True or False, or None if notification_list table has to
+         be checked.
+        """
+        with self._lock:
+            floor = self._floors.get(hostname)
+            if floor is None or since < floor:
+                self._stats['miss_cnt'] += 1
+                return None
+            self._stats['hit_cnt'] += 1
+            times = self._times[hostname]
+            return bisect.bisect_left(times, since) < len(times)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['host_cnt'] = len(self._floors)
+            stats['time_cnt'] = sum(len(t) for t in self._times.values())
+
+        return stats
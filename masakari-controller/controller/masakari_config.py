@@ -113,6 +113,21 @@ class RecoveryControllerConfig(object):
             inifile.get('db', 'lock_retry_max_cnt')
         conf_db['innodb_lock_wait_timeout'] = \
             inifile.get('db', 'innodb_lock_wait_timeout')
+        conf_db['pool_size'] = self._get_option_with_default(
+            inifile, 'db', 'pool_size', '10')
+        conf_db['max_overflow'] = self._get_option_with_default(
+            inifile, 'db', 'max_overflow', '20')
+        conf_db['pool_timeout'] = self._get_option_with_default(
+            inifile, 'db', 'pool_timeout', '30')
+        conf_db['pool_recycle'] = self._get_option_with_default(
+            inifile, 'db', 'pool_recycle', '3600')
+        conf_db['pool_pre_ping'] = self._get_option_with_default(
+            inifile, 'db', 'pool_pre_ping', 'true')
+        conf_db['progress_journal'] = self._get_option_with_default(
+            inifile, 'db', 'progress_journal', 'false')
+        conf_db['progress_journal_flush_interval'] = \
+            self._get_option_with_default(
+                inifile, 'db', 'progress_journal_flush_interval', '0.3')
 
         return conf_db
 
@@ -132,10 +147,40 @@ class RecoveryControllerConfig(object):
         except ConfigParser.NoOptionError:
             conf_recover_starter['node_err_wait'] = '120'
 
+        conf_recover_starter['adaptive_concurrency'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'adaptive_concurrency', 'false')
+        conf_recover_starter['adaptive_concurrency_min'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'adaptive_concurrency_min', '1')
+        conf_recover_starter['adaptive_concurrency_max'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'adaptive_concurrency_max', '20')
+        conf_recover_starter['adaptive_latency_target'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'adaptive_latency_target', '10')
+        conf_recover_starter['node_force_down'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'node_force_down', 'false')
+        conf_recover_starter['stonith_trusted'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'stonith_trusted', 'false')
+        conf_recover_starter['node_err_check_interval'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'node_err_check_interval', '10')
         conf_recover_starter['api_max_retry_cnt'] = inifile.get(
             'recover_starter', 'api_max_retry_cnt')
         conf_recover_starter['api_retry_interval'] = inifile.get(
             'recover_starter', 'api_retry_interval')
+        conf_recover_starter['api_rate_limit'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'api_rate_limit', '0')
+        conf_recover_starter['api_rate_burst'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'api_rate_burst', '10')
+        conf_recover_starter['api_retry_budget_ratio'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'api_retry_budget_ratio', '0.2')
         conf_recover_starter['recovery_max_retry_cnt'] = inifile.get(
             'recover_starter', 'recovery_max_retry_cnt')
         conf_recover_starter['recovery_retry_interval'] = inifile.get(
@@ -144,8 +189,56 @@ class RecoveryControllerConfig(object):
             'recover_starter', 'api_check_interval')
         conf_recover_starter['api_check_max_cnt'] = inifile.get(
             'recover_starter', 'api_check_max_cnt')
+        conf_recover_starter['evacuation_tracking'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'evacuation_tracking', 'false')
+        conf_recover_starter['evacuation_timeout'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'evacuation_timeout', '600')
+        conf_recover_starter['evacuation_max_retry_cnt'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'evacuation_max_retry_cnt', '1')
         conf_recover_starter['notification_expiration_sec'] = \
             inifile.get('recover_starter', 'notification_expiration_sec')
+        conf_recover_starter['notification_id_cache_size'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'notification_id_cache_size',
+                '10000')
+        conf_recover_starter['notification_id_bloom_capacity'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'notification_id_bloom_capacity',
+                '1000000')
+        conf_recover_starter['notification_id_bloom_error_rate'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter',
+                'notification_id_bloom_error_rate', '0.001')
+        conf_recover_starter['notification_id_cache_window'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'notification_id_cache_window',
+                '86400')
+        conf_recover_starter['expiry_sweep_interval'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'expiry_sweep_interval', '60')
+        conf_recover_starter['inventory_snapshot'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'inventory_snapshot', 'false')
+        conf_recover_starter['inventory_refresh_interval'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'inventory_refresh_interval',
+                '60')
+        conf_recover_starter['evacuation_planner'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'evacuation_planner', 'false')
+        conf_recover_starter['evacuation_planner_max_hosts'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'evacuation_planner_max_hosts',
+                '3')
+        conf_recover_starter['cpu_allocation_ratio'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'cpu_allocation_ratio', '16.0')
+        conf_recover_starter['ram_allocation_ratio'] = \
+            self._get_option_with_default(
+                inifile, 'recover_starter', 'ram_allocation_ratio', '1.5')
 
         return conf_recover_starter
 
@@ -159,6 +252,16 @@ class RecoveryControllerConfig(object):
 
         return conf_nova
 
+    def _get_option_with_default(self, inifile, section, option, default):
+        """
+        Return the value of the option, or the default value if the option
+        is not set in the configuration file.
+        """
+        try:
+            return inifile.get(section, option)
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+            return default
+
     def get_value(self, section):
         """
         Return the value
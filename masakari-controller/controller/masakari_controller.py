@@ -31,7 +31,6 @@ import os
 import errno
 import traceback
 import logging
-import calendar
 from eventlet import wsgi
 from eventlet import greenthread
 from sqlalchemy import exc
@@ -47,10 +46,13 @@ if parentdir not in sys.path:
 import controller.masakari_starter as starter
 from controller.masakari_util import RecoveryControllerUtil as util
 from controller.masakari_util import RecoveryControllerUtilDb as util_db
-from controller.masakari_util import RecoveryControllerUtilApi as util_api
+from controller.masakari_util import get_util_api
 from controller.masakari_util import LogProcessBeginAndEnd
+from controller.masakari_util import InFlightIds
 from oslo_log import log as oslo_logging
 import controller.masakari_config as config
+import controller.masakari_cache as cache
+import controller.masakari_poller as poller
 import controller.masakari_worker as worker
 import db.api as dbapi
 
@@ -89,9 +91,22 @@ class RecoveryController(object):
             self.rc_starter = starter.RecoveryControllerStarter(
                 self.rc_config)
             self.rc_util_db = util_db(self.rc_config)
-            self.rc_util_api = util_api(self.rc_config)
+            self.rc_util_api = get_util_api(self.rc_config)
             self.rc_worker = worker.RecoveryControllerWorker(self.rc_config)
 
+            conf_dict = self.rc_config.get_value('recover_starter')
+            self.notification_id_cache = cache.NotificationIdCache(
+                int(conf_dict.get('notification_id_cache_size')),
+                int(conf_dict.get('notification_id_bloom_capacity')),
+                float(conf_dict.get('notification_id_bloom_error_rate')))
+            self.in_flight_notifications = InFlightIds()
+            # Keep some slack for the notifications arriving out of order.
+            self.notification_time_index = cache.NotificationTimeIndex(
+                2 * long(conf_dict.get('notification_time_difference')))
+            self.compute_service_poller = poller.ComputeServicePoller(
+                self.rc_util_api,
+                int(conf_dict.get('node_err_check_interval')))
+
         except Exception as e:
             logger = logging.getLogger()
             logger.setLevel(logging.ERROR)
@@ -144,107 +159,8 @@ class RecoveryController(object):
             LOG.info("masakari START.")
 
             # Get a session and do not pass it to other threads
-            db_engine = dbapi.get_engine(self.rc_config)
-            session = dbapi.get_session(db_engine)
-
-            self._update_old_records_notification_list(session)
-            result = self._find_reprocessing_records_notification_list(session)
-            preprocessing_count = len(result)
-
-            if preprocessing_count > 0:
-                for row in result:
-                    if row.recover_by == 0:
-                        # node recovery event
-                        msg = "Run thread rc_worker.host_maintenance_mode." \
-                            + " notification_id=" + row.notification_id \
-                            + " notification_hostname=" \
-                            + row.notification_hostname \
-                            + " update_progress=False"
-                        LOG.info(msg)
-                        thread_name = self.rc_util.make_thread_name(
-                            NOTIFICATION_LIST,
-                            row.notification_id)
-                        th = threading.Thread(
-                            target=self.rc_worker.host_maintenance_mode,
-                            name=thread_name,
-                            args=(row.notification_id,
-                                  row.notification_hostname,
-                                  False,))
-                        th.start()
-
-                        # Sleep until updating nova-compute service status
-                        # down.
-                        dic = self.rc_config.get_value('recover_starter')
-                        node_err_wait = dic.get("node_err_wait")
-                        msg = ("Sleeping %s sec before starting node recovery"
-                               "thread, until updateing nova-compute"
-                               "service status." % (node_err_wait))
-                        LOG.info(msg)
-                        greenthread.sleep(int(node_err_wait))
-
-                        # Start add_failed_host thread
-                        # TODO(sampath):
-                        # Avoid create thread here,
-                        # insted call rc_starter.add_failed_host
-                        retry_mode = True
-                        msg = "Run thread rc_starter.add_failed_host." \
-                            + " notification_id=" + row.notification_id \
-                            + " notification_hostname=" \
-                            + row.notification_hostname \
-                            + " notification_cluster_port=" \
-                            + row.notification_cluster_port \
-                            + " retry_mode=" + str(retry_mode)
-                        LOG.info(msg)
-                        thread_name = self.rc_util.make_thread_name(
-                            NOTIFICATION_LIST,
-                            row.notification_id)
-                        th = threading.Thread(
-                            target=self.rc_starter.add_failed_host,
-                            name=thread_name,
-                            args=(row.notification_id,
-                                  row.notification_hostname,
-                                  row.notification_cluster_port,
-                                  retry_mode, ))
-                        th.start()
-
-                    elif row.recover_by == 1:
-                        # instance recovery event
-                        # TODO(sampath):
-                        # Avoid create thread here,
-                        # insted call rc_starter.add_failed_instance
-                        msg = "Run thread rc_starter.add_failed_instance." \
-                            + " notification_id=" + row.notification_id \
-                            + " notification_uuid=" \
-                            + row.notification_uuid
-                        LOG.info(msg)
-                        thread_name = self.rc_util.make_thread_name(
-                            NOTIFICATION_LIST,
-                            row.notification_id)
-                        th = threading.Thread(
-                            target=self.rc_starter.add_failed_instance,
-                            name=thread_name,
-                            args=(row.notification_id,
-                                  row.notification_uuid, ))
-                        th.start()
-
-                    else:
-                        # maintenance mode event
-                        msg = "Run thread rc_starter.host_maintenance_mode." \
-                            + " notification_id=" + row.notification_id \
-                            + " notification_hostname=" \
-                            + row.notification_hostname \
-                            + "update_progress=True"
-                        LOG.info(msg)
-                        thread_name = self.rc_util.make_thread_name(
-                            NOTIFICATION_LIST,
-                            row.notification_id)
-                        th = threading.Thread(
-                            target=self.rc_worker.host_maintenance_mode,
-                            name=thread_name,
-                            args=(row.notification_id,
-                                  row.notification_hostname,
-                                  True, ))
-                        th.start()
+            with dbapi.session_scope(self.rc_config) as session:
+                self._start_reprocessing(session)
 
             # Start handle_pending_instances thread
             # TODO(sampath):
@@ -258,6 +174,15 @@ class RecoveryController(object):
                 name=thread_name)
             th.start()
 
+            # Start expiry sweeper thread
+            msg = "Run thread _sweep_old_records."
+            LOG.info(msg)
+            th = threading.Thread(
+                target=self._sweep_old_records,
+                name="Thread:sweep_old_records")
+            th.daemon = True
+            th.start()
+
             # Start reciever process for notification
             conf_wsgi_dic = self.rc_config.get_value('wsgi')
             wsgi.server(
@@ -292,6 +217,125 @@ class RecoveryController(object):
 
             sys.exit()
 
+    def _start_reprocessing(self, session):
+        """
+        Start the recovery of the notifications which were not completed
+        before the controller stopped.
+        """
+        self._warm_notification_id_cache(session)
+        self._update_old_records_notification_list(session)
+        result = self._find_reprocessing_records_notification_list(session)
+        preprocessing_count = len(result)
+
+        if preprocessing_count > 0:
+            for row in result:
+                if row.recover_by == 0:
+                    # node recovery event
+                    msg = "Run thread rc_worker.host_maintenance_mode." \
+                        + " notification_id=" + row.notification_id \
+                        + " notification_hostname=" \
+                        + row.notification_hostname \
+                        + " update_progress=False"
+                    LOG.info(msg)
+                    thread_name = self.rc_util.make_thread_name(
+                        NOTIFICATION_LIST,
+                        row.notification_id)
+                    self._start_notification_thread(
+                        thread_name, row.notification_id,
+                        self.rc_worker.host_maintenance_mode,
+                        row.notification_id, row.notification_hostname, False)
+
+                    # Sleep until updating nova-compute service status
+                    # down.
+                    dic = self.rc_config.get_value('recover_starter')
+                    node_err_wait = dic.get("node_err_wait")
+                    msg = ("Sleeping %s sec before starting node recovery"
+                           "thread, until updateing nova-compute"
+                           "service status." % (node_err_wait))
+                    LOG.info(msg)
+                    greenthread.sleep(int(node_err_wait))
+
+                    # Start add_failed_host thread
+                    # TODO(sampath):
+                    # Avoid create thread here,
+                    # insted call rc_starter.add_failed_host
+                    retry_mode = True
+                    msg = "Run thread rc_starter.add_failed_host." \
+                        + " notification_id=" + row.notification_id \
+                        + " notification_hostname=" \
+                        + row.notification_hostname \
+                        + " notification_cluster_port=" \
+                        + row.notification_cluster_port \
+                        + " retry_mode=" + str(retry_mode)
+                    LOG.info(msg)
+                    thread_name = self.rc_util.make_thread_name(
+                        NOTIFICATION_LIST,
+                        row.notification_id)
+                    self._start_notification_thread(
+                        thread_name, row.notification_id,
+                        self.rc_starter.add_failed_host,
+                        row.notification_id, row.notification_hostname,
+                        row.notification_cluster_port, retry_mode)
+
+                elif row.recover_by == 1:
+                    # instance recovery event
+                    # TODO(sampath):
+                    # Avoid create thread here,
+                    # insted call rc_starter.add_failed_instance
+                    msg = "Run thread rc_starter.add_failed_instance." \
+                        + " notification_id=" + row.notification_id \
+                        + " notification_uuid=" \
+                        + row.notification_uuid
+                    LOG.info(msg)
+                    thread_name = self.rc_util.make_thread_name(
+                        NOTIFICATION_LIST,
+                        row.notification_id)
+                    self._start_notification_thread(
+                        thread_name, row.notification_id,
+                        self.rc_starter.add_failed_instance,
+                        row.notification_id, row.notification_uuid)
+
+                else:
+                    # maintenance mode event
+                    msg = "Run thread rc_starter.host_maintenance_mode." \
+                        + " notification_id=" + row.notification_id \
+                        + " notification_hostname=" \
+                        + row.notification_hostname \
+                        + "update_progress=True"
+                    LOG.info(msg)
+                    thread_name = self.rc_util.make_thread_name(
+                        NOTIFICATION_LIST,
+                        row.notification_id)
+                    self._start_notification_thread(
+                        thread_name, row.notification_id,
+                        self.rc_worker.host_maintenance_mode,
+                        row.notification_id, row.notification_hostname, True)
+
+    @log_process_begin_and_end.output_log
+    def _warm_notification_id_cache(self, session):
+        conf_dict = self.rc_config.get_value('recover_starter')
+        window = int(conf_dict.get('notification_id_cache_window'))
+        limit = int(conf_dict.get('notification_id_bloom_capacity'))
+
+        # Only the ids of the recent notifications are loaded, and the older
+        # ones are looked up in DB.
+        since = datetime.datetime.now() - datetime.timedelta(seconds=window)
+        msg = "Do get_recent_notification_ids."
+        LOG.info(msg)
+        rows = dbapi.get_recent_notification_ids(session, since, limit)
+        msg = "Succeeded in get_recent_notification_ids. " \
+            + "Return_value count = " + str(len(rows))
+        LOG.info(msg)
+
+        if len(rows) >= limit:
+            # Some ids at the oldest time may not be loaded.
+            since = rows[-1].notification_time + \
+                datetime.timedelta(microseconds=1)
+        self.notification_id_cache.set_floor(since)
+        for row in reversed(rows):
+            self.notification_id_cache.add(row.notification_id,
+                                           row.notification_time)
+
     @log_process_begin_and_end.output_log
     def _update_old_records_notification_list(self, session):
         # Get notification_expiration_sec from config
@@ -305,89 +349,59 @@ class RecoveryController(object):
         border_time = now - datetime.timedelta(
             seconds=notification_expiration_sec)
 
-        msg = "Do get_old_records_notification."
+        # The notifications being processed are not expired.
+        msg = "Do expire_old_records_notification."
         LOG.info(msg)
-        result = dbapi.get_old_records_notification(session, border_time)
-        msg = "Succeeded in get_old_records_notification. " \
-            + "Return_value = " + str(result)
+        cnt = dbapi.expire_old_records_notification(
+            session, border_time, now,
+            self.in_flight_notifications.snapshot())
+        msg = "Succeeded in expire_old_records_notification. " \
+            + "Return_value = " + str(cnt)
         LOG.info(msg)
 
-        for row in result:
-            msg = "Do delete_expired_notification."
-            LOG.info(msg)
-            dbapi.delete_expired_notification(
-                session,
-                datetime.datetime.now(),
-                datetime.datetime.now(),
-                row.id)
-            msg = "Succeeded in delete_expired_notification."
-            LOG.info(msg)
+        return cnt
+
+    def _sweep_old_records(self):
+        """
+        Expiry sweeper thread:
+            This thread expires the old notification_list and vm_list
+            records which are not processed, every
+            expiry_sweep_interval seconds.
+        """
+        conf_dict = self.rc_config.get_value('recover_starter')
+        expiry_sweep_interval = int(conf_dict.get('expiry_sweep_interval'))
+
+        while True:
+            greenthread.sleep(expiry_sweep_interval)
+            try:
+                with dbapi.session_scope(self.rc_config) as session:
+                    notification_cnt = \
+                        self._update_old_records_notification_list(session)
+                    vm_list_cnt = \
+                        self.rc_starter._update_old_records_vm_list(session)
+                if notification_cnt or vm_list_cnt:
+                    msg = "Expired old records. notification_list=%d " \
+                        "vm_list=%d" % (notification_cnt, vm_list_cnt)
+                    LOG.info(msg)
+            except:
+                error_type, error_value, traceback_ = sys.exc_info()
+                tb_list = traceback.format_tb(traceback_)
+                LOG.error(error_type)
+                LOG.error(error_value)
+                for tb in tb_list:
+                    LOG.error(tb)
 
     @log_process_begin_and_end.output_log
     def _find_reprocessing_records_notification_list(self, session):
 
-        return_value = []
-        msg = "Do get_reprocessing_records_list_distinct."
-        LOG.info(msg)
-        result = dbapi.get_reprocessing_records_list_distinct(session)
-        msg = "Succeeded in get_reprocessing_records_list_distinct. " \
-            + "Return_value = " + str(result)
-        LOG.info(msg)
-
-        # Get reprocessing record
-        for row in result:
-            msg = "Do get_reprocessing_records_list."
-            LOG.info(msg)
-            result2 = dbapi.get_reprocessing_records_list(
-                session, row.notification_uuid)
-            msg = "Succeeded in get_reprocessing_records_list. " \
-                + "Return_value = " + str(result2)
-            LOG.info(msg)
-            # First row is reprocessing record.
-            row_cnt = 0
-            for row2 in result2:
-                if row_cnt == 0:
-                    return_value.append(row2)
-                else:
-                    ct = datetime.datetime.now()
-                    msg = "Do update_reprocessing_records."
-                    LOG.info(msg)
-                    dbapi.update_reprocessing_records(
-                        session, 4, ct, ct, row2.id)
-                    msg = "Succeeded in update_reprocessing_records."
-                    LOG.info(msg)
-                row_cnt += 1
-        msg = "Do get_notification_list_distinct_hostname."
+        msg = "Do supersede_reprocessing_records."
         LOG.info(msg)
-        result = dbapi.get_notification_list_distinct_hostname(session)
-        msg = "Succeeded in get_notification_list_distinct_hostname. " \
-            + "Return_value = " + str(result)
+        return_value = dbapi.supersede_reprocessing_records(
+            session, datetime.datetime.now())
+        msg = "Succeeded in supersede_reprocessing_records. " \
+            + "Return_value = " + str(return_value)
         LOG.info(msg)
 
-        # Get reprocessing record
-        for row in result:
-            msg = "Do get_notification_list_by_hostname."
-            LOG.info(msg)
-            result2 = dbapi.get_notification_list_by_hostname(
-                session, row.notification_hostname)
-            msg = "Succeeded in get_notification_list_by_hostname. " \
-                + "Return_value = " + str(result2)
-            LOG.info(msg)
-            # First row is reprocessing record.
-            row_cnt = 0
-            for row2 in result2:
-                if row_cnt == 0:
-                    return_value.append(row2)
-                else:
-                    ct = datetime.datetime.now()
-                    msg = "Do update_reprocessing_records."
-                    LOG.info(msg)
-                    dbapi.update_reprocessing_records(
-                        session, 4, ct, ct, row2.id)
-                    msg = "Succeeded in update_reprocessing_records."
-                    LOG.info(msg)
-                row_cnt += 1
-
         return return_value
 
     @log_process_begin_and_end.output_log
@@ -425,14 +439,24 @@ class RecoveryController(object):
     def _notification_reciever(self, env, start_response):
 
         try:
+            # The statistics of the controller are returned for GET.
+            if env.get('REQUEST_METHOD') == 'GET':
+                return self._stats_reciever(env, start_response)
+
             len = env['CONTENT_LENGTH']
             if len > 0:
                 body = env['wsgi.input'].read(len)
-                json_data = json.loads(body)
+                json_data = self._load_notification_body(body)
 
                 msg = "Recieved notification : " + body
                 LOG.info(msg)
 
+                # A JSON array or newline-delimited JSON carries a batch of
+                # notifications.
+                if isinstance(json_data, list):
+                    return self._notification_batch_reciever(
+                        json_data, start_response)
+
                 ret = self._check_json_param(json_data)
                 if ret == 1:
                     # Return Response
@@ -451,159 +475,38 @@ class RecoveryController(object):
                 notification_list_dic = self._create_notification_list_db(
                     json_data)
 
+                if notification_list_dic == {}:
+                    # Return Response
+                    # The notification is a duplicate or is ignored, so
+                    # nothing is queued for it.
+                    start_response(
+                        '200 OK', [('Content-Type', 'application/json')])
+
+                    msg = "Wsgi response: " \
+                        + "status=200 OK, " \
+                        + "body=notification id " + json_data.get("id") \
+                        + " ignored"
+                    LOG.info(msg)
+
+                    return [json.dumps({'id': json_data.get("id"),
+                                        'status': 'ignored'}) + '\r\n']
+
+                self._dispatch_notification(notification_list_dic)
+
                 # Return Response
-                start_response('200 OK', [('Content-Type', 'text/plain')])
+                # The notification has been persisted and its recovery runs
+                # in the background, so the notification id is returned for
+                # tracking.
+                start_response(
+                    '202 Accepted', [('Content-Type', 'application/json')])
 
                 msg = "Wsgi response: " \
-                    + "status=200 OK, " \
-                    + "body=method _notification_reciever returned."
+                    + "status=202 Accepted, " \
+                    + "body=notification id " + json_data.get("id")
                 LOG.info(msg)
 
-                if notification_list_dic != {}:
-                    # Start thread
-                    if notification_list_dic.get("recover_by") == 0 and \
-                       notification_list_dic.get("progress") == 0:
-
-                        msg = "Run thread rc_worker.host_maintenance_mode." \
-                            + " notification_id=" \
-                            + notification_list_dic.get("notification_id") \
-                            + " notification_hostname=" \
-                            + notification_list_dic.get(
-                                "notification_hostname") \
-                            + "update_progress=False"
-                        LOG.info(msg)
-                        thread_name = self.rc_util.make_thread_name(
-                            NOTIFICATION_LIST,
-                            notification_list_dic.get("notification_id"))
-                        th = threading.Thread(
-                            target=self.rc_worker.host_maintenance_mode,
-                            name=thread_name,
-                            args=(notification_list_dic.get(
-                                "notification_id"), notification_list_dic.get(
-                                "notification_hostname"),
-                                False, ))
-                        th.start()
-
-                        dic = self.rc_config.get_value('recover_starter')
-                        node_err_wait = dic.get("node_err_wait")
-                        msg = ("Before starting recovery thread"
-                               "check repeatedly whether nova recognizes"
-                               "the node is down (max %s sec)"
-                               % (node_err_wait)
-                               )
-                        LOG.info(msg)
-
-                        node_err_retry_interval = 10
-                        node_err_retry_until = calendar.timegm(datetime.datetime.utcnow().timetuple()) + int(node_err_wait)
-                        target_hostname = notification_list_dic.get("notification_hostname")
-                        LOG.info('target hostname: {0}'.format(target_hostname))
-                        while True:
-                            if calendar.timegm(datetime.datetime.utcnow().timetuple()) > node_err_retry_until:
-                                break
-
-                            LOG.info('check whether the node is down')
-                            is_down = self.rc_util_api.check_compute_node_state(hostname=target_hostname, state='down')
-                            if is_down:
-                                break
-                            else:
-                                greenthread.sleep(int(node_err_retry_interval))
-
-                        retry_mode = False
-                        msg = "Run thread rc_starter.add_failed_host." \
-                            + " notification_id=" \
-                            + notification_list_dic.get("notification_id") \
-                            + " notification_hostname=" \
-                            + notification_list_dic.get(
-                                "notification_hostname") \
-                            + " notification_cluster_port=" \
-                            + notification_list_dic.get(
-                                "notification_cluster_port") \
-                            + " retry_mode=" + str(retry_mode)
-                        LOG.info(msg)
-                        thread_name = self.rc_util.make_thread_name(
-                            NOTIFICATION_LIST,
-                            notification_list_dic.get("notification_id"))
-                        th = threading.Thread(
-                            target=self.rc_starter.add_failed_host,
-                            name=thread_name,
-                            args=(notification_list_dic.get(
-                                "notification_id"),
-                                notification_list_dic.get(
-                                "notification_hostname"),
-                                notification_list_dic.get(
-                                "notification_cluster_port"),
-                                retry_mode, ))
-
-                        th.start()
-                    elif notification_list_dic.get("recover_by") == 0 and \
-                            notification_list_dic.get("progress") == 3:
-                        msg = "Run thread rc_worker.host_maintenance_mode." \
-                            + " notification_id=" \
-                            + notification_list_dic.get("notification_id") \
-                            + " notification_hostname=" \
-                            + notification_list_dic.get(
-                                "notification_hostname") \
-                            + "update_progress=False"
-                        LOG.info(msg)
-                        thread_name = self.rc_util.make_thread_name(
-                            NOTIFICATION_LIST,
-                            notification_list_dic.get("notification_id"))
-                        th = threading.Thread(
-                            target=self.rc_worker.host_maintenance_mode,
-                            name=thread_name,
-                            args=(notification_list_dic.get(
-                                "notification_id"),
-                                notification_list_dic.get(
-                                "notification_hostname"),
-                                False, ))
-                        th.start()
-                    elif notification_list_dic.get("recover_by") == 1:
-                        retry_mode = False
-                        msg = "Run thread rc_starter.add_failed_instance." \
-                            + " notification_id=" \
-                            + notification_list_dic.get("notification_id") \
-                            + " notification_uuid=" \
-                            + notification_list_dic.get("notification_uuid") \
-                            + " retry_mode=" + str(retry_mode)
-                        LOG.info(msg)
-                        thread_name = self.rc_util.make_thread_name(
-                            NOTIFICATION_LIST,
-                            notification_list_dic.get("notification_id"))
-                        th = threading.Thread(
-                            target=self.rc_starter.add_failed_instance,
-                            name=thread_name,
-                            args=(
-                                notification_list_dic.get("notification_id"),
-                                notification_list_dic.get(
-                                    "notification_uuid"), retry_mode, )
-                        )
-                        th.start()
-                    elif notification_list_dic.get("recover_by") == 2:
-                        msg = "Run thread rc_worker.host_maintenance_mode." \
-                            + " notification_id=" \
-                            + notification_list_dic.get("notification_id") \
-                            + " notification_hostname=" \
-                            + notification_list_dic.get(
-                                "notification_hostname") \
-                            + "update_progress=False"
-                        LOG.info(msg)
-                        thread_name = self.rc_util.make_thread_name(
-                            NOTIFICATION_LIST,
-                            notification_list_dic.get("notification_id"))
-                        th = threading.Thread(
-                            target=self.rc_worker.host_maintenance_mode,
-                            name=thread_name,
-                            args=(
-                                notification_list_dic.get("notification_id"),
-                                notification_list_dic.get(
-                                    "notification_hostname"),
-                                True, )
-                        )
-                        th.start()
-                    else:
-                        LOG.warning(
-                            "Column \"recover_by\" \
-                            on notification_list DB is invalid value.")
+                return [json.dumps({'id': json_data.get("id"),
+                                    'status': 'accepted'}) + '\r\n']
 
         except exc.SQLAlchemyError:
             error_type, error_value, traceback_ = sys.exc_info()
@@ -652,102 +555,502 @@ class RecoveryController(object):
 
         return ['method _notification_reciever returned.\r\n']
 
+    def _stats_reciever(self, env, start_response):
+        """
+        Return the statistics of the controller as a JSON object.
+        """
+        stats = {
+            'recovery_executor': self.rc_starter.rc_executor.get_stats(),
+            'notification_id_cache': self.notification_id_cache.get_stats(),
+            'notification_time_index':
+                self.notification_time_index.get_stats(),
+            'db_pool': dbapi.get_pool_stats(),
+            'db_session': dbapi.get_session_stats(),
+            'db_lock_retry': dbapi.get_retry_stats(),
+            'compute_service_poller':
+                self.compute_service_poller.get_stats(),
+            'instance_state_poller': self.rc_worker.rc_state_poller.get_stats(),
+            'nova_api_governor':
+                self.rc_worker.rc_util_api.governor.get_stats(),
+        }
+        if self.rc_starter.rc_inventory is not None:
+            stats['inventory_snapshot'] = \
+                self.rc_starter.rc_inventory.get_stats()
+        if self.rc_util_db.rc_journal is not None:
+            stats['progress_journal'] = \
+                self.rc_util_db.rc_journal.get_stats()
+
+        start_response('200 OK', [('Content-Type', 'application/json')])
+
+        return [json.dumps(stats) + '\r\n']
+
+    def _load_notification_body(self, body):
+        """
+        Decode the notification body.
+        :param body: A JSON object, a JSON array or newline-delimited JSON
+        :returns: A dictionary for a JSON object, otherwise a list. A line
+         of newline-delimited JSON which is not valid is None in the list.
+        """
+        try:
+            return json.loads(body)
+        except ValueError:
+            # newline-delimited JSON
+            json_list = []
+            for line in body.splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    json_list.append(json.loads(line))
+                except ValueError:
+                    msg = "Invalid line in the notifications: " + line
+                    LOG.warning(msg)
+                    json_list.append(None)
+            return json_list
+
     @log_process_begin_and_end.output_log
-    def _create_notification_list_db(self, jsonData):
+    def _notification_batch_reciever(self, json_list, start_response):
+        """
+        Receive a batch of notifications:
+            All the notifications are validated, the valid ones are
+            inserted into notification_list DB at once and the result of
+            each notification is returned in the order of the batch.
+        """
+        results = []
+        valid_list = []
+        controle_ips = {}
+        for json_data in json_list:
+            if not isinstance(json_data, dict):
+                results.append({'id': None, 'status': 'invalid'})
+            elif self._check_json_param(json_data) == 1 or \
+                    not self._check_batch_item(json_data, controle_ips):
+                results.append({'id': json_data.get("id"),
+                                'status': 'invalid'})
+            else:
+                results.append({'id': json_data.get("id"),
+                                'status': 'accepted'})
+                valid_list.append(json_data)
 
-        ret_dic = {}
+        if not valid_list:
+            # Return Response
+            start_response(
+                '400 Bad Request', [('Content-Type', 'application/json')])
 
-        # Get DB from here and pass it to _check_retry_notification
+            msg = "Wsgi response: " \
+                  "status=400 Bad Request, " \
+                  "body=no valid notification in the batch."
+            LOG.info(msg)
+
+            return [json.dumps(results) + '\r\n']
+
+        # Insert notifications into notification_list_db
+        notification_list_dics = self._create_notification_list_db_bulk(
+            valid_list, controle_ips)
+
+        valid_results = [r for r in results if r['status'] == 'accepted']
+        for result, notification_list_dic in zip(valid_results,
+                                                 notification_list_dics):
+            if notification_list_dic != {}:
+                self._dispatch_notification(notification_list_dic)
+            else:
+                result['status'] = 'ignored'
+
+        # Return Response
+        start_response(
+            '202 Accepted', [('Content-Type', 'application/json')])
+
+        msg = "Wsgi response: " \
+            + "status=202 Accepted, " \
+            + "body=" + json.dumps(results)
+        LOG.info(msg)
+
+        return [json.dumps(results) + '\r\n']
+
+    def _check_batch_item(self, json_data, controle_ips):
+        """
+        Check the values of a notification in the batch, which would fail
+        the insert of the whole batch otherwise. The times have to be
+        parsed and the hostname has to be resolved.
+        :param controle_ips: The dictionary of the hostnames resolved in
+         the batch and their addresses, which is updated
+        :returns: True if the notification is valid
+        """
         try:
-            # Get session for db
-            db_engine = dbapi.get_engine(self.rc_config)
-            session = dbapi.get_session(db_engine)
-            if self._check_retry_notification(jsonData, session):
-                msg = "Duplicate notifications. id:" + jsonData.get("id")
+            self._get_notification_time(json_data)
+            if json_data.get("endTime"):
+                datetime.datetime.strptime(json_data.get("endTime"),
+                                           '%Y%m%d%H%M%S')
+            hostname = json_data.get("hostname")
+            if hostname not in controle_ips:
+                controle_ips[hostname] = socket.gethostbyname(hostname)
+        except (ValueError, TypeError, socket.error) as e:
+            msg = "Invalid notification in the batch. id:%s, %s" % (
+                json_data.get("id"), e)
+            LOG.warning(msg)
+            return False
+
+        return True
+
+    def _start_notification_thread(self, thread_name, notification_id,
+                                   target, *args):
+        """
+        Start the thread processing the notification. The notification is
+        held as in flight until the thread ends.
+        """
+        self.in_flight_notifications.add(notification_id)
+        th = threading.Thread(
+            target=self._run_notification_thread,
+            name=thread_name,
+            args=(notification_id, target) + args)
+        th.start()
+
+    def _run_notification_thread(self, notification_id, target, *args):
+        try:
+            target(*args)
+        finally:
+            self.in_flight_notifications.discard(notification_id)
+
+    def _dispatch_notification(self, notification_list_dic):
+        """
+        Start the recovery thread according to the notification that was
+        registered to notification_list table.
+        :param notification_list_dic: The information that was registered to
+         notification_list table in the dictionary type
+        """
+        # Start thread
+        if notification_list_dic.get("recover_by") == 0 and \
+           notification_list_dic.get("progress") == 0:
+
+            # Waiting for nova to recognize the node down takes
+            # up to node_err_wait seconds, so it is done in the
+            # background and the notification is acknowledged
+            # right away.
+            msg = "Run thread _recover_failed_host." \
+                + " notification_id=" \
+                + notification_list_dic.get("notification_id")
+            LOG.info(msg)
+            thread_name = self.rc_util.make_thread_name(
+                NOTIFICATION_LIST,
+                notification_list_dic.get("notification_id"))
+            self._start_notification_thread(
+                thread_name, notification_list_dic.get("notification_id"),
+                self._recover_failed_host, notification_list_dic)
+        elif notification_list_dic.get("recover_by") == 0 and \
+                notification_list_dic.get("progress") == 3:
+            msg = "Run thread rc_worker.host_maintenance_mode." \
+                + " notification_id=" \
+                + notification_list_dic.get("notification_id") \
+                + " notification_hostname=" \
+                + notification_list_dic.get(
+                    "notification_hostname") \
+                + "update_progress=False"
+            LOG.info(msg)
+            thread_name = self.rc_util.make_thread_name(
+                NOTIFICATION_LIST,
+                notification_list_dic.get("notification_id"))
+            self._start_notification_thread(
+                thread_name, notification_list_dic.get("notification_id"),
+                self.rc_worker.host_maintenance_mode,
+                notification_list_dic.get("notification_id"),
+                notification_list_dic.get("notification_hostname"), False)
+        elif notification_list_dic.get("recover_by") == 1:
+            retry_mode = False
+            msg = "Run thread rc_starter.add_failed_instance." \
+                + " notification_id=" \
+                + notification_list_dic.get("notification_id") \
+                + " notification_uuid=" \
+                + notification_list_dic.get("notification_uuid") \
+                + " retry_mode=" + str(retry_mode)
+            LOG.info(msg)
+            thread_name = self.rc_util.make_thread_name(
+                NOTIFICATION_LIST,
+                notification_list_dic.get("notification_id"))
+            self._start_notification_thread(
+                thread_name, notification_list_dic.get("notification_id"),
+                self.rc_starter.add_failed_instance,
+                notification_list_dic.get("notification_id"),
+                notification_list_dic.get("notification_uuid"), retry_mode)
+        elif notification_list_dic.get("recover_by") == 2:
+            msg = "Run thread rc_worker.host_maintenance_mode." \
+                + " notification_id=" \
+                + notification_list_dic.get("notification_id") \
+                + " notification_hostname=" \
+                + notification_list_dic.get(
+                    "notification_hostname") \
+                + "update_progress=False"
+            LOG.info(msg)
+            thread_name = self.rc_util.make_thread_name(
+                NOTIFICATION_LIST,
+                notification_list_dic.get("notification_id"))
+            self._start_notification_thread(
+                thread_name, notification_list_dic.get("notification_id"),
+                self.rc_worker.host_maintenance_mode,
+                notification_list_dic.get("notification_id"),
+                notification_list_dic.get("notification_hostname"), True)
+        else:
+            LOG.warning(
+                "Column \"recover_by\" \
+                on notification_list DB is invalid value.")
+
+    def _recover_failed_host(self, notification_list_dic):
+        """
+        Host recovery thread:
+            This thread disables nova-compute on the failed host, waits until
+            nova recognizes the host is down and then starts the node
+            recovery. The recovery is prepared during the wait.
+        :param notification_list_dic: The information that was registered to
+         notification_list table in the dictionary type
+        """
+        try:
+            notification_id = notification_list_dic.get("notification_id")
+            target_hostname = notification_list_dic.get(
+                "notification_hostname")
+            cluster_port = notification_list_dic.get(
+                "notification_cluster_port")
+
+            msg = "Run thread rc_worker.host_maintenance_mode." \
+                + " notification_id=" + notification_id \
+                + " notification_hostname=" + target_hostname \
+                + "update_progress=False"
+            LOG.info(msg)
+            thread_name = self.rc_util.make_thread_name(
+                NOTIFICATION_LIST, notification_id)
+            th = threading.Thread(
+                target=self.rc_worker.host_maintenance_mode,
+                name=thread_name,
+                args=(notification_id, target_hostname, False, ))
+            th.start()
+
+            dic = self.rc_config.get_value('recover_starter')
+            node_err_wait = dic.get("node_err_wait")
+            msg = ("Before starting recovery thread"
+                   "check repeatedly whether nova recognizes"
+                   "the node is down (max %s sec)"
+                   % (node_err_wait)
+                   )
+            LOG.info(msg)
+
+            LOG.info('target hostname: {0}'.format(target_hostname))
+
+            # Prepare the recovery while waiting for nova.
+            prepared = {}
+            prepare_th = threading.Thread(
+                target=self._prepare_failed_host,
+                name=thread_name + ':prepare',
+                args=(notification_id, target_hostname, cluster_port,
+                      prepared))
+            prepare_th.start()
+
+            started = False
+            try:
+                is_down = self._force_down_host(notification_list_dic)
+                if not is_down:
+                    is_down = self.compute_service_poller.wait_for_state(
+                        target_hostname, 'down', int(node_err_wait))
+                if not is_down:
+                    msg = "nova did not recognize that the node is down " \
+                        + "in " + node_err_wait + " sec. hostname=" \
+                        + target_hostname
+                    LOG.warning(msg)
+
+                prepare_th.join()
+                if 'prepared' not in prepared:
+                    msg = "Failed to prepare the recovery of " \
+                        + target_hostname
+                    LOG.error(msg)
+                    return
+                if prepared['prepared'] is None:
+                    # There is nothing to recover.
+                    return
+
+                retry_mode = False
+                msg = "Do rc_starter.add_failed_host." \
+                    + " notification_id=" + notification_id \
+                    + " notification_hostname=" + target_hostname \
+                    + " notification_cluster_port=" + cluster_port \
+                    + " retry_mode=" + str(retry_mode)
                 LOG.info(msg)
-                LOG.info(jsonData)
+                started = True
+                self.rc_starter.add_failed_host(notification_id,
+                                                target_hostname,
+                                                cluster_port,
+                                                retry_mode,
+                                                prepared['prepared'])
+            finally:
+                if not started:
+                    # The vm_list records inserted by the preparation are
+                    # not held as in flight forever, so that they are
+                    # expired as the old records.
+                    prepare_th.join()
+                    if prepared.get('prepared') is not None:
+                        self.rc_starter.release_prepared_host(
+                            prepared['prepared'])
 
-            # Node Recovery(processing A)
-            elif jsonData.get("type") == "rscGroup" and \
-                    str(jsonData.get("eventID")) == "1" and \
-                    str(jsonData.get("eventType")) == "2" and \
-                    str(jsonData.get("detail")) == "2":
-
-                tdatetime = datetime.datetime.strptime(
-                    jsonData.get("time"), '%Y%m%d%H%M%S')
-                if not self._check_repeated_notify(tdatetime,
-                                                   jsonData.get("hostname"),
-                                                   session):
-                    recover_by = 0  # node recovery
-                    ret_dic = self.rc_util_db.insert_notification_list_db(
-                        jsonData, recover_by, session)
-                    LOG.info(jsonData)
-                else:
-                    # Duplicate notifications.
-                    msg = "Duplicate notifications. id:" + jsonData.get("id")
-                    LOG.info(msg)
-                    LOG.info(jsonData)
+        except:
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+            return
 
-            # VM Recovery(processing G)
-            elif jsonData.get("type") == 'VM' and \
-                    str(jsonData.get("eventID")) == '0' and \
-                    str(jsonData.get("eventType")) == '5' and \
-                    str(jsonData.get("detail")) == '5':
+    def _prepare_failed_host(self, notification_id, target_hostname,
+                             cluster_port, result):
+        """
+        Run rc_starter.prepare_failed_host and put its return value into
+        result['prepared']. Nothing is put if it failed.
+        """
+        try:
+            msg = "Do rc_starter.prepare_failed_host." \
+                + " notification_id=" + notification_id \
+                + " notification_hostname=" + target_hostname
+            LOG.info(msg)
+            result['prepared'] = self.rc_starter.prepare_failed_host(
+                notification_id, target_hostname, cluster_port)
+        except:
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
 
-                recover_by = 1  # VM recovery
-                ret_dic = self.rc_util_db.insert_notification_list_db(
-                    jsonData, recover_by, session)
-                LOG.info(jsonData)
+    def _force_down_host(self, notification_list_dic):
+        """
+        Force down nova-compute on the failed host if node_force_down in
+        [recover_starter] section is enabled.
+        The notification of the failed host (detail=2) does not tell whether
+        the host was powered off, e.g. hostmonitor does not check the power
+        status unless STONITH is ipmi. A host still running must not be
+        forced down, so the host is forced down only when stonith_trusted
+        states that the fencing of STONITH is confirmed.
+        :returns: True if the host was forced down
+        """
+        dic = self.rc_config.get_value('recover_starter')
+        if dic.get('node_force_down').lower() != 'true':
+            return False
+
+        target_hostname = notification_list_dic.get("notification_hostname")
+        if dic.get('stonith_trusted').lower() != 'true':
+            msg = "Do not force down " + target_hostname \
+                + " because the fencing is not confirmed by STONITH." \
+                + " Set stonith_trusted to force down the failed hosts."
+            LOG.warning(msg)
+            return False
+
+        try:
+            self.rc_util_api.force_down_host(target_hostname)
+            return True
+        except:
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+            msg = "Failed to force down " + target_hostname \
+                + ", so wait until nova recognizes the node is down."
+            LOG.warning(msg)
+            return False
+
+    def _unset_force_down_host(self, hostname):
+        """
+        Unset the forced down of nova-compute on the started host.
+        """
+        try:
+            self.rc_util_api.force_down_host(hostname, False)
+        except:
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+
+    @log_process_begin_and_end.output_log
+    def _create_notification_list_db(self, jsonData):
 
-            # Node Lock(processing D and F)
-            # Node will be locked.
-            elif (jsonData.get("type") == 'nodeStatus') or \
-                 ((jsonData.get("type") == 'rscGroup' and
-                   str(jsonData.get("eventID")) == '1' and
-                   str(jsonData.get("eventType")) == '2') and
-                  (str(jsonData.get("detail")) == '3' or
-                   str(jsonData.get("detail")) == '4')):
-
-                tdatetime = datetime.datetime.strptime(
-                    jsonData.get("time"), '%Y%m%d%H%M%S')
-                if not self._check_repeated_notify(tdatetime,
-                                                   jsonData.get("hostname"),
-                                                   session):
-
-                    recover_by = 2  # NODE lock
+        ret_dic = {}
+
+        # Get DB from here and pass it to _check_retry_notification
+        try:
+            # Get session for db
+            with dbapi.session_scope(self.rc_config) as session:
+                recover_by = self._get_recover_by(jsonData, session)
+                if recover_by is not None:
                     ret_dic = self.rc_util_db.insert_notification_list_db(
                         jsonData, recover_by, session)
+                    self.notification_id_cache.add(
+                        jsonData.get("id"), self._get_notification_time(
+                            jsonData))
+                    self._add_notification_time_index(jsonData)
                     LOG.info(jsonData)
-                else:
-                    # Duplicate notifications.
-                    msg = "Duplicate notifications. id:" + jsonData.get("id")
-                    LOG.info(msg)
-                    LOG.info(jsonData)
+        except Exception:
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+            raise
 
-            # Do not recover(Excuted Stop API)
-            elif jsonData.get("type") == "VM" and \
-                    str(jsonData.get("eventID")) == "0" and \
-                    str(jsonData.get("eventType")) == "5" and \
-                    str(jsonData.get("detail")) == "1":
-                LOG.info(jsonData)
-                msg = "Do not recover instance.(Excuted Stop API)"
-                LOG.info(msg)
+        return ret_dic
 
-            # Notification of starting node.
-            elif jsonData.get("type") == "rscGroup" and \
-                    str(jsonData.get("eventID")) == "1" and \
-                    str(jsonData.get("eventType")) == "1" and \
-                    str(jsonData.get("detail")) == "1":
-                LOG.info(jsonData)
-                msg = "Recieved notification of node starting. Node:" + \
-                      jsonData['hostname']
-                LOG.info(msg)
+    @log_process_begin_and_end.output_log
+    def _create_notification_list_db_bulk(self, json_list,
+                                          controle_ips=None):
+        """
+        Insert a batch of notifications into notification_list DB.
+        :param json_list: The notifications in the batch
+        :param controle_ips: The dictionary of the hostnames already
+         resolved and their addresses
+        :returns: The information that was registered to notification_list
+         table in the dictionary type for each notification, or {} if the
+         notification was not registered.
+        """
 
-            # Ignore notification
-            else:
-                LOG.info(jsonData)
-                msg = "Ignore notification. Notification:" + str(jsonData)
-                LOG.info(msg)
+        ret_list = [{}] * len(json_list)
+
+        try:
+            # Get session for db
+            with dbapi.session_scope(self.rc_config) as session:
+
+                # The notifications in the same batch are not in DB yet,
+                # so the duplicates among them are checked here.
+                batch_ids = set()
+                batch_times = {}
+                notifications = []
+                indexes = []
+                for i, jsonData in enumerate(json_list):
+                    if jsonData.get("id") in batch_ids:
+                        msg = "Duplicate notifications. id:" + \
+                            jsonData.get("id")
+                        LOG.info(msg)
+                        LOG.info(jsonData)
+                        continue
+
+                    recover_by = self._get_recover_by(
+                        jsonData, session,
+                        batch_times.get(jsonData.get("hostname"), []))
+                    if recover_by is None:
+                        continue
+
+                    batch_ids.add(jsonData.get("id"))
+                    if jsonData.get("type") == "rscGroup":
+                        batch_times.setdefault(jsonData.get("hostname"), []).\
+                            append(self._get_notification_time(jsonData))
+                    notifications.append((jsonData, recover_by))
+                    indexes.append(i)
+
+                result = self.rc_util_db.insert_notification_list_db_bulk(
+                    notifications, session, controle_ips)
+                for i, ret_dic in zip(indexes, result):
+                    ret_list[i] = ret_dic
+                    self.notification_id_cache.add(
+                        json_list[i].get("id"), self._get_notification_time(
+                            json_list[i]))
+                    self._add_notification_time_index(json_list[i])
+                    LOG.info(json_list[i])
         except Exception:
             error_type, error_value, traceback_ = sys.exc_info()
             tb_list = traceback.format_tb(traceback_)
@@ -757,56 +1060,188 @@ class RecoveryController(object):
                 LOG.error(tb)
             raise
 
-        return ret_dic
+        return ret_list
+
+    def _get_notification_time(self, jsonData):
+        return datetime.datetime.strptime(jsonData.get("time"),
+                                          '%Y%m%d%H%M%S')
+
+    def _add_notification_time_index(self, jsonData):
+        if jsonData.get("type") == "rscGroup":
+            self.notification_time_index.add(
+                jsonData.get("hostname"),
+                self._get_notification_time(jsonData))
+
+    @log_process_begin_and_end.output_log
+    def _get_recover_by(self, jsonData, session, pending_times=None):
+        """
+        Decide how to recover from the notification.
+        :param jsonData: The notification
+        :param session: session object
+        :param pending_times: notification_time of the rscGroup notifications
+         for the same host which are not in DB yet
+        :returns: node recover(0)/VM recover(1)/process error(2), or None if
+         the notification is a duplicate or is ignored
+        """
+
+        recover_by = None
+
+        if self._check_retry_notification(jsonData, session):
+            msg = "Duplicate notifications. id:" + jsonData.get("id")
+            LOG.info(msg)
+            LOG.info(jsonData)
+
+        # Node Recovery(processing A)
+        elif jsonData.get("type") == "rscGroup" and \
+                str(jsonData.get("eventID")) == "1" and \
+                str(jsonData.get("eventType")) == "2" and \
+                str(jsonData.get("detail")) == "2":
+
+            tdatetime = datetime.datetime.strptime(
+                jsonData.get("time"), '%Y%m%d%H%M%S')
+            if not self._check_repeated_notify(tdatetime,
+                                               jsonData.get("hostname"),
+                                               session,
+                                               pending_times):
+                recover_by = 0  # node recovery
+            else:
+                # Duplicate notifications.
+                msg = "Duplicate notifications. id:" + jsonData.get("id")
+                LOG.info(msg)
+                LOG.info(jsonData)
+
+        # VM Recovery(processing G)
+        elif jsonData.get("type") == 'VM' and \
+                str(jsonData.get("eventID")) == '0' and \
+                str(jsonData.get("eventType")) == '5' and \
+                str(jsonData.get("detail")) == '5':
+
+            recover_by = 1  # VM recovery
+
+        # Node Lock(processing D and F)
+        # Node will be locked.
+        elif (jsonData.get("type") == 'nodeStatus') or \
+             ((jsonData.get("type") == 'rscGroup' and
+               str(jsonData.get("eventID")) == '1' and
+               str(jsonData.get("eventType")) == '2') and
+              (str(jsonData.get("detail")) == '3' or
+               str(jsonData.get("detail")) == '4')):
+
+            tdatetime = datetime.datetime.strptime(
+                jsonData.get("time"), '%Y%m%d%H%M%S')
+            if not self._check_repeated_notify(tdatetime,
+                                               jsonData.get("hostname"),
+                                               session,
+                                               pending_times):
+
+                recover_by = 2  # NODE lock
+            else:
+                # Duplicate notifications.
+                msg = "Duplicate notifications. id:" + jsonData.get("id")
+                LOG.info(msg)
+                LOG.info(jsonData)
+
+        # Do not recover(Excuted Stop API)
+        elif jsonData.get("type") == "VM" and \
+                str(jsonData.get("eventID")) == "0" and \
+                str(jsonData.get("eventType")) == "5" and \
+                str(jsonData.get("detail")) == "1":
+            LOG.info(jsonData)
+            msg = "Do not recover instance.(Excuted Stop API)"
+            LOG.info(msg)
+
+        # Notification of starting node.
+        elif jsonData.get("type") == "rscGroup" and \
+                str(jsonData.get("eventID")) == "1" and \
+                str(jsonData.get("eventType")) == "1" and \
+                str(jsonData.get("detail")) == "1":
+            LOG.info(jsonData)
+            msg = "Recieved notification of node starting. Node:" + \
+                  jsonData['hostname']
+            LOG.info(msg)
+
+            dic = self.rc_config.get_value('recover_starter')
+            if dic.get('node_force_down').lower() == 'true':
+                th = threading.Thread(
+                    target=self._unset_force_down_host,
+                    name='Thread:unset_force_down(%s)' % jsonData['hostname'],
+                    args=(jsonData['hostname'], ))
+                th.start()
+
+        # Ignore notification
+        else:
+            LOG.info(jsonData)
+            msg = "Ignore notification. Notification:" + str(jsonData)
+            LOG.info(msg)
+
+        return recover_by
 
     @log_process_begin_and_end.output_log
     def _check_retry_notification(self, jsonData, session):
 
         notification_id = jsonData.get("id")
-        msg = "Do get_all_notification_list_by_notification_id."
+
+        # Only the ids the cache can not decide are looked up in DB.
+        notification_time = self._get_notification_time(jsonData)
+        result = self.notification_id_cache.lookup(notification_id,
+                                                   notification_time)
+        if result == cache.FOUND:
+            return 1
+        elif result == cache.NOT_FOUND:
+            return 0
+
+        msg = "Do exists_notification_list_by_notification_id."
         LOG.info(msg)
-        cnt = dbapi.get_all_notification_list_by_notification_id(
+        exists = dbapi.exists_notification_list_by_notification_id(
             session, notification_id)
-        msg = "Succeeded in get_all_notification_list_by_notification_id. " \
-            + "Return_value = " + str(cnt)
+        msg = "Succeeded in exists_notification_list_by_notification_id. " \
+            + "Return_value = " + str(exists)
         LOG.info(msg)
-        # if cnt is 0, not duplicate notification.
-        if not cnt:
+        # if not exists, not duplicate notification.
+        if not exists:
             return 0
         else:
+            self.notification_id_cache.add(notification_id,
+                                           notification_time)
             return 1
 
     @log_process_begin_and_end.output_log
     def _check_repeated_notify(self, notification_time,
-                               notification_hostname, session):
-
-        msg = "Do get_all_notification_list_by_hostname_type."
-        LOG.info(msg)
-        result = dbapi.get_all_notification_list_by_hostname_type(
-            session, notification_hostname)
-        msg = "Succeeded in get_all_notification_list_by_hostname_type. " \
-            + "Return_value = " + str(result)
-
-        # if cnt is 0, not duplicate notification.
-        if not result:
-            return 0
-
-        # result = cursor.fetchall()
+                               notification_hostname, session,
+                               pending_times=None):
 
         conf_recover_starter_dic = self.rc_config.get_value('recover_starter')
         notification_time_difference = conf_recover_starter_dic.get(
             "notification_time_difference")
 
-        # Compare timestamp in db and timestamp in notification
-        flg = 0
-        for row in result:
-            db_time = row.notification_time
-            delta = notification_time - db_time
-            if long(delta.total_seconds()) <= long(
-                    notification_time_difference):
-                flg = 1
+        # The notification is duplicate if the host has a notification at
+        # or after this time.
+        since = notification_time - datetime.timedelta(
+            seconds=long(notification_time_difference))
+
+        if pending_times and max(pending_times) >= since:
+            return 1
+
+        exists = self.notification_time_index.exists_since(
+            notification_hostname, since)
+        if exists is not None:
+            return int(exists)
+
+        msg = "Do get_notification_times_by_hostname_type_since."
+        LOG.info(msg)
+        db_times = dbapi.get_notification_times_by_hostname_type_since(
+            session, notification_hostname, since)
+        msg = "Succeeded in get_notification_times_by_hostname_type_since. " \
+            + "Return_value = " + str(db_times)
+        LOG.info(msg)
+        self.notification_time_index.load(notification_hostname, since,
+                                          db_times)
+
+        # if db_times is empty, not duplicate notification.
+        if not db_times:
+            return 0
 
-        return flg
+        return 1
 
 
 def main():
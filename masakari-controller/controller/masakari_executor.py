@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This file defines the RecoveryControllerExecutor class.
+"""
+
+import Queue
+import sys
+import threading
+import time
+import traceback
+import types
+from contextlib import contextmanager
+
+import masakari_governor as governor
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+# The factor the concurrency limit is multiplied by on the congestion
+_DECREASE_FACTOR = 0.5
+
+
+class Wait(object):
+
+    """
+    Wait class:
+    A recovery job written as a generator yields it to wait for an event
+    without holding a worker thread. func is called with args and a
+    callback, and has to call the callback once with the result of the
+    event, which is sent back to the job.
+    """
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+
+class Return(Exception):
+
+    """
+    Return class:
+    A recovery job written as a generator raises it to return the value to
+    the job which yielded it, as a generator can not return a value.
+    """
+
+    def __init__(self, value=None):
+        super(Return, self).__init__(value)
+        self.value = value
+
+
+class RecoveryControllerExecutor(object):
+
+    """
+    RecoveryControllerExecutor class:
+    This class runs the recovery jobs with a limited number of slots.
+    The jobs wait in a queue until a slot becomes free. A job can be a
+    generator, which yields a Wait to give its slot and worker thread back
+    until the event, and is queued again with the result of the event. It
+    can also yield another generator to run it and get its Return value.
+    So the number of the worker threads does not grow with the waiting
+    jobs, and is at most the number of the slots.
+    If the adaptive concurrency is enabled, the number of the slots is
+    adjusted with additive increase and multiplicative decrease, by the
+    latency and the errors of nova API measured in measuring().
+    """
+
+    def __init__(self, worker_cnt, min_cnt=None, max_cnt=None,
+                 latency_target=None):
+        """
+        Constructor:
+        This constructor starts the worker threads.
+        :param worker_cnt: The number of the slots, that is the number of the
+         recovery jobs running at the same time.
+        :param min_cnt: The floor of the adaptive number of the slots
+        :param max_cnt: The ceiling of the adaptive number of the slots.
+         None disables the adaptive concurrency.
+        :param latency_target: The seconds of nova API latency above which
+         nova is regarded as congested
+        """
+        self.worker_cnt = worker_cnt
+        self.adaptive = max_cnt is not None
+        self.min_cnt = min_cnt or 1
+        self.max_cnt = max_cnt or worker_cnt
+        self.latency_target = latency_target
+        self._limit = worker_cnt
+        self._success_cnt = 0
+        self._slot_holder_cnt = 0
+        self._decreased_at = 0.0
+        self._increase_cnt = 0
+        self._decrease_cnt = 0
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._slot_cond = threading.Condition(self._lock)
+        self._busy_cnt = 0
+        self._waiting_cnt = 0
+        self._thread_cnt = worker_cnt
+        self._submitted_cnt = 0
+        self._completed_cnt = 0
+
+        for i in range(worker_cnt):
+            self._start_thread('Thread:recovery_worker(%d)' % i)
+
+    def _start_thread(self, name):
+        th = threading.Thread(target=self._run, name=name)
+        th.daemon = True
+        th.start()
+
+    def _acquire_slot(self):
+        with self._lock:
+            while self._slot_holder_cnt >= self._limit:
+                self._slot_cond.wait()
+            self._slot_holder_cnt += 1
+
+    def _release_slot(self):
+        with self._lock:
+            self._slot_holder_cnt -= 1
+            self._slot_cond.notify()
+
+    def submit(self, job_name, func, *args):
+        """
+        Put the recovery job into the queue.
+        :param job_name: The name of the job. The worker thread is renamed to
+         it while running the job.
+        :param func: The function to run
+        :param args: The arguments of the function
+        """
+        with self._lock:
+            self._submitted_cnt += 1
+        self._queue.put((job_name, func, args, None))
+
+        msg = "Submitted %s to the recovery executor. queue_depth=%d" % (
+            job_name, self._queue.qsize())
+        LOG.info(msg)
+
+    @contextmanager
+    def measuring(self, api_name):
+        """
+        Measure the latency and the error of the nova API called in the
+        context, and adjust the number of the slots by them.
+        The latency is that of the novaclient calls only, without the waits
+        of the governor for the rate limit and the retries.
+        It does nothing when the adaptive concurrency is not enabled.
+        :param api_name: The name of the API for the log
+        """
+        if not self.adaptive:
+            yield
+            return
+
+        latencies = []
+        started_at = time.time()
+        try:
+            with governor.observing(latencies.append):
+                yield
+        except Exception as e:
+            if governor.is_overload_error(e):
+                self._decrease(api_name, started_at, 'error %s' % e)
+            raise
+
+        if not latencies:
+            return
+        latency = max(latencies)
+        if latency > self.latency_target:
+            self._decrease(api_name, started_at,
+                           'latency %.1f sec' % latency)
+        else:
+            self._increase()
+
+    def _increase(self):
+        with self._lock:
+            if self._limit >= self.max_cnt:
+                return
+            # One slot is added after as many successes as the slots.
+            self._success_cnt += 1
+            if self._success_cnt < self._limit:
+                return
+            self._success_cnt = 0
+            self._limit += 1
+            self._increase_cnt += 1
+            self._slot_cond.notify()
+            # Start a worker thread for the new slot, if the slots are
+            # more than the worker threads.
+            start = self._thread_cnt < self._limit
+            if start:
+                name = 'Thread:recovery_worker(%d)' % self._thread_cnt
+                self._thread_cnt += 1
+        if start:
+            self._start_thread(name)
+
+    def _decrease(self, api_name, started_at, reason):
+        with self._lock:
+            # The calls started before the last decrease saw the old limit,
+            # so the limit is decreased once for them.
+            if started_at < self._decreased_at or \
+                    self._limit <= self.min_cnt:
+                return
+            self._limit = max(self.min_cnt,
+                              int(self._limit * _DECREASE_FACTOR))
+            self._success_cnt = 0
+            self._decreased_at = time.time()
+            self._decrease_cnt += 1
+            limit = self._limit
+
+        msg = ("Decreased the recovery concurrency to %d by %s of %s."
+               % (limit, reason, api_name))
+        LOG.warning(msg)
+
+    def _resume(self, job_name, stack, result):
+        with self._lock:
+            self._waiting_cnt -= 1
+        self._queue.put((job_name, None, None, (stack, result)))
+
+    def _step(self, job_name, stack, value):
+        """
+        Run the generator job until it waits or ends.
+        :param stack: The generators of the job, the innermost last
+        :param value: The value sent to the innermost generator
+        :returns: True if the job waits, False if it ended
+        """
+        error = None
+        while stack:
+            try:
+                if error is not None:
+                    yielded = stack[-1].throw(*error)
+                else:
+                    yielded = stack[-1].send(value)
+            except StopIteration:
+                stack.pop()
+                value, error = None, None
+                continue
+            except Return as e:
+                stack.pop()
+                value, error = e.value, None
+                continue
+            except:
+                stack.pop()
+                value, error = None, sys.exc_info()
+                continue
+
+            value, error = None, None
+            if isinstance(yielded, types.GeneratorType):
+                stack.append(yielded)
+                continue
+            if not isinstance(yielded, Wait):
+                error = (TypeError, TypeError(
+                    '%s yielded %r' % (job_name, yielded)), None)
+                continue
+
+            with self._lock:
+                self._waiting_cnt += 1
+            callback = (lambda result:
+                        self._resume(job_name, stack, result))
+            try:
+                yielded.func(*(yielded.args + (callback, )))
+            except:
+                with self._lock:
+                    self._waiting_cnt -= 1
+                error = sys.exc_info()
+                continue
+            return True
+
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return False
+
+    def _run(self):
+        current_thread = threading.current_thread()
+        worker_name = current_thread.name
+
+        while True:
+            job_name, func, args, resumed = self._queue.get()
+
+            self._acquire_slot()
+            with self._lock:
+                self._busy_cnt += 1
+            current_thread.name = job_name
+            waits = False
+            try:
+                if resumed is not None:
+                    waits = self._step(job_name, *resumed)
+                else:
+                    job = func(*args)
+                    if isinstance(job, types.GeneratorType):
+                        waits = self._step(job_name, [job], None)
+            except:
+                error_type, error_value, traceback_ = sys.exc_info()
+                tb_list = traceback.format_tb(traceback_)
+                LOG.error(error_type)
+                LOG.error(error_value)
+                for tb in tb_list:
+                    LOG.error(tb)
+            finally:
+                current_thread.name = worker_name
+                self._release_slot()
+                with self._lock:
+                    self._busy_cnt -= 1
+                    if not waits:
+                        self._completed_cnt += 1
+                self._queue.task_done()
+
+    def get_stats(self):
+        """
+        Return the statistics of the executor in the dictionary type.
+        """
+        with self._lock:
+            busy_cnt = self._busy_cnt
+            waiting_cnt = self._waiting_cnt
+            thread_cnt = self._thread_cnt
+            submitted_cnt = self._submitted_cnt
+            completed_cnt = self._completed_cnt
+            limit = self._limit
+            increase_cnt = self._increase_cnt
+            decrease_cnt = self._decrease_cnt
+
+        return {
+            'worker_cnt': self.worker_cnt,
+            'concurrency_limit': limit,
+            'concurrency_increase_cnt': increase_cnt,
+            'concurrency_decrease_cnt': decrease_cnt,
+            'thread_cnt': thread_cnt,
+            'busy_cnt': busy_cnt,
+            'waiting_cnt': waiting_cnt,
+            'utilization': float(busy_cnt) / limit,
+            'queue_depth': self._queue.qsize(),
+            'submitted_cnt': submitted_cnt,
+            'completed_cnt': completed_cnt,
+        }
+
+
+def get_max_slot_cnt(config_object):
+    """
+    Return the maximum number of the recovery jobs calling nova at the same
+    time, i.e. adaptive_concurrency_max if adaptive_concurrency is enabled,
+    or else semaphore_multiplicity in [recover_starter] section.
+    """
+    conf_dict = config_object.get_value('recover_starter')
+    worker_cnt = int(conf_dict.get('semaphore_multiplicity'))
+    if conf_dict.get('adaptive_concurrency', 'false').lower() == 'true':
+        return int(conf_dict.get('adaptive_concurrency_max'))
+    return worker_cnt
+
+
+def get_executor(config_object):
+    """
+    Return the recovery executor shared in the process.
+    The number of the worker threads is semaphore_multiplicity in
+    [recover_starter] section. If adaptive_concurrency is enabled, the
+    number of the slots is adjusted between adaptive_concurrency_min and
+    adaptive_concurrency_max.
+    """
+    global _EXECUTOR
+
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            conf_dict = config_object.get_value('recover_starter')
+            worker_cnt = int(conf_dict.get('semaphore_multiplicity'))
+            if conf_dict.get('adaptive_concurrency',
+                             'false').lower() == 'true':
+                min_cnt = int(conf_dict.get('adaptive_concurrency_min'))
+                max_cnt = int(conf_dict.get('adaptive_concurrency_max'))
+                worker_cnt = min(max(worker_cnt, min_cnt), max_cnt)
+                _EXECUTOR = RecoveryControllerExecutor(
+                    worker_cnt, min_cnt, max_cnt,
+                    float(conf_dict.get('adaptive_latency_target')))
+            else:
+                _EXECUTOR = RecoveryControllerExecutor(worker_cnt)
+
+    return _EXECUTOR
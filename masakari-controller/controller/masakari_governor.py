@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This file defines the NovaApiGovernor class.
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from keystoneauth1 import exceptions as ks_exceptions
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# The HTTP status codes meaning nova-api rejected the request because it is
+# overloaded or being restarted.
+REJECTED_STATUS_CODES = (429, 503)
+
+# The first backoff of a retry
+_BACKOFF_BASE_SEC = 0.5
+
+# The observer of the novaclient calls in each thread
+_LOCAL = threading.local()
+
+
+def _status_code(error):
+    # novaclient sets code, and keystoneauth sets http_status.
+    code = getattr(error, 'code', None)
+    if code is None:
+        code = getattr(error, 'http_status', None)
+    return code
+
+
+def is_overload_error(error):
+    """
+    Return True if the error shows nova-api or the services behind it are
+    overloaded, e.g. 429, 5xx or the connection failure.
+    """
+    if isinstance(error, ks_exceptions.ConnectionError):
+        return True
+    code = _status_code(error)
+    return isinstance(code, int) and (code == 429 or code >= 500)
+
+
+@contextmanager
+def observing(observer):
+    """
+    Call observer with the seconds of each novaclient call made through
+    NovaApiGovernor.call in this thread while in the context. The waits for
+    the rate limit and the backoff of the retries are not included.
+    :param observer: The function called with the seconds
+    """
+    previous = getattr(_LOCAL, 'observer', None)
+    _LOCAL.observer = observer
+    try:
+        yield
+    finally:
+        _LOCAL.observer = previous
+
+
+def _observe(seconds):
+    observer = getattr(_LOCAL, 'observer', None)
+    if observer:
+        observer(seconds)
+
+
+def is_retryable_error(error, idempotent):
+    """
+    Return True if the call failed with the error can be retried.
+    The request rejected by nova-api (429 or 503) is always retried. The
+    idempotent one is also retried on the other 5xx errors and the
+    connection failures, including the transient ones of keystone, with
+    which the request may have been processed.
+    """
+    if _status_code(error) in REJECTED_STATUS_CODES:
+        return True
+    return idempotent and is_overload_error(error)
+
+
+class TokenBucket(object):
+
+    """
+    TokenBucket class:
+    The requests take a token each, and the tokens are added at a fixed
+    rate up to the burst.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        Constructor:
+        :param rate: The tokens added per second. 0 means no limit.
+        :param burst: The maximum number of the tokens
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.time()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting until one is added.
+        :returns: The seconds waited
+        """
+        if not self.rate:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = max(self._paused_until - now,
+                           (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """
+        Do not give tokens for the seconds, e.g. as nova asked with
+        Retry-After.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until,
+                                     time.time() + seconds)
+
+
+class NovaApiGovernor(object):
+
+    """
+    NovaApiGovernor class:
+    All the calls of nova API go through this class. The calls are limited
+    by a token bucket, and the calls failed because nova-api is overloaded
+    are retried with exponential backoff and full jitter, as long as the
+    retry budget is left.
+    """
+
+    def __init__(self, rate, burst, max_retry_cnt, max_backoff_sec,
+                 retry_budget_ratio):
+        """
+        Constructor:
+        :param rate: The calls per second. 0 means no limit.
+        :param burst: The calls which can be made at once
+        :param max_retry_cnt: The retries of a call
+        :param max_backoff_sec: The cap of the backoff of a retry
+        :param retry_budget_ratio: The retries allowed per call in the
+         process, e.g. 0.2 allows one retry for five calls
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retry_cnt = max_retry_cnt
+        self.max_backoff_sec = max_backoff_sec
+        self.retry_budget_ratio = retry_budget_ratio
+        # Some retries are allowed before any call succeeds.
+        self._budget_cap = max(1.0, retry_budget_ratio * 100)
+        self._budget = self._budget_cap
+        self._lock = threading.Lock()
+        self._stats = {'call_cnt': 0, 'retry_cnt': 0, 'throttled_cnt': 0,
+                       'budget_exhausted_cnt': 0, 'rate_wait_sec': 0.0}
+
+    def _take_budget(self):
+        with self._lock:
+            if self._budget < 1:
+                self._stats['budget_exhausted_cnt'] += 1
+                return False
+            self._budget -= 1
+            self._stats['retry_cnt'] += 1
+            return True
+
+    def call(self, name, func, args=(), kwargs=None, idempotent=True):
+        """
+        Call the nova API.
+        :param name: The name of the API for the log
+        :param func: The function of novaclient
+        :param args: The positional arguments of the function
+        :param kwargs: The keyword arguments of the function
+        :param idempotent: False not to retry on the errors other than 429
+         and 503, with which the request may have been processed
+        :returns: The return value of the function
+        """
+        with self._lock:
+            self._stats['call_cnt'] += 1
+            self._budget = min(self._budget_cap,
+                               self._budget + self.retry_budget_ratio)
+
+        retry_cnt = 0
+        while True:
+            waited = self.bucket.acquire()
+            if waited:
+                with self._lock:
+                    self._stats['rate_wait_sec'] += waited
+            try:
+                started_at = time.time()
+                try:
+                    return func(*args, **(kwargs or {}))
+                finally:
+                    _observe(time.time() - started_at)
+            except Exception as e:
+                if not is_retryable_error(e, idempotent):
+                    raise
+                with self._lock:
+                    self._stats['throttled_cnt'] += 1
+
+                retry_after = getattr(e, 'retry_after', 0) or 0
+                if retry_after:
+                    self.bucket.pause(retry_after)
+
+                if retry_cnt >= self.max_retry_cnt or \
+                        not self._take_budget():
+                    raise
+
+                backoff = min(self.max_backoff_sec,
+                              _BACKOFF_BASE_SEC * 2 ** retry_cnt)
+                wait = max(retry_after, random.uniform(0, backoff))
+                msg = ("%s failed with %s. Retry in %.1f sec."
+                       % (name, _status_code(e) or type(e).__name__, wait))
+                LOG.warning(msg)
+                time.sleep(wait)
+                retry_cnt += 1
+
+    def get_stats(self):
+        """
+        Return the statistics of the governor in the dictionary type.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['retry_budget'] = self._budget
+
+        return stats
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This file defines the InventorySnapshot class.
+"""
+
+import datetime
+import sys
+import threading
+import time
+import traceback
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+_INVENTORY = None
+_INVENTORY_LOCK = threading.Lock()
+
+# The seconds the servers are listed back from the previous listing, to
+# allow the clock difference from nova.
+_CHANGES_SINCE_SLACK_SEC = 60
+
+
+class InventoryServer(object):
+
+    """
+    InventoryServer class:
+    The part of a server detail which the recovery needs. It has the same
+    attributes as the server of novaclient for them.
+    """
+
+    def __init__(self, server):
+        self.id = server.id
+        self.host = getattr(server, 'OS-EXT-SRV-ATTR:host', None)
+        setattr(self, 'OS-EXT-STS:vm_state',
+                getattr(server, 'OS-EXT-STS:vm_state', None))
+        self.task_state = getattr(server, 'OS-EXT-STS:task_state', None)
+        self.metadata = {}
+        ha_enabled = (server.metadata or {}).get('HA-Enabled')
+        if ha_enabled is not None:
+            self.metadata['HA-Enabled'] = ha_enabled
+        self.flavor = {'id': (server.flavor or {}).get('id')}
+
+    @property
+    def verified(self):
+        """False if the server is changing, and has to be read again."""
+        return self.task_state is None
+
+
+class InventorySnapshot(object):
+
+    """
+    InventorySnapshot class:
+    This class keeps the servers of each host with one thread. All the
+    servers are listed at first, then the servers changed since the previous
+    listing are listed every interval.
+    """
+
+    def __init__(self, rc_util_api, interval):
+        """
+        Constructor:
+        This constructor starts the refreshing thread.
+        :param rc_util_api: RecoveryControllerUtilApi object
+        :param interval: The seconds between the listings
+        """
+        self.rc_util_api = rc_util_api
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._servers = {}
+        self._hosts = {}
+        self._refreshed_at = None
+        self._stats = {'refresh_cnt': 0, 'error_cnt': 0, 'hit_cnt': 0,
+                       'miss_cnt': 0}
+
+        th = threading.Thread(target=self._run,
+                              name='Thread:inventory_snapshot')
+        th.daemon = True
+        th.start()
+
+    def _run(self):
+        since = None
+        while True:
+            started_at = datetime.datetime.utcnow()
+            try:
+                if since is None:
+                    servers = self.rc_util_api.fetch_all_servers()
+                else:
+                    servers = self.rc_util_api.fetch_servers_changed_since(
+                        since)
+                self._update(servers, since is None)
+                since = started_at - datetime.timedelta(
+                    seconds=_CHANGES_SINCE_SLACK_SEC)
+            except Exception:
+                with self._lock:
+                    self._stats['error_cnt'] += 1
+                error_type, error_value, traceback_ = sys.exc_info()
+                tb_list = traceback.format_tb(traceback_)
+                LOG.error(error_type)
+                LOG.error(error_value)
+                for tb in tb_list:
+                    LOG.error(tb)
+
+            time.sleep(self.interval)
+
+    def _remove(self, uuid):
+        entry = self._servers.pop(uuid, None)
+        if entry is not None:
+            uuids = self._hosts.get(entry.host)
+            uuids.discard(uuid)
+            if not uuids:
+                del self._hosts[entry.host]
+
+    def _update(self, servers, full):
+        with self._lock:
+            if full:
+                self._servers = {}
+                self._hosts = {}
+            for server in servers:
+                self._remove(server.id)
+                if getattr(server, 'status', None) == 'DELETED':
+                    continue
+                entry = InventoryServer(server)
+                self._servers[entry.id] = entry
+                self._hosts.setdefault(entry.host, set()).add(entry.id)
+            self._refreshed_at = time.time()
+            self._stats['refresh_cnt'] += 1
+
+    def get_servers_on_host(self, hostname):
+        """
+        Return the servers on the host.
+        :returns: The list of InventoryServer, or None if the snapshot is
+         not refreshed in the last two intervals
+        """
+        with self._lock:
+            if self._refreshed_at is None or \
+                    time.time() - self._refreshed_at > 2 * self.interval:
+                self._stats['miss_cnt'] += 1
+                return None
+            self._stats['hit_cnt'] += 1
+            return [self._servers[uuid]
+                    for uuid in sorted(self._hosts.get(hostname, ()))]
+
+    def get_stats(self):
+        """
+        Return the statistics of the snapshot in the dictionary type.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['server_cnt'] = len(self._servers)
+            stats['host_cnt'] = len(self._hosts)
+            if self._refreshed_at is None:
+                stats['age_sec'] = None
+            else:
+                stats['age_sec'] = time.time() - self._refreshed_at
+
+        return stats
+
+
+def get_inventory(config_object, rc_util_api):
+    """
+    Return the inventory snapshot shared in the process, or None if
+    inventory_snapshot in [recover_starter] section is not enabled.
+    """
+    global _INVENTORY
+
+    conf_dict = config_object.get_value('recover_starter')
+    if conf_dict.get('inventory_snapshot', 'false').lower() != 'true':
+        return None
+
+    with _INVENTORY_LOCK:
+        if _INVENTORY is None:
+            _INVENTORY = InventorySnapshot(
+                rc_util_api,
+                int(conf_dict.get('inventory_refresh_interval')))
+
+    return _INVENTORY
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This file defines the RecoveryControllerJournal class.
+"""
+
+import os
+import sys
+import threading
+import traceback
+
+parentdir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                         os.path.pardir))
+if parentdir not in sys.path:
+    sys.path = [parentdir] + sys.path
+
+import db.api as dbapi
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+_JOURNAL = None
+_JOURNAL_LOCK = threading.Lock()
+
+
+class RecoveryControllerJournal(object):
+
+    """
+    RecoveryControllerJournal class:
+    This class buffers the updates of vm_list table and writes them in
+    batches with one flusher thread. The updates of the same record are
+    merged until they are written.
+    """
+
+    def __init__(self, config_object, flush_interval):
+        """
+        Constructor:
+        This constructor starts the flusher thread.
+        :param config_object: RecoveryControllerConfig object
+        :param flush_interval: The seconds between the flushes
+        """
+        self.rc_config = config_object
+        self.flush_interval = flush_interval
+        self._cond = threading.Condition()
+        self._pending = {}
+        # The generation of the flush which writes the pending updates
+        self._generation = 0
+        self._flushed_generation = 0
+        self._errors = {}
+        self._stopped = False
+        self._stats = {'put_cnt': 0, 'coalesced_cnt': 0, 'flush_cnt': 0,
+                       'written_cnt': 0, 'error_cnt': 0}
+
+        self._thread = threading.Thread(target=self._run,
+                                        name='Thread:progress_journal')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, primary_id, update_val, durable=False):
+        """
+        Put the update of vm_list record.
+        :param primary_id: The id of vm_list record
+        :param update_val: The dictionary of the columns to be updated
+        :param durable: If True, wait until the update is written
+        """
+        with self._cond:
+            self._stats['put_cnt'] += 1
+            if primary_id in self._pending:
+                self._stats['coalesced_cnt'] += 1
+                self._pending[primary_id].update(update_val)
+            else:
+                self._pending[primary_id] = dict(update_val)
+
+            if not durable:
+                return
+
+            generation = self._generation
+            while self._flushed_generation <= generation:
+                self._cond.wait()
+            error = self._errors.get(generation)
+
+        if error is not None:
+            raise error
+
+    def stop(self):
+        """
+        Flush the pending updates once more and stop the flusher thread.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            with self._cond:
+                if not self._stopped:
+                    self._cond.wait(self.flush_interval)
+                stopped = self._stopped
+                pending = self._pending
+                self._pending = {}
+                generation = self._generation
+                self._generation += 1
+
+            error = None
+            if pending:
+                error = self._flush(pending)
+
+            with self._cond:
+                if error is not None:
+                    # Keep the updates which were not written, under the
+                    # newer updates of the same records.
+                    for primary_id, update_val in pending.items():
+                        update_val.update(self._pending.get(primary_id, {}))
+                        self._pending[primary_id] = update_val
+                    self._errors[generation] = error
+                # Keep the errors long enough for the waiters to read them
+                self._errors.pop(generation - 100, None)
+                self._flushed_generation = generation + 1
+                self._cond.notify_all()
+
+    def _flush(self, pending):
+        try:
+            with dbapi.session_scope(self.rc_config) as session:
+                cnt = dbapi.update_vm_list_by_id_dicts(session, pending)
+            with self._cond:
+                self._stats['flush_cnt'] += 1
+                self._stats['written_cnt'] += len(pending)
+
+            msg = "Flushed the progress journal. record_cnt=%d, " \
+                "updated_cnt=%d" % (len(pending), cnt)
+            LOG.info(msg)
+            return None
+        except Exception as e:
+            with self._cond:
+                self._stats['error_cnt'] += 1
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+            return e
+
+    def get_stats(self):
+        """
+        Return the statistics of the journal in the dictionary type.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending_cnt'] = len(self._pending)
+
+        return stats
+
+
+def get_journal(config_object):
+    """
+    Return the progress journal shared in the process, or None if
+    progress_journal in [db] section is not enabled.
+    """
+    global _JOURNAL
+
+    conf_dict = config_object.get_value('db')
+    if conf_dict.get('progress_journal', 'false').lower() != 'true':
+        return None
+
+    with _JOURNAL_LOCK:
+        if _JOURNAL is None:
+            _JOURNAL = RecoveryControllerJournal(
+                config_object,
+                float(conf_dict.get('progress_journal_flush_interval')))
+
+    return _JOURNAL
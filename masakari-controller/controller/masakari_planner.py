@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Placement of the VMs of a failed host onto reserve hosts.
+The resources are given as tuples of the same length, e.g.
+(vcpus, memory_mb).
+"""
+
+
+def _size(demand, totals):
+    # The largest share of the resources that the VM needs
+    size = 0.0
+    for d, t in zip(demand, totals):
+        if d <= 0:
+            continue
+        if t <= 0:
+            return float('inf')
+        size = max(size, float(d) / t)
+    return size
+
+
+def plan_first_fit_decreasing(vms, hosts):
+    """
+    Place the VMs onto the hosts with first-fit decreasing.
+    The VMs are placed from the largest one, each onto the first host
+    which has enough free resources left.
+    :param vms: The list of (uuid, demand) of the VMs
+    :param hosts: The list of (hostname, free resources) of the hosts in
+                  the order of preference
+    :returns: The dictionary of uuid and hostname of the placed VMs, and
+              the list of uuids of the VMs which do not fit in any host
+    """
+    free = [(hostname, list(resources)) for hostname, resources in hosts]
+    if free:
+        totals = [sum(r) for r in zip(*[f[1] for f in free])]
+    else:
+        totals = []
+
+    ordered = sorted(vms, key=lambda vm: (-_size(vm[1], totals), vm[0]))
+
+    placement = {}
+    unplaced = []
+    for uuid, demand in ordered:
+        for hostname, resources in free:
+            if all(d <= r for d, r in zip(demand, resources)):
+                for i, d in enumerate(demand):
+                    resources[i] -= d
+                placement[uuid] = hostname
+                break
+        else:
+            unplaced.append(uuid)
+
+    return placement, unplaced
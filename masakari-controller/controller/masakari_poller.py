@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This file defines the ComputeServicePoller and InstanceStatePoller classes.
+"""
+
+import datetime
+import sys
+import threading
+import time
+import traceback
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+_INSTANCE_STATE_POLLER = None
+_INSTANCE_STATE_POLLER_LOCK = threading.Lock()
+
+# The seconds the servers are listed back from the registration of the
+# waits, to allow the clock difference from nova.
+_CHANGES_SINCE_SLACK_SEC = 60
+
+
+class ComputeServicePoller(object):
+
+    """
+    ComputeServicePoller class:
+    This class lists nova-compute services with one thread, while any
+    thread is waiting for a service to become a state, and wakes the
+    waiting threads up after each listing.
+    """
+
+    def __init__(self, rc_util_api, interval):
+        """
+        Constructor:
+        This constructor starts the polling thread.
+        :param rc_util_api: RecoveryControllerUtilApi object
+        :param interval: The seconds between the listings
+        """
+        self.rc_util_api = rc_util_api
+        self.interval = interval
+        self._cond = threading.Condition()
+        # hostname -> (binary, state, status)
+        self._services = {}
+        self._refreshed_at = None
+        # (hostname, state) -> The number of the waiting threads
+        self._waiters = {}
+        self._stats = {'poll_cnt': 0, 'error_cnt': 0}
+
+        th = threading.Thread(target=self._run,
+                              name='Thread:compute_service_poller')
+        th.daemon = True
+        th.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._waiters:
+                    self._cond.wait()
+
+            try:
+                services = self.rc_util_api.fetch_compute_services()
+                with self._cond:
+                    self._services = dict(
+                        (s.host, (s.binary, s.state, s.status))
+                        for s in services)
+                    self._refreshed_at = time.time()
+                    self._stats['poll_cnt'] += 1
+                    self._cond.notify_all()
+            except Exception:
+                with self._cond:
+                    self._stats['error_cnt'] += 1
+                error_type, error_value, traceback_ = sys.exc_info()
+                tb_list = traceback.format_tb(traceback_)
+                LOG.error(error_type)
+                LOG.error(error_value)
+                for tb in tb_list:
+                    LOG.error(tb)
+
+            time.sleep(self.interval)
+
+    def _is_fresh(self):
+        return self._refreshed_at is not None and \
+            time.time() - self._refreshed_at <= self.interval
+
+    def wait_for_state(self, hostname, state, timeout):
+        """
+        Wait until nova-compute service of the host becomes the state.
+        :param hostname: The host name
+        :param state: 'up' or 'down'
+        :param timeout: The seconds to wait
+        :returns: True if the service became the state, False if timed out
+        """
+        deadline = time.time() + timeout
+        key = (hostname, state)
+
+        with self._cond:
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            self._cond.notify_all()
+            try:
+                while True:
+                    service = self._services.get(hostname)
+                    if service is not None and service[1] == state and \
+                            self._is_fresh():
+                        return True
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters[key] -= 1
+                if not self._waiters[key]:
+                    del self._waiters[key]
+
+    def get_stats(self):
+        """
+        Return the statistics of the poller in the dictionary type.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['waiter_cnt'] = sum(self._waiters.values())
+            stats['host_cnt'] = len(self._services)
+
+        return stats
+
+
+class InstanceStatePoller(object):
+
+    """
+    InstanceStatePoller class:
+    This class lists the servers changed recently with one thread, while
+    any server is watched to become a vm_state or to be evacuated, and
+    calls the callbacks of the watches back after each listing.
+    A watch is covered from its registration by the first listing, and from
+    the previous listing by the others, so the changes-since window does
+    not grow with the oldest watch.
+    """
+
+    def __init__(self, rc_util_api, interval):
+        """
+        Constructor:
+        This constructor starts the polling thread.
+        :param rc_util_api: RecoveryControllerUtilApi object
+        :param interval: The seconds between the listings
+        """
+        self.rc_util_api = rc_util_api
+        self.interval = interval
+        self._cond = threading.Condition()
+        # The number of the listings done
+        self._generation = 0
+        # uuid -> (vm_state, task_state, host, generation of the listing)
+        self._states = {}
+        # uuid -> [The watches (check, deadline, generation, callback),
+        #          the time from which the changes are not listed yet]
+        self._waiters = {}
+        self._stats = {'poll_cnt': 0, 'error_cnt': 0,
+                       'evacuation_done_cnt': 0, 'evacuation_error_cnt': 0,
+                       'evacuation_timeout_cnt': 0,
+                       'evacuation_sec_total': 0.0,
+                       'evacuation_sec_max': 0.0}
+
+        th = threading.Thread(target=self._run,
+                              name='Thread:instance_state_poller')
+        th.daemon = True
+        th.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._waiters:
+                    self._cond.wait()
+                since = min(w[1] for w in self._waiters.values()) - \
+                    datetime.timedelta(seconds=_CHANGES_SINCE_SLACK_SEC)
+                listed_at = datetime.datetime.utcnow()
+
+            try:
+                servers = self.rc_util_api.fetch_servers_changed_since(since)
+                with self._cond:
+                    self._generation += 1
+                    # The changes before this listing have been listed.
+                    for waiter in self._waiters.values():
+                        waiter[1] = max(waiter[1], listed_at)
+                    for server in servers:
+                        if server.id in self._waiters:
+                            self._states[server.id] = (
+                                getattr(server, 'OS-EXT-STS:vm_state'),
+                                getattr(server, 'OS-EXT-STS:task_state',
+                                        None),
+                                getattr(server, 'OS-EXT-SRV-ATTR:host',
+                                        None),
+                                self._generation)
+                    self._stats['poll_cnt'] += 1
+            except Exception:
+                with self._cond:
+                    self._stats['error_cnt'] += 1
+                error_type, error_value, traceback_ = sys.exc_info()
+                tb_list = traceback.format_tb(traceback_)
+                LOG.error(error_type)
+                LOG.error(error_value)
+                for tb in tb_list:
+                    LOG.error(tb)
+
+            # The callbacks are called without the lock, as they may queue
+            # the recovery jobs.
+            for callback, result in self._pop_resolved():
+                try:
+                    callback(result)
+                except Exception:
+                    error_type, error_value, traceback_ = sys.exc_info()
+                    tb_list = traceback.format_tb(traceback_)
+                    LOG.error(error_type)
+                    LOG.error(error_value)
+                    for tb in tb_list:
+                        LOG.error(tb)
+
+            time.sleep(self.interval)
+
+    def _pop_resolved(self):
+        """
+        Remove the watches whose check returned other than None for the
+        state listed after the registration, or which timed out.
+        :returns: The list of (callback, result)
+        """
+        resolved = []
+        now = time.time()
+
+        with self._cond:
+            for uuid, waiter in self._waiters.items():
+                state = self._states.get(uuid)
+                watches = []
+                for watch in waiter[0]:
+                    check, deadline, generation, callback = watch
+                    result = None
+                    if state is not None and state[3] > generation:
+                        result = check(*state[:3])
+                    if result is not None:
+                        resolved.append((callback, result))
+                    elif now >= deadline:
+                        resolved.append((callback, None))
+                    else:
+                        watches.append(watch)
+                if watches:
+                    waiter[0] = watches
+                else:
+                    del self._waiters[uuid]
+                    self._states.pop(uuid, None)
+
+        return resolved
+
+    def _watch(self, uuid, check, timeout, callback):
+        """
+        Register a watch which calls callback back with the return value of
+        check, when it returns other than None for the state of the server
+        listed after the call, or with None if timed out.
+        """
+        with self._cond:
+            waiter = self._waiters.setdefault(
+                uuid, [[], datetime.datetime.utcnow()])
+            waiter[0].append((check, time.time() + timeout,
+                              self._generation, callback))
+            self._cond.notify_all()
+
+    def watch_state(self, uuid, vm_state, timeout, callback):
+        """
+        Watch the server until it becomes the vm_state, without blocking.
+        Call it after the request which changes the vm_state, so that the
+        listing covers the change.
+        :param uuid: The server id
+        :param vm_state: The vm_state to wait for
+        :param timeout: The seconds to wait
+        :param callback: The function called back from the polling thread
+         with True if the server became the vm_state, or None if timed out
+        """
+        def check(state, task_state, host):
+            if state == vm_state:
+                return True
+
+        self._watch(uuid, check, timeout, callback)
+
+    def watch_evacuation(self, uuid, target_host, timeout, callback):
+        """
+        Watch the server until its evacuation completes, without blocking.
+        Call it after Evacuate API is accepted.
+        :param uuid: The server id
+        :param target_host: The host the server is evacuated to
+        :param timeout: The seconds to wait
+        :param callback: The function called back from the polling thread
+         with 'done' if the server became active or stopped on the target
+         host, 'error' if it became error, or None if timed out
+        """
+        def check(vm_state, task_state, host):
+            if task_state is not None:
+                return None
+            if vm_state == 'error':
+                return 'error'
+            if host == target_host and vm_state in ('active', 'stopped'):
+                return 'done'
+
+        started_at = time.time()
+
+        def count(result):
+            elapsed = time.time() - started_at
+            with self._cond:
+                if result == 'done':
+                    self._stats['evacuation_done_cnt'] += 1
+                    self._stats['evacuation_sec_total'] += elapsed
+                    self._stats['evacuation_sec_max'] = max(
+                        self._stats['evacuation_sec_max'], elapsed)
+                elif result == 'error':
+                    self._stats['evacuation_error_cnt'] += 1
+                else:
+                    self._stats['evacuation_timeout_cnt'] += 1
+            callback(result)
+
+        self._watch(uuid, check, timeout, count)
+
+    def get_stats(self):
+        """
+        Return the statistics of the poller in the dictionary type.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['waiter_cnt'] = sum(
+                len(w[0]) for w in self._waiters.values())
+
+        return stats
+
+
+def get_instance_state_poller(config_object, rc_util_api):
+    """
+    Return the instance state poller shared in the process.
+    The servers are listed every api_check_interval seconds in
+    [recover_starter] section.
+    """
+    global _INSTANCE_STATE_POLLER
+
+    with _INSTANCE_STATE_POLLER_LOCK:
+        if _INSTANCE_STATE_POLLER is None:
+            conf_dict = config_object.get_value('recover_starter')
+            _INSTANCE_STATE_POLLER = InstanceStatePoller(
+                rc_util_api, int(conf_dict.get('api_check_interval')))
+
+    return _INSTANCE_STATE_POLLER
@@ -28,6 +28,9 @@ import traceback
 import json
 import masakari_worker as worker
 import masakari_config as config
+import masakari_executor as executor
+import masakari_inventory as inventory
+import masakari_planner as planner
 import masakari_util as util
 import os
 from eventlet import greenthread
@@ -64,7 +67,30 @@ class RecoveryControllerStarter(object):
         self.rc_worker = worker.RecoveryControllerWorker(config_object)
         self.rc_util = util.RecoveryControllerUtil()
         self.rc_util_db = util.RecoveryControllerUtilDb(config_object)
-        self.rc_util_api = util.RecoveryControllerUtilApi(config_object)
+        self.rc_util_api = util.get_util_api(config_object)
+        self.rc_executor = executor.get_executor(config_object)
+        self.rc_inventory = inventory.get_inventory(config_object,
+                                                    self.rc_util_api)
+        self.in_flight_vm_list = util.InFlightIds()
+
+    def _submit_recovery_instance(self, thread_name, uuid, primary_id,
+                                  vm_info=None):
+        """
+        Submit rc_worker.recovery_instance to the recovery executor.
+        The vm_list record is held as in flight until the job ends.
+        :param vm_info: The server details already fetched, or None to
+         fetch them in the job
+        """
+        self.in_flight_vm_list.add(primary_id)
+        self.rc_executor.submit(thread_name, self._run_recovery_instance,
+                                uuid, primary_id, vm_info)
+
+    def _run_recovery_instance(self, uuid, primary_id, vm_info=None):
+        try:
+            yield self.rc_worker.recovery_instance(uuid, primary_id,
+                                                   vm_info=vm_info)
+        finally:
+            self.in_flight_vm_list.discard(primary_id)
 
     @log_process_begin_and_end.output_log
     def _compare_timestamp(self, timestamp_1, timestamp_2):
@@ -156,38 +182,36 @@ class RecoveryControllerStarter(object):
     @log_process_begin_and_end.output_log
     def _create_vm_list_db_for_failed_host(self, session,
                                            notification_id,
-                                           notification_uuid):
+                                           notification_uuids,
+                                           recover_tos=None):
+        """
+        Insert vm_list records for the VMs on the failed host.
+        The VMs which already have a record in progress 0 or 1 are skipped.
+        :param recover_tos: The dictionary of VM uuid and the host planned
+         to recover it to
+        :returns: The dictionary of VM uuid and primary_id of the inserted
+         record
+        """
         try:
-            conf_recover_starter_dic = self.rc_config.get_value(
-                'recover_starter')
-
-            interval_to_be_retry = conf_recover_starter_dic.get(
-                "interval_to_be_retry")
-            max_retry_cnt = conf_recover_starter_dic.get("max_retry_cnt")
-
-            msg = "Do get_one_vm_list_by_uuid_and_progress_create_at_last."
+            msg = "Do get_vm_list_uuids_in_progress."
             LOG.info(msg)
-            result = dbapi.get_one_vm_list_by_uuid_and_progress_create_at_last(
-                session,
-                notification_uuid)
-            msg = "Succeeded in " \
-                + "get_one_vm_list_by_uuid_and_progress_create_at_last. " \
-                + "Return_value = " + str(result)
+            in_progress = dbapi.get_vm_list_uuids_in_progress(
+                session, notification_uuids)
+            msg = "Succeeded in get_vm_list_uuids_in_progress. " \
+                + "Return_value = " + str(in_progress)
             LOG.info(msg)
 
-            primary_id = None
-            if not result:
-                primary_id = self.rc_util_db.insert_vm_list_db(
-                    session, notification_id, notification_uuid, 0)
-
-                return primary_id
-            else:
-                msg = "Do not insert a record into vm_list db " \
-                      "because there are same uuid records that " \
-                      "progress is 0 or 1."
-                LOG.warning(msg)
+            for notification_uuid in notification_uuids:
+                if notification_uuid in in_progress:
+                    msg = "Do not insert a record into vm_list db " \
+                          "because there are same uuid records that " \
+                          "progress is 0 or 1. uuid=" + notification_uuid
+                    LOG.warning(msg)
 
-                return None
+            return self.rc_util_db.insert_vm_list_db_bulk(
+                session, notification_id,
+                [uuid for uuid in notification_uuids
+                 if uuid not in in_progress], 0, recover_tos)
 
         except KeyError:
             error_type, error_value, traceback_ = sys.exc_info()
@@ -213,39 +237,33 @@ class RecoveryControllerStarter(object):
 
         try:
             self.rc_config.set_request_context()
-            db_engine = dbapi.get_engine(self.rc_config)
-            session = dbapi.get_session(db_engine)
-
-            # Get primary id of vm_list
-            primary_id = self._create_vm_list_db_for_failed_instance(
-                session, notification_id, notification_uuid)
-            # update record in notification_list
-            self.rc_util_db.update_notification_list_db(
-                session, 'progress', 2, notification_id)
-            # create semaphore (Multiplicity = 1)
-            sem_recovery_instance = threading.Semaphore(1)
-            # create and start thread
-            if primary_id:
-                if retry_mode is True:
-                    # Skip recovery_instance.
-                    # Will delegate to handle_pending_instances
-                    msg = "RETRY MODE. Skip recovery_instance thread" \
-                        + " vm_uuide=" + notification_uuid \
-                        + " notification_id=" + notification_id
-                    LOG.info(msg)
-                else:
-                    msg = "Run thread rc_worker.recovery_instance." \
-                        + " notification_uuid=" + notification_uuid \
-                        + " primary_id=" + str(primary_id)
-                    LOG.info(msg)
-                    thread_name = self.rc_util.make_thread_name(
-                        VM_LIST, primary_id)
-                    threading.Thread(target=self.rc_worker.recovery_instance,
-                                     name=thread_name,
-                                     args=(notification_uuid, primary_id,
-                                           sem_recovery_instance)).start()
+            with dbapi.session_scope(self.rc_config) as session:
+                # Get primary id of vm_list
+                primary_id = self._create_vm_list_db_for_failed_instance(
+                    session, notification_id, notification_uuid)
+                # update record in notification_list
+                self.rc_util_db.update_notification_list_db(
+                    session, 'progress', 2, notification_id)
+                # submit recovery job
+                if primary_id:
+                    if retry_mode is True:
+                        # Skip recovery_instance.
+                        # Will delegate to handle_pending_instances
+                        msg = "RETRY MODE. Skip recovery_instance thread" \
+                            + " vm_uuide=" + notification_uuid \
+                            + " notification_id=" + notification_id
+                        LOG.info(msg)
+                    else:
+                        msg = "Submit rc_worker.recovery_instance." \
+                            + " notification_uuid=" + notification_uuid \
+                            + " primary_id=" + str(primary_id)
+                        LOG.info(msg)
+                        thread_name = self.rc_util.make_thread_name(
+                            VM_LIST, primary_id)
+                        self._submit_recovery_instance(
+                            thread_name, notification_uuid, primary_id)
 
-            return
+                return
 
         except KeyError:
             error_type, error_value, traceback_ = sys.exc_info()
@@ -264,11 +282,63 @@ class RecoveryControllerStarter(object):
                 LOG.error(tb)
             return
 
+    def prepare_failed_host(self,
+                            notification_id,
+                            notification_hostname,
+                            notification_cluster_port):
+        """
+        Prepare the recovery of the failed host while waiting for nova to
+        recognize that the host is down. The nova session of the worker is
+        authenticated as well, so that the recovery starts without waiting
+        for keystone.
+        :param notification_id: The notification ID included in the
+         notification
+        :param notification_hostname: The host name of the failure node that
+         is included in the notification
+        :returns: The prepared recovery to be passed to add_failed_host, or
+         None if there is nothing to recover
+        """
+        self.rc_config.set_request_context()
+        with dbapi.session_scope(self.rc_config) as session:
+            prepared = self._prepare_failed_host(session, notification_id,
+                                                 notification_hostname,
+                                                 notification_cluster_port,
+                                                 False)
+
+        if prepared is not None:
+            try:
+                self.rc_worker.rc_util_api.authenticate()
+            except Exception:
+                # The recovery jobs authenticate again when they call nova.
+                error_type, error_value, traceback_ = sys.exc_info()
+                tb_list = traceback.format_tb(traceback_)
+                LOG.error(error_type)
+                LOG.error(error_value)
+                for tb in tb_list:
+                    LOG.error(tb)
+
+        return prepared
+
+    def release_prepared_host(self, prepared):
+        """
+        Stop holding the vm_list records inserted by prepare_failed_host as
+        in flight. It is called once the records are submitted, or when the
+        recovery is not started, so that the expiry sweeper expires them.
+        The records are released only once.
+        :param prepared: The recovery prepared by prepare_failed_host
+        """
+        if prepared.get('released'):
+            return
+        prepared['released'] = True
+        for primary_id in prepared['primary_ids'].values():
+            self.in_flight_vm_list.discard(primary_id)
+
     def add_failed_host(self,
                         notification_id,
                         notification_hostname,
                         notification_cluster_port,
-                        retry_mode):
+                        retry_mode,
+                        prepared=None):
         """
         Node recover start thread :
             This thread starts the VM recover execution thread,
@@ -277,92 +347,192 @@ class RecoveryControllerStarter(object):
          notification
         :param notification_hostname: The host name of the failure node that
          is included in the notification
+        :param prepared: The recovery prepared by prepare_failed_host, or
+         None to prepare it here
         """
 
         try:
             self.rc_config.set_request_context()
-            db_engine = dbapi.get_engine(self.rc_config)
-            session = dbapi.get_session(db_engine)
-            conf_dict = self.rc_config.get_value('recover_starter')
-            recovery_max_retry_cnt = conf_dict.get('recovery_max_retry_cnt')
-            recovery_retry_interval = conf_dict.get('recovery_retry_interval')
+            with dbapi.session_scope(self.rc_config) as session:
+                self._add_failed_host(session, notification_id,
+                                      notification_hostname,
+                                      notification_cluster_port,
+                                      retry_mode, prepared)
+
+        except KeyError:
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+            return
+        except:
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+            return
+        finally:
+            if prepared is not None:
+                self.release_prepared_host(prepared)
 
-            vm_list = self.rc_util_api.fetch_servers_on_hypervisor(
+    def _fetch_servers_on_failed_host(self, notification_hostname):
+        """
+        List the servers on the failed host from the inventory snapshot, so
+        that the recovery is prepared without listing nova. nova is listed
+        if the snapshot is not refreshed recently or has no server on the
+        host. The servers listed from the snapshot are reconciled with nova
+        by _reconcile_failed_host before they are submitted.
+        :returns: The list of the servers on the host, and True if they are
+         listed from the snapshot
+        """
+        servers = None
+        if self.rc_inventory is not None:
+            servers = self.rc_inventory.get_servers_on_host(
                 notification_hostname)
+        if servers:
+            return servers, True
 
-            # Count vm_list
-            if len(vm_list) == 0:
-                msg = "There is no instance in " + notification_hostname + "."
-                LOG.info(msg)
+        return self.rc_util_api.fetch_servers_on_hypervisor(
+            notification_hostname), False
 
-                # update record in notification_list
-                self.rc_util_db.update_notification_list_db(
-                    session, 'progress', 2, notification_id)
+    def _reconcile_failed_host(self, session, notification_id,
+                               notification_hostname, prepared):
+        """
+        Reconcile the recovery prepared from the inventory snapshot with the
+        servers on the failed host listed from nova. The vm_list records of
+        the servers created or migrated onto the host after the last
+        refresh of the snapshot are inserted, and the ones of the servers
+        moved away are superseded(progress=4). The servers added are
+        recovered to recover_to, as they are not in the evacuation plan.
+        If nova can not be listed, the snapshot is used as it is.
+        :param prepared: The recovery prepared by _prepare_failed_host,
+         which is updated
+        """
+        try:
+            servers = self.rc_util_api.fetch_servers_on_hypervisor(
+                notification_hostname)
+        except Exception:
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+            msg = "Failed to list the servers on " + notification_hostname \
+                + ", so recover the servers in the inventory snapshot."
+            LOG.warning(msg)
+            return
 
-                return
-            else:
-                msg = "Do get_all_notification_list_by_id_for_update."
-                LOG.info(msg)
-                result = dbapi.get_all_notification_list_by_id_for_update(
-                    session, notification_id)
-                msg = "Succeeded in " \
-                    + "get_all_notification_list_by_id_for_update. " \
-                    + "Return_value = " + str(result)
-                LOG.info(msg)
-                recover_to = result.pop().recover_to
+        vm_list = prepared['vm_list']
+        primary_ids = prepared['primary_ids']
+        listed = [server.id for server in servers]
+
+        moved = [uuid for uuid in vm_list if uuid not in listed]
+        for uuid in moved:
+            msg = "The server moved away from " + notification_hostname \
+                + " after the inventory snapshot. uuid=" + uuid
+            LOG.info(msg)
+            primary_id = primary_ids.pop(uuid, None)
+            if primary_id is not None:
+                self.rc_util_db.update_vm_list_db(
+                    session, 'progress', 4, primary_id)
+                self.in_flight_vm_list.discard(primary_id)
+
+        added = [uuid for uuid in listed if uuid not in vm_list]
+        if added:
+            msg = "The servers moved onto " + notification_hostname \
+                + " after the inventory snapshot. uuids=" + str(added)
+            LOG.info(msg)
+            added_ids = self._create_vm_list_db_for_failed_host(
+                session, notification_id, added)
+            for primary_id in added_ids.values():
+                self.in_flight_vm_list.add(primary_id)
+            primary_ids.update(added_ids)
+
+        prepared['vm_list'] = [uuid for uuid in vm_list
+                               if uuid not in moved] + added
+        # The details listed from nova are newer than the snapshot.
+        prepared['vm_infos'] = dict((server.id, server)
+                                    for server in servers)
+
+    @log_process_begin_and_end.output_log
+    def _prepare_failed_host(self, session, notification_id,
+                             notification_hostname,
+                             notification_cluster_port, retry_mode):
+        """
+        Prepare the recovery of the failed host: fetch the servers on it,
+        take the reserve host, plan the evacuation and insert the vm_list
+        records. The records are held as in flight until they are submitted.
+        :returns: The dictionary of the prepared recovery, or None if there
+         is nothing to recover
+        """
+        conf_dict = self.rc_config.get_value('recover_starter')
 
-                if retry_mode is False:
-                    msg = "Do get_all_reserve_list_by_hostname_not_deleted."
+        servers, from_snapshot = self._fetch_servers_on_failed_host(
+            notification_hostname)
+        # The servers being changed in the snapshot are read again by the
+        # recovery jobs.
+        vm_infos = dict((server.id, server) for server in servers
+                        if getattr(server, 'verified', True))
+        vm_list = [server.id for server in servers]
+
+        # Count vm_list
+        if len(vm_list) == 0:
+            msg = "There is no instance in " + notification_hostname + "."
+            LOG.info(msg)
+
+            # update record in notification_list
+            self.rc_util_db.update_notification_list_db(
+                session, 'progress', 2, notification_id)
+
+            return None
+        else:
+            msg = "Do get_all_notification_list_by_id_for_update."
+            LOG.info(msg)
+            result = dbapi.get_all_notification_list_by_id_for_update(
+                session, notification_id)
+            msg = "Succeeded in " \
+                + "get_all_notification_list_by_id_for_update. " \
+                + "Return_value = " + str(result)
+            LOG.info(msg)
+            recover_to = result.pop().recover_to
+
+            if retry_mode is False:
+                hint = recover_to
+                recover_to = self.rc_util_db.claim_reserve_node(
+                    session, notification_cluster_port,
+                    notification_hostname, hint)
+
+                if recover_to is None:
+                    msg = "The reserve node not exist in " \
+                          "reserve_list DB, " \
+                          "so do not recover instances."
+                    LOG.warning(msg)
+                    self.rc_util_db.update_notification_list_db(
+                        session, 'progress', 3, notification_id)
+
+                    return None
+
+                if recover_to != hint:
+                    update_at = datetime.datetime.now()
+                    msg = "Do " \
+                        + "update_notification_list_by_notification_id_recover_to."
                     LOG.info(msg)
-                    cnt = dbapi.get_all_reserve_list_by_hostname_not_deleted(
+                    dbapi.update_notification_list_by_notification_id_recover_to(
                         session,
-                        recover_to)
+                        notification_id,
+                        update_at,
+                        recover_to
+                    )
                     msg = "Succeeded in " \
-                        + "get_all_reserve_list_by_hostname_not_deleted. " \
-                        + "Return_value = " + str(cnt)
+                        + "update_notification_list_by_notification_id_recover_to."
                     LOG.info(msg)
-
-                    if not cnt:
-                        msg = "Do " \
-                            + "get_one_reserve_list_by_cluster_port_for_update."
-                        LOG.info(msg)
-                        cnt = dbapi.\
-                            get_one_reserve_list_by_cluster_port_for_update(
-                                session,
-                                notification_cluster_port,
-                                notification_hostname
-                            )
-                        msg = "Succeeded in " \
-                            + "get_one_reserve_list_by_cluster_port_for_update. " \
-                            + "Return_value = " + str(cnt)
-                        LOG.info(msg)
-
-                        if not cnt:
-                            msg = "The reserve node not exist in " \
-                                  "reserve_list DB, " \
-                                  "so do not recover instances."
-                            LOG.warning(msg)
-                            self.rc_util_db.update_notification_list_db(
-                                'progress', 3, notification_id)
-
-                            return
-
-                        result = cnt.pop()
-                        recover_to = result.hostname
-                        update_at = datetime.datetime.now()
-                        msg = "Do " \
-                            + "update_notification_list_by_notification_id_recover_to."
-                        LOG.info(msg)
-                        dbapi.update_notification_list_by_notification_id_recover_to(
-                            session,
-                            notification_id,
-                            update_at,
-                            recover_to
-                        )
-                        msg = "Succeeded in " \
-                            + "update_notification_list_by_notification_id_recover_to."
-                        LOG.info(msg)
-
+            else:
+                # The reserve node was taken before the retry.
                 delete_at = datetime.datetime.now()
 
                 msg = "Do update_reserve_list_by_hostname_as_deleted."
@@ -372,91 +542,202 @@ class RecoveryControllerStarter(object):
                 msg = "Succeeded in " \
                     + "update_reserve_list_by_hostname_as_deleted."
                 LOG.info(msg)
-            # create semaphore (Multiplicity is get from config.)
-            conf_dict = self.rc_config.get_value('recover_starter')
-            sem_recovery_instance = threading.Semaphore(
-                int(conf_dict.get('semaphore_multiplicity')))
 
+        recover_tos = None
+        if retry_mode is False and \
+                conf_dict.get('evacuation_planner').lower() == 'true':
+            recover_tos = self._plan_evacuation(
+                session, notification_hostname, notification_cluster_port,
+                recover_to, servers)
+
+        primary_ids = self._create_vm_list_db_for_failed_host(
+            session, notification_id, vm_list, recover_tos)
+        for primary_id in primary_ids.values():
+            self.in_flight_vm_list.add(primary_id)
+
+        return {'vm_infos': vm_infos,
+                'vm_list': vm_list,
+                'recover_tos': recover_tos,
+                'primary_ids': primary_ids,
+                'from_snapshot': from_snapshot}
+
+    @log_process_begin_and_end.output_log
+    def _add_failed_host(self, session, notification_id,
+                         notification_hostname, notification_cluster_port,
+                         retry_mode, prepared=None):
+        conf_dict = self.rc_config.get_value('recover_starter')
+        recovery_max_retry_cnt = conf_dict.get('recovery_max_retry_cnt')
+        recovery_retry_interval = conf_dict.get('recovery_retry_interval')
+
+        if prepared is None:
+            prepared = self._prepare_failed_host(
+                session, notification_id, notification_hostname,
+                notification_cluster_port, retry_mode)
+            if prepared is None:
+                return
+
+        try:
+            if prepared.get('from_snapshot'):
+                self._reconcile_failed_host(
+                    session, notification_id, notification_hostname,
+                    prepared)
+            self._submit_failed_host(
+                session, notification_id, retry_mode, prepared,
+                int(recovery_max_retry_cnt), int(recovery_retry_interval))
+        finally:
+            self.release_prepared_host(prepared)
+
+        # update record in notification_list
+        self.rc_util_db.update_notification_list_db(
+            session, 'progress', 2, notification_id)
+
+        return
+
+    def _submit_failed_host(self, session, notification_id, retry_mode,
+                            prepared, recovery_max_retry_cnt,
+                            recovery_retry_interval):
+        vm_infos = prepared['vm_infos']
+        vm_list = prepared['vm_list']
+        recover_tos = prepared['recover_tos']
+        primary_ids = prepared['primary_ids']
+
+        incomplete_list = []
+        for i in range(0, recovery_max_retry_cnt):
             incomplete_list = []
-            for i in range(0, int(recovery_max_retry_cnt)):
-                incomplete_list = []
-
-                for vm_uuid in vm_list:
-                    primary_id = self._create_vm_list_db_for_failed_host(
-                        session, notification_id, vm_uuid)
-
-                    if primary_id:
-                        if retry_mode is True:
-                            # Skip recovery_instance thread. Will delegate to
-                            # ...
-                            msg = "RETRY MODE. Skip recovery_instance thread" \
-                                + " vm_uuide=" + vm_uuid \
-                                + " notification_id=" + notification_id
-                            LOG.info(msg)
-                        else:
-                            msg = "Run thread rc_worker.recovery_instance." \
-                                + " vm_uuid=" + vm_uuid \
-                                + " primary_id=" + str(primary_id)
-                            LOG.info(msg)
-
-                            thread_name = self.rc_util.make_thread_name(
-                                VM_LIST, primary_id)
-                            threading.Thread(
-                                target=self.rc_worker.recovery_instance,
-                                name=thread_name,
-                                args=(vm_uuid, primary_id,
-                                      sem_recovery_instance)).start()
+
+            if i > 0:
+                primary_ids = self._create_vm_list_db_for_failed_host(
+                    session, notification_id, vm_list, recover_tos)
+
+            for vm_uuid in vm_list:
+                primary_id = primary_ids.get(vm_uuid)
+
+                if primary_id:
+                    if retry_mode is True:
+                        # Skip recovery_instance thread. Will delegate to
+                        # ...
+                        msg = "RETRY MODE. Skip recovery_instance thread" \
+                            + " vm_uuide=" + vm_uuid \
+                            + " notification_id=" + notification_id
+                        LOG.info(msg)
                     else:
-                        if retry_mode is True:
-                            continue
-                        else:
-                            incomplete_list.append(vm_uuid)
-
-                if incomplete_list:
-                    vm_list = incomplete_list
-                    greenthread.sleep(int(recovery_retry_interval))
+                        msg = "Submit rc_worker.recovery_instance." \
+                            + " vm_uuid=" + vm_uuid \
+                            + " primary_id=" + str(primary_id)
+                        LOG.info(msg)
+
+                        thread_name = self.rc_util.make_thread_name(
+                            VM_LIST, primary_id)
+                        self._submit_recovery_instance(
+                            thread_name, vm_uuid, primary_id,
+                            vm_infos.get(vm_uuid))
                 else:
-                    break
+                    if retry_mode is True:
+                        continue
+                    else:
+                        incomplete_list.append(vm_uuid)
 
-            for vm_uuid in incomplete_list:
-                primary_id = self.rc_util_db.insert_vm_list_db(
-                    session, notification_id, vm_uuid, 0)
+            if incomplete_list:
+                vm_list = incomplete_list
+                greenthread.sleep(recovery_retry_interval)
+            else:
+                break
 
-                # Skip recovery_instance thread. Will delegate to ...
-                msg = "Run thread rc_worker.recovery_instance." \
-                    + " vm_uuid=" + vm_uuid \
-                    + " primary_id=" + str(primary_id)
-                LOG.info(msg)
-                thread_name = self.rc_util.make_thread_name(
-                    VM_LIST, primary_id)
-                threading.Thread(
-                    target=self.rc_worker.recovery_instance,
-                    name=thread_name,
-                    args=(vm_uuid, primary_id,
-                          sem_recovery_instance)).start()
+        primary_ids = self.rc_util_db.insert_vm_list_db_bulk(
+            session, notification_id, incomplete_list, 0, recover_tos)
+        for vm_uuid in incomplete_list:
+            primary_id = primary_ids[vm_uuid]
 
-            # update record in notification_list
-            self.rc_util_db.update_notification_list_db(
-                session, 'progress', 2, notification_id)
+            # Skip recovery_instance thread. Will delegate to ...
+            msg = "Submit rc_worker.recovery_instance." \
+                + " vm_uuid=" + vm_uuid \
+                + " primary_id=" + str(primary_id)
+            LOG.info(msg)
+            thread_name = self.rc_util.make_thread_name(
+                VM_LIST, primary_id)
+            self._submit_recovery_instance(thread_name, vm_uuid, primary_id,
+                                           vm_infos.get(vm_uuid))
 
-            return
+    @log_process_begin_and_end.output_log
+    def _plan_evacuation(self, session, notification_hostname,
+                         notification_cluster_port, recover_to, servers):
+        """
+        Plan the reserve hosts to recover the VMs of the failed host to.
+        The VMs are placed onto recover_to first. While some VMs do not
+        fit, another reserve host of the cluster is taken, up to
+        evacuation_planner_max_hosts hosts.
+        :returns: The dictionary of VM uuid and the host to recover it to.
+         The VMs not in it are recovered to recover_to.
+        """
+        conf_dict = self.rc_config.get_value('recover_starter')
+        max_hosts = int(conf_dict.get('evacuation_planner_max_hosts'))
 
-        except KeyError:
-            error_type, error_value, traceback_ = sys.exc_info()
-            tb_list = traceback.format_tb(traceback_)
-            LOG.error(error_type)
-            LOG.error(error_value)
-            for tb in tb_list:
-                LOG.error(tb)
-            return
-        except:
+        claimed = []
+        try:
+            demands = self.rc_util_api.fetch_server_resources(servers)
+            free = self.rc_util_api.fetch_hypervisor_free_resources()
+
+            if recover_to not in free:
+                msg = "The resources of " + recover_to \
+                    + " are not found, so do not plan the evacuation."
+                LOG.warning(msg)
+                return {}
+
+            vms = [(server.id, demands[server.id]) for server in servers
+                   if server.id in demands]
+            hosts = [(recover_to, free[recover_to])]
+            placement, unplaced = planner.plan_first_fit_decreasing(
+                vms, hosts)
+
+            def fits_more(hostname):
+                # Only the reserve host which takes some of the VMs left
+                # is claimed.
+                if hostname not in free:
+                    return False
+                new_unplaced = planner.plan_first_fit_decreasing(
+                    vms, hosts + [(hostname, free[hostname])])[1]
+                return len(new_unplaced) < len(unplaced)
+
+            while unplaced and len(hosts) < max_hosts:
+                hostname = self.rc_util_db.claim_reserve_node(
+                    session, notification_cluster_port,
+                    notification_hostname, None, accept=fits_more)
+                if hostname is None:
+                    break
+                claimed.append(hostname)
+
+                hosts.append((hostname, free[hostname]))
+                placement, unplaced = planner.plan_first_fit_decreasing(
+                    vms, hosts)
+
+            msg = "Planned the evacuation of " + notification_hostname \
+                + ". hosts=" + str([h[0] for h in hosts]) \
+                + ", unplaced=" + str(unplaced)
+            LOG.info(msg)
+
+            return placement
+
+        except Exception:
             error_type, error_value, traceback_ = sys.exc_info()
             tb_list = traceback.format_tb(traceback_)
             LOG.error(error_type)
             LOG.error(error_value)
             for tb in tb_list:
                 LOG.error(tb)
-            return
+
+            # The reserve hosts taken for the plan are not used.
+            for hostname in claimed:
+                try:
+                    self.rc_util_db.release_reserve_node(
+                        session, notification_cluster_port, hostname)
+                except Exception:
+                    msg = "Failed to release the reserve node " + hostname
+                    LOG.error(msg)
+
+            msg = "Failed to plan the evacuation, " \
+                "so recover all instances to " + recover_to + "."
+            LOG.warning(msg)
+            return {}
 
     @log_process_begin_and_end.output_log
     def _update_old_records_vm_list(self, session):
@@ -466,81 +747,32 @@ class RecoveryControllerStarter(object):
         now = datetime.datetime.now()
         border_time = now - \
             datetime.timedelta(seconds=notification_expiration_sec)
-        border_time_str = border_time.strftime('%Y-%m-%d %H:%M:%S')
 
-        msg = "Do get_old_records_vm_list."
+        # The records waiting in the recovery executor are not expired.
+        msg = "Do expire_old_records_vm_list."
         LOG.info(msg)
-        result = dbapi.get_old_records_vm_list(
-            session,
-            border_time_str,
-            border_time_str
-        )
-        msg = "Succeeded in get_old_records_vm_list. " \
-            + "Return_value = " + str(result)
+        cnt = dbapi.expire_old_records_vm_list(
+            session, border_time, now, self.in_flight_vm_list.snapshot())
+        msg = "Succeeded in expire_old_records_vm_list. " \
+            + "Return_value = " + str(cnt)
         LOG.info(msg)
 
-        if result:
+        if cnt:
             msg = 'Old and incomplete records will be skipped.'
             LOG.info(msg)
 
-            # Set progress = 4 for old record
-            for row in result:
-                update_val = {'progress': 4,
-                              'update_at': datetime.datetime.now(),
-                              'delete_at': datetime.datetime.now()
-                              }
-                msg = "Do update_vm_list_by_id_dict."
-                LOG.info(msg)
-                dbapi.update_vm_list_by_id_dict(session, row.id, update_val)
-                msg = "Succeeded in update_vm_list_by_id_dict."
-                LOG.info(msg)
+        return cnt
 
     @log_process_begin_and_end.output_log
     def _find_reprocessing_records_vm_list(self, session):
-        return_value = []
-        msg = "Do get_all_vm_list_by_progress."
+        msg = "Do supersede_reprocessing_vm_list."
         LOG.info(msg)
-        result = dbapi.get_all_vm_list_by_progress(session)
-        msg = "Succeeded in get_all_vm_list_by_progress. " \
-            + "Return_value = " + str(result)
+        return_value = dbapi.supersede_reprocessing_vm_list(
+            session, datetime.datetime.now())
+        msg = "Succeeded in supersede_reprocessing_vm_list. " \
+            + "Return_value = " + str(return_value)
         LOG.info(msg)
 
-        # UUID to see one by one, and look for the re-processing target record
-        for row in result:
-            msg = "Do get_vm_list_by_uuid_and_progress_sorted."
-            LOG.info(msg)
-            result2 = dbapi.get_vm_list_by_uuid_and_progress_sorted(
-                session,
-                row.uuid
-            )
-            msg = "Succeeded in get_vm_list_by_uuid_and_progress_sorted. " \
-                + "Return_value = " + str(result2)
-            LOG.info(msg)
-
-            row_cnt = 0
-            for row2 in result2:
-                # First row is the re-processing target
-                if row_cnt == 0:
-                    return_value.append(row2)
-                # Update progress that is not the re-processing target
-                else:
-                    update_val = {'progress': 4,
-                                  'update_at': datetime.datetime.now(),
-                                  'delete_at': datetime.datetime.now()
-                                  }
-
-                    msg = "Do update_vm_list_by_id_dict."
-                    LOG.info(msg)
-                    dbapi.update_vm_list_by_id_dict(
-                        session,
-                        row2.id,
-                        update_val
-                    )
-                    msg = "Succeeded in update_vm_list_by_id_dict."
-                    LOG.info(msg)
-
-                row_cnt += 1
-
         return return_value
 
     def handle_pending_instances(self):
@@ -551,42 +783,31 @@ class RecoveryControllerStarter(object):
         """
         try:
             self.rc_config.set_request_context()
-            db_engine = dbapi.get_engine(self.rc_config)
-            session = dbapi.get_session(db_engine)
-
-            self._update_old_records_vm_list(session)
-            result = self._find_reprocessing_records_vm_list(session)
-
-            # [recover_starter]section
-            recover_starter_dic = self.rc_config.get_value("recover_starter")
-            semaphore_multiplicity = recover_starter_dic.get(
-                "semaphore_multiplicity")
-
-            # Set multiplicity by semaphore_multiplicity
-            sem = threading.Semaphore(int(semaphore_multiplicity))
-
-            # Execute vm_recovery_worker
-            if len(result) > 0:
-                # Execute the required number
-                for row in result:
-                    vm_uuid = row.uuid
-                    primary_id = row.id
-                    msg = "Run thread rc_worker.recovery_instance." \
-                        + " vm_uuid=" + vm_uuid \
-                        + " primary_id=" + str(primary_id)
-                    LOG.info(msg)
-                    thread_name = self.rc_util.make_thread_name(
-                        VM_LIST, primary_id)
-                    threading.Thread(
-                        target=self.rc_worker.recovery_instance,
-                        name=thread_name,
-                        args=(vm_uuid, primary_id, sem)).start()
-
-            # Imperfect_recover
-            else:
-                return
+            with dbapi.session_scope(self.rc_config) as session:
+
+                self._update_old_records_vm_list(session)
+                result = self._find_reprocessing_records_vm_list(session)
+
+                # Execute vm_recovery_worker
+                if len(result) > 0:
+                    # Execute the required number
+                    for row in result:
+                        vm_uuid = row.uuid
+                        primary_id = row.id
+                        msg = "Submit rc_worker.recovery_instance." \
+                            + " vm_uuid=" + vm_uuid \
+                            + " primary_id=" + str(primary_id)
+                        LOG.info(msg)
+                        thread_name = self.rc_util.make_thread_name(
+                            VM_LIST, primary_id)
+                        self._submit_recovery_instance(
+                            thread_name, vm_uuid, primary_id)
 
-            return
+                # Imperfect_recover
+                else:
+                    return
+
+                return
         except KeyError:
             error_type, error_value, traceback_ = sys.exc_info()
             tb_list = traceback.format_tb(traceback_)
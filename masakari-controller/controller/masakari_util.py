@@ -25,16 +25,21 @@ import os
 import paramiko
 import re
 import masakari_config as config
+import masakari_executor as executor
+import masakari_governor as governor
+import masakari_journal as journal
 import socket
 import subprocess
 import sys
 import threading
+import time
 import traceback
 import errno
 
 from eventlet import greenthread
 from keystoneauth1 import loading
 from keystoneauth1 import session
+import requests
 from keystoneclient import client as keystone_client
 from novaclient import client as nova_client
 from novaclient import exceptions
@@ -56,6 +61,17 @@ from functools import wraps
 
 LOG = logging.getLogger(__name__)
 
+_UTIL_API = None
+_UTIL_API_LOCK = threading.Lock()
+
+# The HTTP connections kept for the threads calling the APIs besides the
+# recovery jobs (the pollers, the notification threads and so on)
+_API_POOL_EXTRA_SIZE = 5
+# The token is got again when it expires within this seconds. The refresher
+# thread checks it more often, so the recovery threads do not wait for it.
+_TOKEN_REFRESH_MARGIN_SEC = 600
+_TOKEN_REFRESH_INTERVAL_SEC = 60
+
 
 class LogProcessBeginAndEnd(object):
 
@@ -80,6 +96,35 @@ class LogProcessBeginAndEnd(object):
 log_process_begin_and_end = LogProcessBeginAndEnd(LOG)
 
 
+class InFlightIds(object):
+
+    """
+    InFlightIds class:
+    This class holds the ids of the records which are being processed in
+    this process, so that the expiry sweeper does not expire them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+
+    def add(self, record_id):
+        with self._lock:
+            self._ids[record_id] = self._ids.get(record_id, 0) + 1
+
+    def discard(self, record_id):
+        with self._lock:
+            cnt = self._ids.get(record_id, 0) - 1
+            if cnt > 0:
+                self._ids[record_id] = cnt
+            else:
+                self._ids.pop(record_id, None)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._ids)
+
+
 class RecoveryControllerUtilDb(object):
 
     """
@@ -88,6 +133,56 @@ class RecoveryControllerUtilDb(object):
 
     def __init__(self, config_object):
         self.rc_config = config_object
+        self.rc_journal = journal.get_journal(config_object)
+
+    @log_process_begin_and_end.output_log
+    def insert_vm_list_db_bulk(self, session, notification_id,
+                               notification_uuids, retry_cnt,
+                               recover_tos=None):
+        """
+        VM list table registration for many VMs
+        :param :notification_id: Notification ID
+                (used as search criteria for notification list table)
+        :param :notification_uuids: The list of VM uuid
+                (used as the registered contents of the VM list table)
+        :param :retry_cnt:Retry count
+                (used as the registered contents of the VM list table)
+        :param :recover_tos: The dictionary of VM uuid and the host to
+                recover it to. The VMs not in it are recovered to
+                recover_to of the notification.
+        :return :The dictionary of VM uuid and primary_id
+        """
+
+        if not notification_uuids:
+            return {}
+
+        msg = "Do get_all_notification_list_by_notification_id."
+        LOG.info(msg)
+        res = dbapi.get_all_notification_list_by_notification_id(
+            session,
+            notification_id
+        )
+        msg = "Succeeded in get_all_notification_list_by_notification_id. " \
+            + "Return_value = " + str(res)
+        LOG.info(msg)
+        notification_recover_to = res[0].recover_to
+        notification_recover_by = res[0].recover_by
+
+        msg = "Do add_vm_list_bulk."
+        LOG.info(msg)
+        primary_ids = dbapi.add_vm_list_bulk(session,
+                                             datetime.datetime.now(),
+                                             notification_id,
+                                             notification_uuids,
+                                             retry_cnt,
+                                             notification_recover_to,
+                                             notification_recover_by,
+                                             recover_tos)
+        msg = "Succeeded in add_vm_list_bulk. " \
+            + "Return_value = " + str(primary_ids)
+        LOG.info(msg)
+
+        return primary_ids
 
     @log_process_begin_and_end.output_log
     def insert_vm_list_db(self, session, notification_id,
@@ -190,6 +285,157 @@ class RecoveryControllerUtilDb(object):
                        notification_list table in the dictionary type
 
         """
+        controle_ip = socket.gethostbyname(jsonData.get("hostname"))
+        recover_to = None
+        if recover_by == 0:
+            recover_to = self._get_reserve_node_from_reserve_list_db(
+                jsonData.get("cluster_port"),
+                jsonData.get("hostname"),
+                session)
+        notification_list = self._make_notification_list_row(
+            jsonData, recover_by, recover_to, controle_ip)
+
+        # Todo: (sampath) correct the exceptions catching
+        # Insert to notification_list DB.
+
+        try:
+            msg = "Do add_notification_list."
+            LOG.info(msg)
+            result = dbapi.add_notification_list(session,
+                                                 **notification_list)
+            msg = "Succeeded in add_notification_list. " \
+                + "Return_value = " + str(result)
+            LOG.info(msg)
+
+            msg = "Do get_all_reserve_list_by_hostname_not_deleted."
+            LOG.info(msg)
+            cnt = dbapi.get_all_reserve_list_by_hostname_not_deleted(
+                session,
+                jsonData.get("hostname")
+            )
+            msg = "Succeeded in get_all_reserve_list_by_hostname_not_deleted. " \
+                + "Return_value = " + str(cnt)
+            LOG.info(msg)
+
+            if len(cnt) > 0:
+                msg = "Do update_reserve_list_by_hostname_as_deleted."
+                LOG.info(msg)
+                dbapi.update_reserve_list_by_hostname_as_deleted(
+                    session,
+                    jsonData.get("hostname"),
+                    datetime.datetime.now()
+                )
+                msg = "Succeeded in " \
+                    + "update_reserve_list_by_hostname_as_deleted."
+                LOG.info(msg)
+
+            return self._make_notification_list_dic(jsonData,
+                                                    notification_list)
+
+        except Exception as e:
+
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+
+            LOG.error(e.message)
+
+            raise e
+
+    @log_process_begin_and_end.output_log
+    def insert_notification_list_db_bulk(self, notifications, session,
+                                         controle_ips=None):
+        """
+           Insert into notification_list DB from several notification JSONs
+           with one multi-row INSERT.
+           :param :notifications: list of (jsonData, recover_by) tuples.
+           :param :session: session object
+           :param :controle_ips: The dictionary of the host names already
+                                 resolved and their addresses
+           :return :ret_list:the information that was registered to
+                       notification_list table in the dictionary type,
+                       in the order of notifications
+
+        """
+        if not notifications:
+            return []
+
+        # The host names and the reserve nodes are looked up once for the
+        # batch.
+        hostnames = set(jsonData.get("hostname")
+                        for jsonData, recover_by in notifications)
+        controle_ips = dict(controle_ips or {})
+        for hostname in hostnames:
+            if hostname not in controle_ips:
+                controle_ips[hostname] = socket.gethostbyname(hostname)
+        cluster_ports = set(jsonData.get("cluster_port")
+                            for jsonData, recover_by in notifications
+                            if recover_by == 0)
+        reserve_nodes = self._get_reserve_nodes_from_reserve_list_db(
+            cluster_ports, hostnames, session)
+
+        rows = []
+        for jsonData, recover_by in notifications:
+            recover_to = None
+            if recover_by == 0:
+                recover_to = reserve_nodes.get(jsonData.get("cluster_port"))
+                if recover_to is None:
+                    msg = "The reserve node not exist in reserve_list DB."
+                    LOG.warning(msg)
+            rows.append(self._make_notification_list_row(
+                jsonData, recover_by, recover_to,
+                controle_ips[jsonData.get("hostname")]))
+
+        try:
+            msg = "Do add_notification_list_bulk."
+            LOG.info(msg)
+            result = dbapi.add_notification_list_bulk(session, rows)
+            msg = "Succeeded in add_notification_list_bulk. " \
+                + "Return_value = " + str(result)
+            LOG.info(msg)
+
+            # Failed hosts can not be used as reserve nodes any more.
+            hostnames = set(jsonData.get("hostname")
+                            for jsonData, recover_by in notifications)
+            msg = "Do update_reserve_list_by_hostnames_as_deleted."
+            LOG.info(msg)
+            dbapi.update_reserve_list_by_hostnames_as_deleted(
+                session, list(hostnames), datetime.datetime.now())
+            msg = "Succeeded in " \
+                + "update_reserve_list_by_hostnames_as_deleted."
+            LOG.info(msg)
+
+            return [self._make_notification_list_dic(jsonData, row)
+                    for (jsonData, recover_by), row in zip(notifications,
+                                                           rows)]
+
+        except Exception as e:
+
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+
+            LOG.error(e.message)
+
+            raise e
+
+    def _make_notification_list_row(self, jsonData, recover_by, recover_to,
+                                    controle_ip):
+        """
+           Make the column values of notification_list from notification JSON.
+           :param :jsonData: notifocation json data.
+           :param :recover_by:node recover(0)/VM recover(1)/process error(2)
+           :param :recover_to: Host name of the reserve node for the node
+                               recovery, or None if no reserve node exists
+           :param :controle_ip: The address of the notified host
+           :return :row: column name and value in the dictionary type
+        """
 
         # NOTE: The notification item 'endTime' may have a NULL value.
         #       reference : The Notification Spec for RecoveryController.
@@ -207,20 +453,12 @@ class RecoveryControllerUtilDb(object):
             deleted = 0
             # progress 0:not yet
             progress = 0
-            # From /etc/hosts
             # NOTE: Hosts hostname suffix is
             # undetermined("_data_line","_control_line")
             iscsi_ip = None
-            controle_ip = socket.gethostbyname(jsonData.get("hostname"))
-            recover_to = None
-            if recover_by == 0:
-                recover_to = self._get_reserve_node_from_reserve_list_db(
-                    jsonData.get("cluster_port"),
-                    jsonData.get("hostname"),
-                    session)
-                # If reserve node is None, set progress 3.
-                if recover_to is None:
-                    progress = 3
+            # If reserve node is None, set progress 3.
+            if recover_by == 0 and recover_to is None:
+                progress = 3
 
             def strp_time(u_time):
                 """
@@ -250,91 +488,191 @@ class RecoveryControllerUtilDb(object):
             LOG.error(e.message)
 
             raise e
-        # Todo: (sampath) correct the exceptions catching
-        # Insert to notification_list DB.
+
+        row = {
+            "create_at": create_at,
+            "update_at": update_at,
+            "delete_at": delete_at,
+            "deleted": deleted,
+            "notification_id": jsonData.get("id"),
+            "notification_type": jsonData.get("type"),
+            "notification_regionID": jsonData.get("regionID"),
+            "notification_hostname": jsonData.get("hostname"),
+            "notification_uuid": jsonData.get("uuid"),
+            "notification_time": notification_time,
+            "notification_eventID": jsonData.get("eventID"),
+            "notification_eventType": jsonData.get("eventType"),
+            "notification_detail": jsonData.get("detail"),
+            "notification_startTime": notification_startTime,
+            "notification_endTime": j_endTime,
+            "notification_tzname": jsonData.get("tzname"),
+            "notification_daylight": jsonData.get("daylight"),
+            "notification_cluster_port": jsonData.get("cluster_port"),
+            "progress": progress,
+            "recover_by": recover_by,
+            "iscsi_ip": iscsi_ip,
+            "controle_ip": controle_ip,
+            "recover_to": recover_to
+        }
+
+        return row
+
+    def _make_notification_list_dic(self, jsonData, row):
+        # The times are returned as they were notified.
+        ret_dic = dict(row)
+        ret_dic["notification_time"] = jsonData.get("time")
+        ret_dic["notification_startTime"] = jsonData.get("startTime")
+
+        return ret_dic
+
+    @log_process_begin_and_end.output_log
+    def _get_reserve_node_from_reserve_list_db(self,
+                                               cluster_port,
+                                               notification_hostname,
+                                               session):
+        """
+        Get reserve node as a hint of the recovery destination.
+        The node is not taken here. It is taken by claim_reserve_node when
+        the instances are recovered.
+        :param: cluster_port: select keys, cluster port number.
+        :param: notification_hostname: The failed host name
+        :param :session: session object
+        :return: hostname: Host name of the spare node machine
+                            (obtained from the spare node list table)
+
+        """
 
         try:
-            msg = "Do add_notification_list."
+            msg = "Do get_reserve_list_candidates."
             LOG.info(msg)
-            result = dbapi.add_notification_list(
+            candidates = dbapi.get_reserve_list_candidates(
                 session,
-                create_at=create_at,
-                update_at=update_at,
-                delete_at=delete_at,
-                deleted=deleted,
-                notification_id=jsonData.get("id"),
-                notification_type=jsonData.get("type"),
-                notification_regionID=jsonData.get("regionID"),
-                notification_hostname=jsonData.get("hostname"),
-                notification_uuid=jsonData.get("uuid"),
-                notification_time=notification_time,
-                notification_eventID=jsonData.get("eventID"),
-                notification_eventType=jsonData.get("eventType"),
-                notification_detail=jsonData.get("detail"),
-                notification_startTime=notification_startTime,
-                notification_endTime=j_endTime,
-                notification_tzname=jsonData.get("tzname"),
-                notification_daylight=jsonData.get("daylight"),
-                notification_cluster_port=jsonData.get("cluster_port"),
-                progress=progress,
-                recover_by=recover_by,
-                iscsi_ip=iscsi_ip,
-                controle_ip=controle_ip,
-                recover_to=recover_to
+                cluster_port,
+                notification_hostname
             )
-            msg = "Succeeded in add_notification_list. " \
-                + "Return_value = " + str(result)
+            msg = "Succeeded in get_reserve_list_candidates. " \
+                + "Return_value = " + str(candidates)
             LOG.info(msg)
 
-            msg = "Do get_all_reserve_list_by_hostname_not_deleted."
+            if not candidates:
+                msg = "The reserve node not exist in reserve_list DB."
+                LOG.warning(msg)
+                hostname = None
+            else:
+                hostname = candidates[0].hostname
+
+        except Exception as e:
+
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+
+            LOG.error(e.message)
+
+            raise e
+
+        return hostname
+
+    @log_process_begin_and_end.output_log
+    def _get_reserve_nodes_from_reserve_list_db(self, cluster_ports,
+                                                excluded_hostnames,
+                                                session):
+        """
+        Get reserve nodes as hints of the recovery destinations of a batch
+        of notifications with one query.
+        :param: cluster_ports: The cluster ports of the node notifications
+        :param: excluded_hostnames: The host names in the batch
+        :param :session: session object
+        :return: The dictionary of cluster port and host name of its first
+                 reserve node. The cluster ports without any reserve node
+                 are not included.
+        """
+
+        try:
+            msg = "Do get_reserve_list_candidates_by_cluster_ports."
             LOG.info(msg)
-            cnt = dbapi.get_all_reserve_list_by_hostname_not_deleted(
-                session,
-                jsonData.get("hostname")
-            )
-            msg = "Succeeded in get_all_reserve_list_by_hostname_not_deleted. " \
-                + "Return_value = " + str(cnt)
+            candidates = dbapi.get_reserve_list_candidates_by_cluster_ports(
+                session, list(cluster_ports), list(excluded_hostnames))
+            msg = "Succeeded in " \
+                + "get_reserve_list_candidates_by_cluster_ports. " \
+                + "Return_value = " + str(candidates)
             LOG.info(msg)
 
-            if len(cnt) > 0:
-                msg = "Do update_reserve_list_by_hostname_as_deleted."
+        except Exception as e:
+
+            error_type, error_value, traceback_ = sys.exc_info()
+            tb_list = traceback.format_tb(traceback_)
+            LOG.error(error_type)
+            LOG.error(error_value)
+            for tb in tb_list:
+                LOG.error(tb)
+
+            LOG.error(e.message)
+
+            raise e
+
+        reserve_nodes = {}
+        for reserve_id, cluster_port, hostname in candidates:
+            reserve_nodes.setdefault(cluster_port, hostname)
+
+        return reserve_nodes
+
+    @log_process_begin_and_end.output_log
+    def claim_reserve_node(self, session, cluster_port,
+                           notification_hostname, hint, accept=None):
+        """
+        Take a reserve node without locking reserve_list table.
+        The candidates are tried in order, starting from the hint, until
+        one of them is taken. A candidate taken by another recovery at the
+        same time is skipped.
+        :param :session: session object
+        :param :cluster_port: select keys, cluster port number.
+        :param :notification_hostname: The failed host name
+        :param :hint: Host name of the reserve node chosen when the
+                      notification was received, or None
+        :param :accept: The function called with the host name of a
+                        candidate, which returns False not to take it.
+                        All the candidates are taken if it is None.
+        :return: hostname: Host name of the taken reserve node, or None if
+                           no reserve node is left
+        """
+
+        try:
+            msg = "Do get_reserve_list_candidates."
+            LOG.info(msg)
+            candidates = dbapi.get_reserve_list_candidates(
+                session, cluster_port, notification_hostname)
+            msg = "Succeeded in get_reserve_list_candidates. " \
+                + "Return_value = " + str(candidates)
+            LOG.info(msg)
+
+            # Try the hint first, then the others in create_at order.
+            candidates.sort(key=lambda c: c.hostname != hint)
+
+            for reserve_id, hostname in candidates:
+                if accept is not None and not accept(hostname):
+                    msg = "The reserve node " + hostname \
+                        + " is not accepted, try the next one."
+                    LOG.info(msg)
+                    continue
+
+                msg = "Do claim_reserve_list_by_id. hostname=" + hostname
                 LOG.info(msg)
-                dbapi.update_reserve_list_by_hostname_as_deleted(
-                    session,
-                    jsonData.get("hostname"),
-                    datetime.datetime.now()
-                )
-                msg = "Succeeded in " \
-                    + "update_reserve_list_by_hostname_as_deleted."
+                cnt = dbapi.claim_reserve_list_by_id(
+                    session, reserve_id, datetime.datetime.now())
+                msg = "Succeeded in claim_reserve_list_by_id. " \
+                    + "Return_value = " + str(cnt)
                 LOG.info(msg)
 
-            ret_dic = {
-                "create_at": create_at,
-                "update_at": update_at,
-                "delete_at": delete_at,
-                "deleted": deleted,
-                "notification_id": jsonData.get("id"),
-                "notification_type": jsonData.get("type"),
-                "notification_regionID": jsonData.get("regionID"),
-                "notification_hostname": jsonData.get("hostname"),
-                "notification_uuid": jsonData.get("uuid"),
-                "notification_time": jsonData.get("time"),
-                "notification_eventID": jsonData.get("eventID"),
-                "notification_eventType": jsonData.get("eventType"),
-                "notification_detail": jsonData.get("detail"),
-                "notification_startTime": jsonData.get("startTime"),
-                "notification_endTime": j_endTime,
-                "notification_tzname": jsonData.get("tzname"),
-                "notification_daylight": jsonData.get("daylight"),
-                "notification_cluster_port": jsonData.get("cluster_port"),
-                "progress": progress,
-                "recover_by": recover_by,
-                "iscsi_ip": iscsi_ip,
-                "controle_ip": controle_ip,
-                "recover_to": recover_to
-            }
-
-            return ret_dic
+                if cnt:
+                    return hostname
+
+                msg = "The reserve node " + hostname \
+                    + " was taken by another recovery, try the next one."
+                LOG.info(msg)
 
         except Exception as e:
 
@@ -349,42 +687,28 @@ class RecoveryControllerUtilDb(object):
 
             raise e
 
+        msg = "The reserve node not exist in reserve_list DB."
+        LOG.warning(msg)
+        return None
+
     @log_process_begin_and_end.output_log
-    def _get_reserve_node_from_reserve_list_db(self,
-                                               cluster_port,
-                                               notification_hostname,
-                                               session):
+    def release_reserve_node(self, session, cluster_port, hostname):
         """
-        Get reserve node, check it in use and change to 'enable'.
-        :param: con_args: args database connection.
-        :param: cluster_port: select keys, cluster port number.
-        :param :cursor: cursor object
-        :return: hostname: Host name of the spare node machine
-                            (obtained from the spare node list table)
-
+        Give back the reserve node taken by claim_reserve_node but not used.
+        :param :session: session object
+        :param :cluster_port: cluster port number of the reserve node
+        :param :hostname: Host name of the reserve node
         """
 
         try:
-            # Todo(sampath): write the test codes
-            #                Check it
-            msg = "Do get_one_reserve_list_by_cluster_port_for_update."
+            msg = "Do release_reserve_list_by_hostname. hostname=" + hostname
             LOG.info(msg)
-            cnt = dbapi.get_one_reserve_list_by_cluster_port_for_update(
-                session,
-                cluster_port,
-                notification_hostname
-            )
-            msg = "Succeeded in get_one_reserve_list_by_cluster_port_for_update. " \
+            cnt = dbapi.release_reserve_list_by_hostname(
+                session, cluster_port, hostname)
+            msg = "Succeeded in release_reserve_list_by_hostname. " \
                 + "Return_value = " + str(cnt)
             LOG.info(msg)
 
-            if not cnt:
-                msg = "The reserve node not exist in reserve_list DB."
-                LOG.warning(msg)
-                hostname = None
-            if not isinstance(cnt, (list, tuple)):
-                hostname = cnt.hostname
-
         except Exception as e:
 
             error_type, error_value, traceback_ = sys.exc_info()
@@ -398,8 +722,6 @@ class RecoveryControllerUtilDb(object):
 
             raise e
 
-        return hostname
-
     @log_process_begin_and_end.output_log
     def update_notification_list_db(self, session, key, value,
                                     notification_id):
@@ -473,12 +795,15 @@ class RecoveryControllerUtilDb(object):
             raise KeyError
 
     @log_process_begin_and_end.output_log
-    def update_vm_list_db(self,  session, key, value, primary_id):
+    def update_vm_list_db(self,  session, key, value, primary_id,
+                          recovery_sec=None):
         """
         VM list table update
         :param :key: Update column name
         :param :value: Updated value
         :param :uuid: VM of uuid (updated narrowing condition of VM list table)
+        :param :recovery_sec: The seconds the recovery took, recorded with
+         the end of the progress
         """
 
         try:
@@ -493,17 +818,29 @@ class RecoveryControllerUtilDb(object):
                 update_val['update_at'] = now
                 update_val['progress'] = value
                 update_val['delete_at'] = now
+                if recovery_sec is not None:
+                    update_val['recovery_sec'] = recovery_sec
             # Update than progress
             else:
                 if hasattr(VmList, key):
                     update_val[key] = value
                 else:
                     raise AttributeError
-            msg = "Do update_vm_list_by_id_dict."
-            LOG.info(msg)
-            dbapi.update_vm_list_by_id_dict(session, primary_id, update_val)
-            msg = "Succeeded in update_vm_list_by_id_dict."
-            LOG.info(msg)
+            if self.rc_journal is not None:
+                # Only the end of the progress is waited to be written.
+                msg = "Do rc_journal.put."
+                LOG.info(msg)
+                self.rc_journal.put(primary_id, update_val,
+                                    durable=key == 'progress' and value != 1)
+                msg = "Succeeded in rc_journal.put."
+                LOG.info(msg)
+            else:
+                msg = "Do update_vm_list_by_id_dict."
+                LOG.info(msg)
+                dbapi.update_vm_list_by_id_dict(session, primary_id,
+                                                update_val)
+                msg = "Succeeded in update_vm_list_by_id_dict."
+                LOG.info(msg)
 
         except AttributeError:
             error_type, error_value, traceback_ = sys.exc_info()
@@ -556,10 +893,26 @@ class RecoveryControllerUtilApi(object):
 
     KEYSTONE_API_VERSION = '3'
     NOVA_API_VERSION = '2'
+    # The microversion which supports forcing down a compute service
+    NOVA_FORCE_DOWN_API_VERSION = '2.11'
+    SERVER_LIST_PAGE_SIZE = 1000
 
     def __init__(self, config_object):
         self.rc_config = config_object
 
+        conf_dic = self.rc_config.get_value('recover_starter')
+        api_retries = conf_dic.get('api_max_retry_cnt')
+        # Keep a connection for each recovery job which can call nova at
+        # the same time.
+        self.pool_size = executor.get_max_slot_cnt(self.rc_config) + \
+            _API_POOL_EXTRA_SIZE
+        self.governor = governor.NovaApiGovernor(
+            float(conf_dic.get('api_rate_limit')),
+            int(conf_dic.get('api_rate_burst')),
+            int(api_retries),
+            float(conf_dic.get('api_retry_interval')),
+            float(conf_dic.get('api_retry_budget_ratio')))
+
         project_id = self._fetch_project_id()
         auth_args = {
             'auth_url': self.rc_config.conf_nova['auth_url'],
@@ -571,23 +924,61 @@ class RecoveryControllerUtilApi(object):
         }
 
         self.auth_session = self._get_session(auth_args)
-
-        conf_dic = self.rc_config.get_value('recover_starter')
-        api_retries = conf_dic.get('api_max_retry_cnt')
+        self.auth_session.auth.MIN_TOKEN_LIFE_SECONDS = \
+            _TOKEN_REFRESH_MARGIN_SEC
 
         self.nova_client = nova_client.Client(self.NOVA_API_VERSION,
                                               session=self.auth_session,
                                               connect_retries=api_retries,
                                               logger=LOG.logger)
+        self.nova_client_force_down = nova_client.Client(
+            self.NOVA_FORCE_DOWN_API_VERSION,
+            session=self.auth_session,
+            connect_retries=api_retries,
+            logger=LOG.logger)
+
+        th = threading.Thread(target=self._refresh_token,
+                              name='Thread:token_refresher')
+        th.daemon = True
+        th.start()
 
     def _get_session(self, auth_args):
         """ Return Keystone API session object."""
         loader = loading.get_plugin_loader('password')
         auth = loader.load_from_options(**auth_args)
-        sess = session.Session(auth=auth)
+        # Keep as many connections as the threads calling the APIs.
+        http_session = requests.Session()
+        for scheme in ('https://', 'http://'):
+            http_session.mount(scheme, session.TCPKeepAliveAdapter(
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size))
+        sess = session.Session(auth=auth, session=http_session)
 
         return sess
 
+    def _refresh_token(self):
+        """
+        Get the token again before it expires, so that the recovery threads
+        do not wait for Keystone.
+        """
+        while True:
+            try:
+                self.auth_session.get_token()
+            except:
+                error_type, error_value, traceback_ = sys.exc_info()
+                tb_list = traceback.format_tb(traceback_)
+                LOG.error(error_type)
+                LOG.error(error_value)
+                for tb in tb_list:
+                    LOG.error(tb)
+            time.sleep(_TOKEN_REFRESH_INTERVAL_SEC)
+
+    def authenticate(self):
+        """Get the token of the session, unless it is already valid."""
+        msg = 'Get the token of Keystone session'
+        LOG.info(msg)
+        self.auth_session.get_token()
+
     def _fetch_project_id(self):
         auth_args = {
             'auth_url': self.rc_config.conf_nova['auth_url'],
@@ -602,8 +993,7 @@ class RecoveryControllerUtilApi(object):
         ks_client = keystone_client.Client(self.KEYSTONE_API_VERSION,
                                            session=sess)
         project_name = self.rc_config.conf_nova['project_name']
-        projects = filter(lambda x: (x.name == project_name),
-                          ks_client.projects.list())
+        projects = ks_client.projects.list(name=project_name)
 
         if len(projects) != 1:
             msg = ("Project name: %s doesn't exist in project list."
@@ -621,7 +1011,9 @@ class RecoveryControllerUtilApi(object):
         try:
             msg = ('Call Server Details API with %s' % uuid)
             LOG.info(msg)
-            server = self.nova_client.servers.get(uuid)
+            server = self.governor.call('Server Details API',
+                                        self.nova_client.servers.get,
+                                        (uuid,))
 
         except exceptions.ClientException as e:
             msg = 'Fails to call Nova get Server Details API: %s' % e
@@ -640,7 +1032,9 @@ class RecoveryControllerUtilApi(object):
         try:
             msg = ('Call Stop API with %s' % uuid)
             LOG.info(msg)
-            self.nova_client.servers.stop(uuid)
+            self.governor.call('Server Stop API',
+                               self.nova_client.servers.stop, (uuid,),
+                               idempotent=False)
 
         except exceptions.Conflict as e:
             msg = "Server instance %s is already in stopped." % uuid
@@ -662,7 +1056,9 @@ class RecoveryControllerUtilApi(object):
         try:
             msg = ('Call Start API with %s' % uuid)
             LOG.info(msg)
-            self.nova_client.servers.start(uuid)
+            self.governor.call('Server Start API',
+                               self.nova_client.servers.start, (uuid,),
+                               idempotent=False)
 
         except exceptions.Conflict as e:
             msg = "Server instance %s is already in active." % uuid
@@ -685,7 +1081,9 @@ class RecoveryControllerUtilApi(object):
             msg = ('Call Reset State API with %s to %s' %
                    (uuid, status))
             LOG.info(msg)
-            self.nova_client.servers.reset_state(uuid, status)
+            self.governor.call('Server Reset State API',
+                               self.nova_client.servers.reset_state,
+                               (uuid, status))
 
         except exceptions.ClientException as e:
             msg = 'Fails to call Nova Server Reset State API: %s' % e
@@ -693,7 +1091,11 @@ class RecoveryControllerUtilApi(object):
             raise EnvironmentError(msg)
 
     def fetch_servers_on_hypervisor(self, hypervisor):
-        """Fetch server instance list on the hypervisor.
+        """Fetch server instance details on the hypervisor.
+
+        The servers are listed in pages of SERVER_LIST_PAGE_SIZE servers.
+        The details carry the vm_state and the metadata which the recovery
+        of each server needs, so no Server Details API is called for them.
 
         :hypervisor : hypervisor's hostname
         :return : A list of servers
@@ -705,16 +1107,141 @@ class RecoveryControllerUtilApi(object):
         try:
             msg = ('Fetch Server list on %s' % hypervisor)
             LOG.info(msg)
-            servers = self.nova_client.servers.list(detailed=False,
-                                                    search_opts=opts)
+            return self._list_servers(opts)
 
-            return [s.id for s in servers]
+        except exceptions.ClientException as e:
+            msg = 'Fails to call Nova Servers List API: %s' % e
+            LOG.error(msg)
+            raise
+
+    def fetch_all_servers(self):
+        """Fetch server instance details of all projects.
+
+        :return : A list of servers
+        """
+        opts = {
+            'all_tenants': True,
+        }
+        try:
+            msg = 'Fetch all Server list'
+            LOG.info(msg)
+            return self._list_servers(opts)
 
         except exceptions.ClientException as e:
             msg = 'Fails to call Nova Servers List API: %s' % e
             LOG.error(msg)
             raise
 
+    def fetch_servers_changed_since(self, since):
+        """Fetch server instance details changed since the time.
+
+        :since : The time in UTC
+        :return : A list of servers
+        """
+        opts = {
+            'changes-since': since.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'all_tenants': True,
+        }
+        try:
+            msg = ('Fetch Server list changed since %s'
+                   % opts['changes-since'])
+            LOG.info(msg)
+            return self._list_servers(opts)
+
+        except exceptions.ClientException as e:
+            msg = 'Fails to call Nova Servers List API: %s' % e
+            LOG.error(msg)
+            raise
+
+    def _list_servers(self, opts):
+        """List server instance details in pages of SERVER_LIST_PAGE_SIZE."""
+        servers = []
+        marker = None
+        while True:
+            page = self.governor.call(
+                'Servers List API', self.nova_client.servers.list,
+                kwargs={'detailed': True, 'search_opts': opts,
+                        'marker': marker,
+                        'limit': self.SERVER_LIST_PAGE_SIZE})
+            servers.extend(page)
+            if len(page) < self.SERVER_LIST_PAGE_SIZE:
+                break
+            marker = page[-1].id
+
+        return servers
+
+    def fetch_server_resources(self, servers):
+        """Fetch the resources of server instances.
+
+        :servers : A list of servers fetched with the details
+        :return : A dictionary of server id and (vcpus, memory_mb) of its
+                  flavor. The servers whose flavor is not found are not
+                  included.
+        """
+        try:
+            flavors = {}
+            resources = {}
+            for server in servers:
+                flavor_id = server.flavor.get('id')
+                if flavor_id not in flavors:
+                    try:
+                        flavor = self.governor.call(
+                            'Flavor Details API',
+                            self.nova_client.flavors.get, (flavor_id,))
+                        flavors[flavor_id] = (flavor.vcpus, flavor.ram)
+                    except exceptions.NotFound:
+                        msg = ('Flavor %s of server %s is not found.'
+                               % (flavor_id, server.id))
+                        LOG.warning(msg)
+                        flavors[flavor_id] = None
+                if flavors[flavor_id] is not None:
+                    resources[server.id] = flavors[flavor_id]
+
+            return resources
+
+        except exceptions.ClientException as e:
+            msg = 'Fails to call Nova Flavor Details API: %s' % e
+            LOG.error(msg)
+            raise
+
+    def fetch_hypervisor_free_resources(self):
+        """Fetch the free resources of the hypervisors.
+
+        The capacity is overcommitted by cpu_allocation_ratio and
+        ram_allocation_ratio in [recover_starter] section, which have to be
+        the same as nova-scheduler, as the hypervisor API does not show
+        them.
+
+        :return : A dictionary of hostname and (free vcpus, free memory_mb)
+        """
+        try:
+            conf_dic = self.rc_config.get_value('recover_starter')
+            cpu_ratio = float(conf_dic.get('cpu_allocation_ratio'))
+            ram_ratio = float(conf_dic.get('ram_allocation_ratio'))
+
+            msg = 'Call Hypervisors List API'
+            LOG.info(msg)
+            hypervisors = self.governor.call(
+                'Hypervisors List API', self.nova_client.hypervisors.list)
+
+            resources = {}
+            for hypervisor in hypervisors:
+                service = getattr(hypervisor, 'service', None) or {}
+                hostname = service.get('host',
+                                       hypervisor.hypervisor_hostname)
+                resources[hostname] = (
+                    int(hypervisor.vcpus * cpu_ratio) -
+                    hypervisor.vcpus_used,
+                    int(hypervisor.memory_mb * ram_ratio) -
+                    hypervisor.memory_mb_used)
+
+            return resources
+
+        except exceptions.ClientException as e:
+            msg = 'Fails to call Nova Hypervisors List API: %s' % e
+            LOG.error(msg)
+            raise
+
     def disable_host_status(self, hostname):
         """Disable host' status.
 
@@ -723,13 +1250,39 @@ class RecoveryControllerUtilApi(object):
         try:
             msg = ('Disable nova-compute on %s' % hostname)
             LOG.info(msg)
-            self.nova_client.services.disable(hostname, 'nova-compute')
+            self.governor.call('Service Disable API',
+                               self.nova_client.services.disable,
+                               (hostname, 'nova-compute'))
 
         except exceptions.ClientException as e:
             msg = 'Fails to disable nova-compute on %s: %s' % (hostname, e)
             LOG.error(msg)
             raise
 
+    def force_down_host(self, hostname, force_down=True):
+        """Force down (or unset it) nova-compute on the host.
+
+        nova regards the service as down at once, without waiting for the
+        service report to time out. Call it only for a fenced host.
+
+        :hostname: Target host name
+        :force_down: False to unset the forced down
+        """
+        try:
+            msg = ('Set forced_down=%s to nova-compute on %s'
+                   % (force_down, hostname))
+            LOG.info(msg)
+            self.governor.call(
+                'Service Force Down API',
+                self.nova_client_force_down.services.force_down,
+                (hostname, 'nova-compute', force_down))
+
+        except exceptions.ClientException as e:
+            msg = ('Fails to set forced_down=%s to nova-compute on %s: %s'
+                   % (force_down, hostname, e))
+            LOG.error(msg)
+            raise
+
     def do_instance_evacuate(self, uuid, targethost):
         """Call evacuate API for server instance.
 
@@ -740,8 +1293,11 @@ class RecoveryControllerUtilApi(object):
             msg = ('Call Evacuate API with %s to %s' %
                    (uuid, targethost))
             LOG.info(msg)
-            self.nova_client.servers.evacuate(uuid, host=targethost,
-                                              on_shared_storage=True)
+            self.governor.call('Server Evacuate API',
+                               self.nova_client.servers.evacuate, (uuid,),
+                               {'host': targethost,
+                                'on_shared_storage': True},
+                               idempotent=False)
 
         except exceptions.ClientException as e:
             msg = ('Fails to call Instance Evacuate API onto %s: %s'
@@ -749,29 +1305,37 @@ class RecoveryControllerUtilApi(object):
             LOG.error(msg)
             raise
 
-    def check_compute_node_state(self, hostname, state):
-        """Check state (up or down) of specified compute node.
+    def fetch_compute_services(self):
+        """Fetch nova-compute services.
 
-        :hostname : hostname of compute node to check state.
-        :state : return True if current state of target compute node equals this value.
+        :return : A list of nova-compute services
         """
         try:
-            msg = 'Call compute services API with hostname={0} state={1}'.format(hostname, state)
+            msg = 'Call compute services API'
             LOG.info(msg)
-            services = self.nova_client.services.list()
-            for service in services:
-                if service.binary != 'nova-compute':
-                    continue
-                if service.host == hostname and service.state == state:
-                    return True
-            return False
+            return self.governor.call('Services List API',
+                                      self.nova_client.services.list,
+                                      kwargs={'binary': 'nova-compute'})
 
         except exceptions.ClientException as e:
-            msg = 'Fails to Call compute services API with hostname={0} state={1}: {2}'.format(hostname, state, e)
+            msg = 'Fails to Call compute services API: %s' % e
             LOG.error(msg)
             raise
 
 
+def get_util_api(config_object):
+    """
+    Return the RecoveryControllerUtilApi object shared in the process.
+    """
+    global _UTIL_API
+
+    with _UTIL_API_LOCK:
+        if _UTIL_API is None:
+            _UTIL_API = RecoveryControllerUtilApi(config_object)
+
+    return _UTIL_API
+
+
 class RecoveryControllerUtil(object):
 
     def make_thread_name(self, table_name, record_identifier):
@@ -24,10 +24,12 @@ import traceback
 import sys
 import json
 import datetime
+import time
 # import masakari_config as config
+import masakari_executor as executor
+import masakari_poller as poller
 import masakari_util as util
 import os
-from eventlet import greenthread
 parentdir = os.path.abspath(os.path.join(os.path.dirname(__file__),
                                          os.path.pardir))
 # rootdir = os.path.abspath(os.path.join(parentdir, os.path.pardir))
@@ -53,7 +55,10 @@ class RecoveryControllerWorker(object):
     def __init__(self, config_object):
         self.rc_config = config_object
         self.rc_util_db = util.RecoveryControllerUtilDb(self.rc_config)
-        self.rc_util_api = util.RecoveryControllerUtilApi(self.rc_config)
+        self.rc_util_api = util.get_util_api(self.rc_config)
+        self.rc_executor = executor.get_executor(self.rc_config)
+        self.rc_state_poller = poller.get_instance_state_poller(
+            self.rc_config, self.rc_util_api)
 
         self.STATUS_NORMAL = 0
         self.STATUS_ERROR = 1
@@ -64,24 +69,14 @@ class RecoveryControllerWorker(object):
     def _get_vm_param(self, uuid):
 
         try:
-            # Initalize return values.
-            conf_dic = self.rc_config.get_value('recover_starter')
-            api_max_retry_cnt = conf_dic.get('api_max_retry_cnt')
-            api_retry_interval = conf_dic.get('api_retry_interval')
-            cnt = 0
-            while cnt < int(api_max_retry_cnt) + 1:
-                try:
-                    # Call nova show API.
-                    server = self.rc_util_api.do_instance_show(uuid)
-                    return server
-                except Exception:
-                    if cnt == int(api_max_retry_cnt):
-                        raise EnvironmentError("Failed to nova show API.")
-                    else:
-                        msg = (" Retry nova show API.")
-                        LOG.info(msg)
-                        greenthread.sleep(int(api_retry_interval))
-                        cnt += 1
+            # Call nova show API. The governor of the API retries it on the
+            # overload and the transient errors, e.g. 5xx and the connection
+            # failures.
+            try:
+                server = self.rc_util_api.do_instance_show(uuid)
+                return server
+            except Exception:
+                raise EnvironmentError("Failed to nova show API.")
 
         except EnvironmentError:
             error_type, error_value, traceback_ = sys.exc_info()
@@ -153,9 +148,12 @@ class RecoveryControllerWorker(object):
 
         return recover_by, recover_to
 
-    @log_process_begin_and_end.output_log
-    def _execute_recovery(self, session, uuid, vm_state, HA_Enabled,
+    def _execute_recovery(self, uuid, vm_state, HA_Enabled,
                           recover_by, recover_to):
+        """
+        Execute the recovery of the VM as a generator job of the recovery
+        executor. The status is returned by executor.Return.
+        """
 
         # Initalize status.
         res = self.STATUS_NORMAL
@@ -170,7 +168,7 @@ class RecoveryControllerWorker(object):
                 if vm_state == 'active' or \
                         vm_state == 'stopped' or \
                         vm_state == 'resized':
-                    res = self._do_node_accident_vm_recovery(
+                    res = yield self._do_node_accident_vm_recovery(
                         uuid, vm_state, recover_to)
                 else:
                     msg = "Inapplicable vm. instance_uuid = '%s', " \
@@ -184,18 +182,20 @@ class RecoveryControllerWorker(object):
         # For vm accident.
         elif recover_by == 1:
             if HA_Enabled == 'ON':
-                res = self._do_process_accident_vm_recovery(
+                res = yield self._do_process_accident_vm_recovery(
                     uuid, vm_state)
 
             elif HA_Enabled == 'OFF':
                 res = self._skip_process_accident_vm_recovery(
                     uuid, vm_state)
 
-        return res
+        raise executor.Return(res)
 
-    @log_process_begin_and_end.output_log
     def _do_node_accident_vm_recovery(self, uuid, vm_state, evacuate_node):
-
+        """
+        Evacuate the VM as a generator job of the recovery executor. The
+        status is returned by executor.Return.
+        """
         try:
             # Initalize status.
             status = self.STATUS_NORMAL
@@ -206,7 +206,14 @@ class RecoveryControllerWorker(object):
             if vm_state == 'resized':
                 self.rc_util_api.do_instance_reset(uuid, 'error')
 
-            self.rc_util_api.do_instance_evacuate(uuid, evacuate_node)
+            started_at = time.time()
+            with self.rc_executor.measuring('Evacuate API'):
+                self.rc_util_api.do_instance_evacuate(uuid, evacuate_node)
+
+            conf_dic = self.rc_config.get_value('recover_starter')
+            if conf_dic.get('evacuation_tracking', 'false').lower() == 'true':
+                yield self._wait_for_evacuation(uuid, evacuate_node,
+                                                started_at)
 
         except EnvironmentError:
             status = self.STATUS_ERROR
@@ -241,7 +248,53 @@ class RecoveryControllerWorker(object):
             for tb in tb_list:
                 LOG.error(tb)
 
-        return status
+        raise executor.Return(status)
+
+    def _wait_for_evacuation(self, uuid, evacuate_node, started_at):
+        """
+        Wait until the evacuation completes on the evacuate_node, without
+        holding the slot and the worker thread of the recovery executor.
+        The evacuation is requested again if the server became error on the
+        failed host.
+        :param started_at: The time the evacuation was requested
+        """
+        conf_dic = self.rc_config.get_value('recover_starter')
+        evacuation_timeout = int(conf_dic.get('evacuation_timeout'))
+        evacuation_max_retry_cnt = int(
+            conf_dic.get('evacuation_max_retry_cnt'))
+
+        cnt = 0
+        while True:
+            result = yield executor.Wait(
+                self.rc_state_poller.watch_evacuation, uuid, evacuate_node,
+                evacuation_timeout)
+
+            if result == 'done':
+                msg = ("Evacuation of %s to %s has completed in %.1f sec."
+                       % (uuid, evacuate_node, time.time() - started_at))
+                LOG.info(msg)
+                return
+
+            if result is None:
+                msg = ("Evacuation of %s to %s did not complete in %d sec."
+                       % (uuid, evacuate_node, evacuation_timeout))
+                raise EnvironmentError(msg)
+
+            # The server which is not moved to the evacuate_node yet can be
+            # evacuated again.
+            server = self._get_vm_param(uuid)
+            host = getattr(server, 'OS-EXT-SRV-ATTR:host', None)
+            if cnt >= evacuation_max_retry_cnt or host == evacuate_node:
+                msg = ("Evacuation of %s to %s has failed on %s."
+                       % (uuid, evacuate_node, host))
+                raise EnvironmentError(msg)
+
+            msg = ("Evacuation of %s to %s has failed on %s. Retry it."
+                   % (uuid, evacuate_node, host))
+            LOG.warning(msg)
+            with self.rc_executor.measuring('Evacuate API'):
+                self.rc_util_api.do_instance_evacuate(uuid, evacuate_node)
+            cnt += 1
 
     @log_process_begin_and_end.output_log
     def _skip_node_accident_vm_recovery(self, uuid, vm_state):
@@ -275,8 +328,11 @@ class RecoveryControllerWorker(object):
 
         return status
 
-    @log_process_begin_and_end.output_log
     def _do_process_accident_vm_recovery(self, uuid, vm_state):
+        """
+        Restart the VM as a generator job of the recovery executor. The
+        status is returned by executor.Return.
+        """
         # Initalize status.
         status = self.STATUS_NORMAL
 
@@ -287,33 +343,29 @@ class RecoveryControllerWorker(object):
             # in some race conditions, it could happen.
             if vm_state == 'stopped':
                 self.rc_util_api.do_instance_reset(uuid, 'stopped')
-                return status
+            else:
+                if vm_state == 'resized':
+                    self.rc_util_api.do_instance_reset(uuid, 'active')
 
-            if vm_state == 'resized':
-                self.rc_util_api.do_instance_reset(uuid, 'active')
+                with self.rc_executor.measuring('Stop API'):
+                    self.rc_util_api.do_instance_stop(uuid)
 
-            self.rc_util_api.do_instance_stop(uuid)
+                # Wait to be in the Stopped, without holding the slot and
+                # the worker thread of the recovery executor.
+                conf_dic = self.rc_config.get_value('recover_starter')
+                api_check_interval = conf_dic.get('api_check_interval')
+                api_check_max_cnt = conf_dic.get('api_check_max_cnt')
 
-            # Wait to be in the Stopped.
-            conf_dic = self.rc_config.get_value('recover_starter')
-            api_check_interval = conf_dic.get('api_check_interval')
-            api_check_max_cnt = conf_dic.get('api_check_max_cnt')
-            loop_cnt = 0
-
-            while loop_cnt < int(api_check_max_cnt):
-                vm_info = self._get_vm_param(uuid)
-                vm_state = getattr(vm_info, 'OS-EXT-STS:vm_state')
-                if vm_state == 'stopped':
-                    break
-                else:
-                    loop_cnt += 1
-                    greenthread.sleep(int(api_check_interval))
+                is_stopped = yield executor.Wait(
+                    self.rc_state_poller.watch_state, uuid, 'stopped',
+                    int(api_check_interval) * int(api_check_max_cnt))
 
-            if loop_cnt == int(api_check_max_cnt):
-                msg = "vm_state did not become stopped."
-                raise EnvironmentError(msg)
+                if not is_stopped:
+                    msg = "vm_state did not become stopped."
+                    raise EnvironmentError(msg)
 
-            self.rc_util_api.do_instance_start(uuid)
+                with self.rc_executor.measuring('Start API'):
+                    self.rc_util_api.do_instance_start(uuid)
 
         except EnvironmentError:
             status = self.STATUS_ERROR
@@ -332,7 +384,7 @@ class RecoveryControllerWorker(object):
             for tb in tb_list:
                 LOG.error(tb)
 
-        return status
+        raise executor.Return(status)
 
     @log_process_begin_and_end.output_log
     def _skip_process_accident_vm_recovery(self, uuid, vm_state):
@@ -377,14 +429,13 @@ class RecoveryControllerWorker(object):
         """
         try:
             self.rc_config.set_request_context()
-            db_engine = dbapi.get_engine(self.rc_config)
-            session = dbapi.get_session(db_engine)
-            self.rc_util_api.disable_host_status(hostname)
+            with dbapi.session_scope(self.rc_config) as session:
+                self.rc_util_api.disable_host_status(hostname)
 
-            if update_progress is True:
-                self.rc_util_db.update_notification_list_db(
-                    session,
-                    'progress', 2, notification_id)
+                if update_progress is True:
+                    self.rc_util_db.update_notification_list_db(
+                        session,
+                        'progress', 2, notification_id)
 
         except KeyError:
             error_type, error_value, traceback_ = sys.exc_info()
@@ -403,51 +454,53 @@ class RecoveryControllerWorker(object):
                 LOG.error(tb)
             return
 
-    @log_process_begin_and_end.output_log
-    def recovery_instance(self, uuid, primary_id, sem):
+    def recovery_instance(self, uuid, primary_id, sem=None, vm_info=None):
         """
-           Execute VM recovery.
+           Execute VM recovery as a generator job of the recovery executor.
            :param uuid: Recovery target VM UUID
            :param primary_id: Unique ID of the vm_list table
-           :param sem: Semaphore
+           :param sem: Semaphore. The multiplicity is limited by the
+                       recovery executor when it is None.
+           :param vm_info: The server details fetched with the server
+                           list. They are fetched by uuid when it is None.
         """
+        started_at = time.time()
         try:
-            sem.acquire()
+            if sem:
+                sem.acquire()
             self.rc_config.set_request_context()
-            db_engine = dbapi.get_engine(self.rc_config)
-            session = dbapi.get_session(db_engine)
-
-            # Initlize status.
-            status = self.STATUS_NORMAL
-
-            # Update vmha recovery status.
-            self.rc_util_db.update_vm_list_db(
-                session, 'progress', 1, primary_id)
-
-            # Get vm infomation.
-            vm_info = self._get_vm_param(uuid)
-            HA_Enabled = vm_info.metadata.get('HA-Enabled')
-            if HA_Enabled:
-                HA_Enabled = HA_Enabled.upper()
-            if HA_Enabled != 'OFF':
-                HA_Enabled = 'ON'
-
-            # Set recovery parameter.
-            exe_param = {}
-            exe_param['vm_state'] = getattr(vm_info, 'OS-EXT-STS:vm_state')
-            exe_param['HA-Enabled'] = HA_Enabled
-            recover_by, recover_to = self._get_vmha_param(
-                session, uuid, primary_id)
-            exe_param['recover_by'] = recover_by
-            exe_param['recover_to'] = recover_to
-
-            # Execute.
-            status = self._execute_recovery(session,
-                                            uuid,
-                                            exe_param.get("vm_state"),
-                                            exe_param.get("HA-Enabled"),
-                                            exe_param.get("recover_by"),
-                                            exe_param.get("recover_to"))
+            with dbapi.session_scope(self.rc_config) as session:
+                # Initlize status.
+                status = self.STATUS_NORMAL
+
+                # Update vmha recovery status.
+                self.rc_util_db.update_vm_list_db(
+                    session, 'progress', 1, primary_id)
+
+                # Get vm infomation.
+                if vm_info is None:
+                    vm_info = self._get_vm_param(uuid)
+                HA_Enabled = vm_info.metadata.get('HA-Enabled')
+                if HA_Enabled:
+                    HA_Enabled = HA_Enabled.upper()
+                if HA_Enabled != 'OFF':
+                    HA_Enabled = 'ON'
+
+                # Set recovery parameter.
+                exe_param = {}
+                exe_param['vm_state'] = getattr(vm_info, 'OS-EXT-STS:vm_state')
+                exe_param['HA-Enabled'] = HA_Enabled
+                recover_by, recover_to = self._get_vmha_param(
+                    session, uuid, primary_id)
+                exe_param['recover_by'] = recover_by
+                exe_param['recover_to'] = recover_to
+
+            # Execute. The session is not held while the recovery waits.
+            status = yield self._execute_recovery(uuid,
+                                                  exe_param.get("vm_state"),
+                                                  exe_param.get("HA-Enabled"),
+                                                  exe_param.get("recover_by"),
+                                                  exe_param.get("recover_to"))
 
         except EnvironmentError:
             status = self.STATUS_ERROR
@@ -478,21 +531,27 @@ class RecoveryControllerWorker(object):
             return
         finally:
             try:
-                # Successful execution.
-                if status == self.STATUS_NORMAL:
-                    self.rc_util_db.update_vm_list_db(
-                        session, 'progress', 2, primary_id)
-
-                    msg = "Recovery process has been completed successfully."
-                    LOG.info(msg)
+                recovery_sec = int(round(time.time() - started_at))
+                with dbapi.session_scope(self.rc_config) as session:
+                    # Successful execution.
+                    if status == self.STATUS_NORMAL:
+                        self.rc_util_db.update_vm_list_db(
+                            session, 'progress', 2, primary_id,
+                            recovery_sec=recovery_sec)
+
+                        msg = "Recovery process has been completed " \
+                            "successfully."
+                        LOG.info(msg)
 
-                # Abnormal termination.
-                else:
-                    self.rc_util_db.update_vm_list_db(
-                        session, 'progress', 3, primary_id)
+                    # Abnormal termination.
+                    else:
+                        self.rc_util_db.update_vm_list_db(
+                            session, 'progress', 3, primary_id,
+                            recovery_sec=recovery_sec)
 
-                    msg = "Recovery process has been terminated abnormally."
-                    LOG.info(msg)
+                        msg = "Recovery process has been terminated " \
+                            "abnormally."
+                        LOG.info(msg)
 
                 # Release semaphore
                 if sem:
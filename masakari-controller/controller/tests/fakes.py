@@ -18,8 +18,11 @@
 import mock
 
 class FakeNovaServer(mock.MagicMock):
-    def __init__(self, id, vm_state, metadata=None):
+    def __init__(self, id, vm_state, metadata=None, task_state=None,
+                 host=None):
         super(FakeNovaServer, self).__init__()
         self.id = id
         setattr(self, 'OS-EXT-STS:vm_state', vm_state)
+        setattr(self, 'OS-EXT-STS:task_state', task_state)
+        setattr(self, 'OS-EXT-SRV-ATTR:host', host)
         self.metadata = metadata if metadata is not None else {}
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import os
+import sqlite3
+import sys
+import unittest
+
+import mock
+from sqlalchemy import create_engine
+import sqlalchemy.exc as dbexc
+from sqlalchemy.orm import sessionmaker
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+import db.api as dbapi
+from db import models
+import masakari_config
+
+
+class TestEngine(unittest.TestCase):
+    def setUp(self):
+        sample_config = os.path.dirname(os.path.abspath(__file__)) +\
+            '/masakari-controller-test.conf'
+        self.rc_config = masakari_config.RecoveryControllerConfig(
+            sample_config)
+
+    def test_engine_is_shared(self):
+        eng = dbapi.get_engine(self.rc_config)
+
+        self.assertIs(eng, dbapi.get_engine(self.rc_config))
+
+    def test_pool_stats(self):
+        eng = dbapi.get_engine(self.rc_config)
+        before = dbapi.get_pool_stats()
+
+        conn = eng.connect()
+        self.assertEqual(before['checked_out_cnt'] + 1,
+                         dbapi.get_pool_stats()['checked_out_cnt'])
+        conn.close()
+
+        stats = dbapi.get_pool_stats()
+        self.assertEqual(before['checked_out_cnt'], stats['checked_out_cnt'])
+        self.assertEqual(before['checkout_cnt'] + 1, stats['checkout_cnt'])
+
+    def test_checkout_wait_is_measured(self):
+        timed_pool = dbapi._TimedQueuePool(
+            lambda: sqlite3.connect(':memory:'), pool_size=1,
+            max_overflow=0, timeout=0.1)
+        before = dbapi.get_pool_stats()
+
+        conn = timed_pool.connect()
+        # No connection is left until pool_timeout.
+        self.assertRaises(dbexc.TimeoutError, timed_pool.connect)
+        conn.close()
+
+        stats = dbapi.get_pool_stats()
+        self.assertGreaterEqual(stats['checkout_wait_total_sec'] -
+                                before['checkout_wait_total_sec'], 0.1)
+        self.assertGreaterEqual(stats['checkout_wait_max_sec'], 0.1)
+
+
+class TestSessionScope(unittest.TestCase):
+    def setUp(self):
+        sample_config = os.path.dirname(os.path.abspath(__file__)) +\
+            '/masakari-controller-test.conf'
+        self.rc_config = masakari_config.RecoveryControllerConfig(
+            sample_config)
+
+    def test_session_is_closed(self):
+        before = dbapi.get_session_stats()
+
+        with dbapi.session_scope(self.rc_config) as session:
+            session.execute('SELECT 1')
+            self.assertEqual(before['open_cnt'] + 1,
+                             dbapi.get_session_stats()['open_cnt'])
+
+        stats = dbapi.get_session_stats()
+        self.assertEqual(before['open_cnt'], stats['open_cnt'])
+        self.assertEqual(before['opened_cnt'] + 1, stats['opened_cnt'])
+        self.assertEqual(0, dbapi.get_pool_stats()['checked_out_cnt'])
+
+    def test_session_is_closed_on_error(self):
+        before = dbapi.get_session_stats()
+
+        def run():
+            with dbapi.session_scope(self.rc_config) as session:
+                session.execute('SELECT 1')
+                raise ValueError()
+
+        self.assertRaises(ValueError, run)
+        self.assertEqual(before['open_cnt'],
+                         dbapi.get_session_stats()['open_cnt'])
+        self.assertEqual(0, dbapi.get_pool_stats()['checked_out_cnt'])
+
+
+class TestSupersedeReprocessing(unittest.TestCase):
+    def setUp(self):
+        eng = create_engine('sqlite://')
+        models.Base.metadata.create_all(eng)
+        self.session = sessionmaker(bind=eng)()
+        self.now = datetime.datetime(2016, 1, 1, 0, 0, 0)
+
+    def tearDown(self):
+        self.session.close()
+
+    def _add_notification(self, id, hostname, uuid, recover_by, seconds):
+        self.session.add(models.NotificationList(
+            id=id, notification_id='id%d' % id,
+            notification_hostname=hostname, notification_uuid=uuid,
+            recover_by=recover_by, progress=0,
+            create_at=self.now + datetime.timedelta(seconds=seconds)))
+
+    def _progress(self, model, id):
+        return self.session.query(model.progress).filter_by(id=id).scalar()
+
+    def test_supersede_reprocessing_records(self):
+        self._add_notification(1, 'host1', 'uuid1', 1, 0)
+        self._add_notification(2, 'host1', 'uuid1', 1, 10)
+        self._add_notification(3, 'host2', '', 0, 0)
+        self._add_notification(4, 'host2', '', 0, 10)
+        self._add_notification(5, 'host3', 'uuid2', 1, 0)
+        self.session.commit()
+
+        result = dbapi.supersede_reprocessing_records(self.session, self.now)
+
+        self.assertEqual([2, 5, 4], [row.id for row in result])
+        self.assertEqual(4, self._progress(models.NotificationList, 1))
+        self.assertEqual(4, self._progress(models.NotificationList, 3))
+        self.assertEqual(0, self._progress(models.NotificationList, 2))
+
+    def test_supersede_reprocessing_vm_list(self):
+        for id, uuid, progress, recover_by, seconds in (
+                (1, 'uuid1', 0, 0, 10),
+                (2, 'uuid1', 1, 1, 20),
+                (3, 'uuid1', 0, 0, 0),
+                (4, 'uuid2', 2, 0, 0),
+                (5, 'uuid3', 1, 0, 0)):
+            self.session.add(models.VmList(
+                id=id, uuid=uuid, progress=progress, recover_by=recover_by,
+                create_at=self.now + datetime.timedelta(seconds=seconds)))
+        self.session.commit()
+
+        result = dbapi.supersede_reprocessing_vm_list(self.session, self.now)
+
+        self.assertEqual([1, 5], [row.id for row in result])
+        self.assertEqual(4, self._progress(models.VmList, 2))
+        self.assertEqual(4, self._progress(models.VmList, 3))
+        self.assertEqual(2, self._progress(models.VmList, 4))
+
+
+class TestExpireOldRecords(unittest.TestCase):
+    def setUp(self):
+        eng = create_engine('sqlite://')
+        models.Base.metadata.create_all(eng)
+        self.session = sessionmaker(bind=eng)()
+        self.now = datetime.datetime(2016, 1, 1, 0, 0, 0)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_expire_old_records_notification(self):
+        for id, progress, seconds in ((1, 0, -600), (2, 0, -600),
+                                      (3, 1, -600), (4, 0, 0)):
+            self.session.add(models.NotificationList(
+                id=id, notification_id='id%d' % id, progress=progress,
+                create_at=self.now + datetime.timedelta(seconds=seconds)))
+        self.session.commit()
+
+        cnt = dbapi.expire_old_records_notification(
+            self.session, self.now - datetime.timedelta(seconds=300),
+            self.now, ['id2'])
+
+        self.assertEqual(1, cnt)
+        self.assertEqual(
+            [(1, 4), (2, 0), (3, 1), (4, 0)],
+            self.session.query(models.NotificationList.id,
+                               models.NotificationList.progress).order_by(
+                models.NotificationList.id).all())
+
+    def test_expire_old_records_vm_list(self):
+        for id, progress, seconds in ((1, 0, -600), (2, 0, -600),
+                                      (3, 0, 0)):
+            self.session.add(models.VmList(
+                id=id, uuid='uuid%d' % id, progress=progress,
+                create_at=self.now + datetime.timedelta(seconds=seconds)))
+        self.session.commit()
+
+        cnt = dbapi.expire_old_records_vm_list(
+            self.session, self.now - datetime.timedelta(seconds=300),
+            self.now, [1])
+
+        self.assertEqual(1, cnt)
+        self.assertEqual(
+            [(1, 0), (2, 4), (3, 0)],
+            self.session.query(models.VmList.id,
+                               models.VmList.progress).order_by(
+                models.VmList.id).all())
+
+
+class TestGetRecentNotificationIds(unittest.TestCase):
+    def setUp(self):
+        eng = create_engine('sqlite://')
+        models.Base.metadata.create_all(eng)
+        self.session = sessionmaker(bind=eng)()
+        self.now = datetime.datetime(2016, 1, 1, 0, 0, 0)
+        for id, seconds in ((1, -600), (2, -100), (3, 0), (4, -200)):
+            self.session.add(models.NotificationList(
+                id=id, notification_id='id%d' % id,
+                notification_time=self.now + datetime.timedelta(
+                    seconds=seconds)))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_get_recent_notification_ids(self):
+        res = dbapi.get_recent_notification_ids(
+            self.session, self.now - datetime.timedelta(seconds=300), 10)
+
+        self.assertEqual(['id3', 'id2', 'id4'],
+                         [row.notification_id for row in res])
+
+    def test_limit(self):
+        res = dbapi.get_recent_notification_ids(
+            self.session, self.now - datetime.timedelta(seconds=300), 2)
+
+        self.assertEqual(['id3', 'id2'], [row.notification_id for row in res])
+
+
+class TestVmListBulk(unittest.TestCase):
+    def setUp(self):
+        eng = create_engine('sqlite://')
+        models.Base.metadata.create_all(eng)
+        self.session = sessionmaker(bind=eng)()
+        self.now = datetime.datetime(2016, 1, 1, 0, 0, 0, 123456)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_add_vm_list_bulk(self):
+        self.session.add(models.VmList(id=10, uuid='uuid1', progress=2))
+        self.session.add(models.VmList(id=11, uuid='uuid2', progress=1))
+        self.session.commit()
+
+        in_progress = dbapi.get_vm_list_uuids_in_progress(
+            self.session, ['uuid1', 'uuid2', 'uuid3'])
+        self.assertEqual(set(['uuid2']), in_progress)
+
+        result = dbapi.add_vm_list_bulk(
+            self.session, self.now, 'id1', ['uuid1', 'uuid3'], 0,
+            'host2', 0)
+
+        self.assertEqual(set(['uuid1', 'uuid3']), set(result))
+        row = self.session.query(models.VmList).filter_by(
+            id=result['uuid3']).one()
+        self.assertEqual(('uuid3', 0, 'id1', 'host2'),
+                         (row.uuid, row.progress, row.notification_id,
+                          row.recover_to))
+
+
+class TestNotificationListBulk(unittest.TestCase):
+    def setUp(self):
+        eng = create_engine('sqlite://')
+        models.Base.metadata.create_all(eng)
+        self.session = sessionmaker(bind=eng)()
+        self.now = datetime.datetime(2016, 1, 1, 0, 0, 0)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_add_notification_list_bulk(self):
+        rows = [dict(create_at=self.now, notification_id='id%d' % i,
+                     notification_hostname='host%d' % i, progress=0,
+                     recover_by=i % 2, recover_to=None)
+                for i in range(3)]
+
+        self.assertEqual(3, dbapi.add_notification_list_bulk(self.session,
+                                                             rows))
+        self.assertEqual(
+            [('id0', 'host0', 0), ('id1', 'host1', 1), ('id2', 'host2', 0)],
+            self.session.query(
+                models.NotificationList.notification_id,
+                models.NotificationList.notification_hostname,
+                models.NotificationList.recover_by).order_by(
+                    models.NotificationList.id).all())
+
+    def test_get_reserve_list_candidates_by_cluster_ports(self):
+        for id, cluster_port, hostname, seconds, deleted in (
+                (1, 'port1', 'host1', 10, 0),
+                (2, 'port1', 'host2', 0, 0),
+                (3, 'port2', 'host3', 0, 0),
+                (4, 'port2', 'host4', 0, 1),
+                (5, 'port3', 'host5', 0, 0),
+                (6, 'port1', 'failed', 0, 0)):
+            self.session.add(models.ReserveList(
+                id=id, cluster_port=cluster_port, hostname=hostname,
+                deleted=deleted,
+                create_at=self.now + datetime.timedelta(seconds=seconds)))
+        self.session.commit()
+
+        candidates = dbapi.get_reserve_list_candidates_by_cluster_ports(
+            self.session, ['port1', 'port2'], ['failed'])
+
+        self.assertEqual(
+            [(2, 'port1', 'host2'), (3, 'port2', 'host3'),
+             (1, 'port1', 'host1')],
+            [tuple(c) for c in candidates])
+
+
+class TestReserveListClaim(unittest.TestCase):
+    def setUp(self):
+        eng = create_engine('sqlite://')
+        models.Base.metadata.create_all(eng)
+        self.session = sessionmaker(bind=eng)()
+        self.now = datetime.datetime(2016, 1, 1, 0, 0, 0)
+
+    def tearDown(self):
+        self.session.close()
+
+    def _add_reserve(self, id, hostname, seconds, deleted=0):
+        self.session.add(models.ReserveList(
+            id=id, cluster_port='port1', hostname=hostname, deleted=deleted,
+            create_at=self.now + datetime.timedelta(seconds=seconds)))
+
+    def test_claim_reserve_list(self):
+        self._add_reserve(1, 'host1', 10)
+        self._add_reserve(2, 'host2', 0)
+        self._add_reserve(3, 'host3', 20, deleted=1)
+        self._add_reserve(4, 'failed', 30)
+        self.session.commit()
+
+        candidates = dbapi.get_reserve_list_candidates(
+            self.session, 'port1', 'failed')
+        self.assertEqual([(2, 'host2'), (1, 'host1')],
+                         [tuple(c) for c in candidates])
+
+        self.assertEqual(1, dbapi.claim_reserve_list_by_id(
+            self.session, 2, self.now))
+        # Already taken by the first claim
+        self.assertEqual(0, dbapi.claim_reserve_list_by_id(
+            self.session, 2, self.now))
+        self.assertEqual([(1, 'host1')], [tuple(c) for c in
+                         dbapi.get_reserve_list_candidates(
+                             self.session, 'port1', 'failed')])
+
+    def test_release_reserve_list(self):
+        self._add_reserve(1, 'host1', 0)
+        self.session.commit()
+        dbapi.claim_reserve_list_by_id(self.session, 1, self.now)
+
+        self.assertEqual(1, dbapi.release_reserve_list_by_hostname(
+            self.session, 'port1', 'host1'))
+        self.assertEqual([(1, 'host1')], [tuple(c) for c in
+                         dbapi.get_reserve_list_candidates(
+                             self.session, 'port1', 'failed')])
+
+
+class TestRetryOnDeadlock(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(dbapi.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _error(self, message):
+        return dbexc.OperationalError('UPDATE vm_list', {}, Exception(message))
+
+    def test_retry_until_success(self):
+        fn = mock.Mock(__name__='fn_success', side_effect=[
+            self._error('Deadlock found when trying to get lock'),
+            self._error('Lock wait timeout exceeded'), 'ok'])
+
+        self.assertEqual('ok', dbapi._retry_on_deadlock(fn)())
+        self.assertEqual(2, self.sleep.call_count)
+        self.assertEqual({'retry_cnt': 2, 'exhausted_cnt': 0},
+                         dbapi.get_retry_stats()['fn_success'])
+
+    def test_raise_after_max_retries(self):
+        fn = mock.Mock(__name__='fn_exhausted', side_effect=self._error(
+            'Deadlock found when trying to get lock'))
+
+        self.assertRaises(dbexc.OperationalError,
+                          dbapi._retry_on_deadlock(fn))
+        self.assertEqual(dbapi._LOCK_RETRY_MAX_CNT + 1, fn.call_count)
+        for args, kwargs in self.sleep.call_args_list:
+            self.assertTrue(0 <= args[0] <= dbapi._LOCK_RETRY_MAX_SEC)
+        self.assertEqual(1, dbapi.get_retry_stats()['fn_exhausted'][
+            'exhausted_cnt'])
+
+    def test_other_error_is_not_retried(self):
+        fn = mock.Mock(__name__='fn_other', side_effect=self._error(
+            'Unknown column'))
+
+        self.assertRaises(dbexc.OperationalError,
+                          dbapi._retry_on_deadlock(fn))
+        self.assertEqual(1, fn.call_count)
+        self.assertFalse(self.sleep.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+
+from sqlalchemy import create_engine, inspect
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+from db import migration
+from db import models
+
+
+class TestMigration(unittest.TestCase):
+    def setUp(self):
+        self.eng = create_engine('sqlite://')
+
+    def _index_names(self, table_name):
+        return set(i['name'] for i in
+                   inspect(self.eng).get_indexes(table_name))
+
+    def _column_names(self, table_name):
+        return set(c['name'] for c in
+                   inspect(self.eng).get_columns(table_name))
+
+    def test_upgrade_empty_database(self):
+        self.assertIsNone(migration.get_version(self.eng))
+
+        version = migration.upgrade(self.eng)
+
+        self.assertEqual(migration.LATEST_VERSION, version)
+        self.assertEqual(migration.LATEST_VERSION,
+                         migration.get_version(self.eng))
+        self.assertIn('vm_list_uuid_progress_create_at_idx',
+                      self._index_names('vm_list'))
+        self.assertIn('recovery_sec', self._column_names('vm_list'))
+
+    def test_upgrade_version_1(self):
+        # Tables created before schema_version table was introduced
+        for model in (models.NotificationList, models.VmList,
+                      models.ReserveList):
+            model.__table__.create(self.eng)
+            for index in model.__table__.indexes:
+                index.drop(self.eng)
+        self.eng.execute('ALTER TABLE vm_list DROP COLUMN recovery_sec')
+        self.assertEqual(1, migration.get_version(self.eng))
+
+        self.assertEqual(3, migration.upgrade(self.eng))
+
+        self.assertEqual(
+            set(['notification_list_notification_id_idx',
+                 'notification_list_hostname_type_time_idx',
+                 'notification_list_progress_recover_by_idx']),
+            self._index_names('notification_list'))
+        self.assertEqual(
+            set(['reserve_list_cluster_port_deleted_idx',
+                 'reserve_list_hostname_deleted_idx']),
+            self._index_names('reserve_list'))
+
+        self.assertIn('recovery_sec', self._column_names('vm_list'))
+
+        # Nothing is applied twice
+        self.assertEqual(3, migration.upgrade(self.eng))
+
+
+if __name__ == '__main__':
+    unittest.main()
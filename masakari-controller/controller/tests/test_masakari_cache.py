@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import os
+import sys
+import unittest
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import masakari_cache
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_added_keys_are_contained(self):
+        bloom = masakari_cache.BloomFilter(1000, 0.01)
+        keys = ['id%d' % i for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        for key in keys:
+            self.assertIn(key, bloom)
+        self.assertIn(u'id1', bloom)
+
+    def test_false_positive_rate(self):
+        bloom = masakari_cache.BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add('id%d' % i)
+
+        false_positives = sum(1 for i in range(10000)
+                              if 'other%d' % i in bloom)
+        self.assertLess(false_positives, 300)
+
+
+class TestNotificationIdCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = masakari_cache.NotificationIdCache(2, 1000, 0.001)
+        self.base = datetime.datetime(2016, 1, 1, 0, 0, 0)
+
+    def _time(self, seconds):
+        return self.base + datetime.timedelta(seconds=seconds)
+
+    def test_lookup(self):
+        self.cache.add('id1', self._time(0))
+
+        self.assertEqual(masakari_cache.FOUND,
+                         self.cache.lookup('id1', self._time(0)))
+        self.assertEqual(masakari_cache.NOT_FOUND,
+                         self.cache.lookup('id2', self._time(0)))
+
+    def test_evicted_id_is_unknown(self):
+        self.cache.add('id1', self._time(0))
+        self.cache.add('id2', self._time(0))
+        self.cache.lookup('id1', self._time(0))
+        self.cache.add('id3', self._time(0))
+
+        # id2 is the least recently used one
+        self.assertEqual(masakari_cache.UNKNOWN,
+                         self.cache.lookup('id2', self._time(0)))
+        self.assertEqual(masakari_cache.FOUND,
+                         self.cache.lookup('id1', self._time(0)))
+        self.assertEqual(masakari_cache.FOUND,
+                         self.cache.lookup('id3', self._time(0)))
+
+        stats = self.cache.get_stats()
+        self.assertEqual(2, stats['lru_cnt'])
+        self.assertEqual(1, stats['unknown_cnt'])
+        self.assertEqual(3, stats['found_cnt'])
+
+    def test_id_older_than_floor_is_unknown(self):
+        self.cache.set_floor(self._time(100))
+
+        self.assertEqual(masakari_cache.UNKNOWN,
+                         self.cache.lookup('id1', self._time(99)))
+        self.assertEqual(masakari_cache.NOT_FOUND,
+                         self.cache.lookup('id1', self._time(100)))
+
+    def test_rotate_full_bloom_filter(self):
+        cache = masakari_cache.NotificationIdCache(1, 10, 0.001)
+        for i in range(25):
+            cache.add('id%d' % i, self._time(i))
+
+        # The filter is never filled past its capacity.
+        stats = cache.get_stats()
+        self.assertEqual(2, stats['rotate_cnt'])
+        self.assertEqual(5, stats['bloom_cnt'])
+
+        # The ids of the first filter are forgotten, so the notifications
+        # up to their time have to be checked in DB.
+        self.assertEqual(masakari_cache.UNKNOWN,
+                         cache.lookup('id0', self._time(0)))
+        self.assertEqual(masakari_cache.UNKNOWN,
+                         cache.lookup('other', self._time(9)))
+        # The ids of the old filter are still kept.
+        self.assertEqual(masakari_cache.UNKNOWN,
+                         cache.lookup('id10', self._time(10)))
+        self.assertEqual(masakari_cache.UNKNOWN,
+                         cache.lookup('id20', self._time(20)))
+        self.assertEqual(masakari_cache.NOT_FOUND,
+                         cache.lookup('other', self._time(10)))
+
+
+class TestNotificationTimeIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = masakari_cache.NotificationTimeIndex(600)
+        self.base = datetime.datetime(2016, 1, 1, 0, 0, 0)
+
+    def _time(self, seconds):
+        return self.base + datetime.timedelta(seconds=seconds)
+
+    def test_unloaded_host_is_unknown(self):
+        self.index.add('host1', self._time(0))
+
+        self.assertIsNone(self.index.exists_since('host1', self._time(0)))
+
+    def test_exists_since(self):
+        self.index.load('host1', self._time(0), [self._time(100)])
+        self.index.add('host1', self._time(50))
+
+        self.assertTrue(self.index.exists_since('host1', self._time(100)))
+        self.assertFalse(self.index.exists_since('host1', self._time(101)))
+        # Older than the time loaded from DB
+        self.assertIsNone(self.index.exists_since('host1', self._time(-1)))
+
+    def test_old_times_are_dropped(self):
+        self.index.load('host1', self._time(0), [self._time(0)])
+        self.index.add('host1', self._time(1000))
+
+        self.assertIsNone(self.index.exists_since('host1', self._time(0)))
+        self.assertTrue(self.index.exists_since('host1', self._time(400)))
+        self.assertEqual(1, self.index.get_stats()['time_cnt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
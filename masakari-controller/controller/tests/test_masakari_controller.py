@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import json
+import os
+import StringIO
+import sys
+import unittest
+
+import mock
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import masakari_controller
+
+
+def make_controller():
+    sample_config = os.path.dirname(os.path.abspath(__file__)) +\
+        '/masakari-controller-test.conf'
+    rc = masakari_controller.RecoveryController.__new__(
+        masakari_controller.RecoveryController)
+    rc.rc_config = masakari_controller.config.RecoveryControllerConfig(
+        sample_config)
+    rc.rc_util = masakari_controller.util()
+    rc.rc_starter = mock.Mock()
+    rc.rc_worker = mock.Mock()
+    rc.rc_util_db = mock.Mock()
+    rc.rc_util_api = mock.Mock()
+    rc.notification_id_cache = masakari_controller.cache.NotificationIdCache(
+        100, 1000, 0.001)
+    rc.in_flight_notifications = masakari_controller.InFlightIds()
+    rc.notification_time_index = \
+        masakari_controller.cache.NotificationTimeIndex(480)
+    rc.compute_service_poller = mock.Mock()
+    return rc
+
+
+def make_notification(id, type='VM', hostname='host1', event_type='5',
+                      detail='5', time='20160101000000'):
+    return {
+        'id': id, 'type': type, 'regionID': 'RegionOne',
+        'hostname': hostname, 'uuid': 'uuid-' + id, 'time': time,
+        'eventID': '0' if type == 'VM' else '1', 'eventType': event_type,
+        'detail': detail, 'startTime': time, 'endTime': None,
+        'tzname': 'UTC', 'daylight': '0', 'cluster_port': '226.11.1.1:4000'}
+
+
+def make_env(body):
+    return {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': len(body),
+            'wsgi.input': StringIO.StringIO(body)}
+
+
+@mock.patch.object(masakari_controller, 'dbapi')
+class TestNotificationReciever(unittest.TestCase):
+    def setUp(self):
+        self.rc = make_controller()
+        self.rc._dispatch_notification = mock.Mock()
+        self.rc.rc_util_db.insert_notification_list_db.side_effect = \
+            lambda json_data, recover_by, session: {
+                'notification_id': json_data['id'],
+                'recover_by': recover_by, 'progress': 0}
+        self.start_response = mock.Mock()
+
+    def _post(self, body):
+        return self.rc._notification_reciever(make_env(body),
+                                              self.start_response)
+
+    def test_accepted_notification_returns_202_with_id(self, mock_dbapi):
+        ret = self._post(json.dumps(make_notification('id1')))
+
+        self.start_response.assert_called_once_with(
+            '202 Accepted', [('Content-Type', 'application/json')])
+        self.assertEqual({'id': 'id1', 'status': 'accepted'},
+                         json.loads(''.join(ret)))
+        self.assertEqual(1, self.rc._dispatch_notification.call_count)
+
+    def test_duplicate_notification_returns_200_ignored(self, mock_dbapi):
+        self._post(json.dumps(make_notification('id1')))
+        self.start_response.reset_mock()
+
+        ret = self._post(json.dumps(make_notification('id1')))
+
+        self.start_response.assert_called_once_with(
+            '200 OK', [('Content-Type', 'application/json')])
+        self.assertEqual({'id': 'id1', 'status': 'ignored'},
+                         json.loads(''.join(ret)))
+        self.assertEqual(1, self.rc._dispatch_notification.call_count)
+
+    def test_ignored_notification_returns_200_ignored(self, mock_dbapi):
+        # The instance was stopped with Stop API.
+        ret = self._post(json.dumps(make_notification('id1', detail='1')))
+
+        self.start_response.assert_called_once_with(
+            '200 OK', [('Content-Type', 'application/json')])
+        self.assertEqual({'id': 'id1', 'status': 'ignored'},
+                         json.loads(''.join(ret)))
+        self.assertFalse(self.rc._dispatch_notification.called)
+
+    def test_invalid_notification_returns_400(self, mock_dbapi):
+        notification = make_notification('id1')
+        del notification['hostname']
+
+        self._post(json.dumps(notification))
+
+        self.start_response.assert_called_once_with(
+            '400 Bad Request', [('Content-Type', 'text/plain')])
+        self.assertFalse(self.rc._dispatch_notification.called)
+
+
+@mock.patch.object(masakari_controller, 'dbapi')
+class TestWarmNotificationIdCache(unittest.TestCase):
+    def setUp(self):
+        self.rc = make_controller()
+        self.rc.notification_id_cache = mock.Mock()
+        self.now = datetime.datetime(2016, 1, 1, 0, 0, 0)
+
+    def _row(self, id, seconds):
+        return mock.Mock(notification_id=id,
+                         notification_time=self.now + datetime.timedelta(
+                             seconds=seconds))
+
+    @mock.patch.object(masakari_controller.datetime, 'datetime')
+    def test_warm_recent_window(self, mock_datetime, mock_dbapi):
+        mock_datetime.now.return_value = self.now
+        mock_dbapi.get_recent_notification_ids.return_value = [
+            self._row('id2', -10), self._row('id1', -20)]
+
+        self.rc._warm_notification_id_cache(mock.Mock())
+
+        since = self.now - datetime.timedelta(seconds=86400)
+        self.assertEqual(since, mock_dbapi.get_recent_notification_ids.
+                         call_args[0][1])
+        self.rc.notification_id_cache.set_floor.assert_called_once_with(
+            since)
+        self.assertEqual(
+            [mock.call('id1', self.now - datetime.timedelta(seconds=20)),
+             mock.call('id2', self.now - datetime.timedelta(seconds=10))],
+            self.rc.notification_id_cache.add.call_args_list)
+
+    @mock.patch.object(masakari_controller.datetime, 'datetime')
+    def test_warm_up_to_capacity(self, mock_datetime, mock_dbapi):
+        mock_datetime.now.return_value = self.now
+        self.rc.rc_config.get_value('recover_starter')[
+            'notification_id_bloom_capacity'] = '2'
+        mock_dbapi.get_recent_notification_ids.return_value = [
+            self._row('id3', -10), self._row('id2', -20)]
+
+        self.rc._warm_notification_id_cache(mock.Mock())
+
+        # The older ids than the loaded ones are checked in DB.
+        self.rc.notification_id_cache.set_floor.assert_called_once_with(
+            self.now - datetime.timedelta(seconds=20, microseconds=-1))
+
+
+class TestForceDownHost(unittest.TestCase):
+    def setUp(self):
+        self.rc = make_controller()
+        self.conf_dic = self.rc.rc_config.get_value('recover_starter')
+        self.conf_dic['node_force_down'] = 'true'
+        self.conf_dic['stonith_trusted'] = 'true'
+        self.notification_list_dic = {'notification_hostname': 'host1',
+                                      'notification_detail': '2'}
+
+    def test_force_down_host(self):
+        self.assertTrue(
+            self.rc._force_down_host(self.notification_list_dic))
+        self.rc.rc_util_api.force_down_host.assert_called_once_with('host1')
+
+    def test_node_force_down_disabled(self):
+        self.conf_dic['node_force_down'] = 'false'
+
+        self.assertFalse(
+            self.rc._force_down_host(self.notification_list_dic))
+        self.assertFalse(self.rc.rc_util_api.force_down_host.called)
+
+    def test_stonith_not_trusted(self):
+        # The host may be still running.
+        self.conf_dic['stonith_trusted'] = 'false'
+
+        self.assertFalse(
+            self.rc._force_down_host(self.notification_list_dic))
+        self.assertFalse(self.rc.rc_util_api.force_down_host.called)
+
+    def test_force_down_host_fails(self):
+        self.rc.rc_util_api.force_down_host.side_effect = Exception()
+
+        self.assertFalse(
+            self.rc._force_down_host(self.notification_list_dic))
+
+    def test_unset_force_down_host(self):
+        self.rc._unset_force_down_host('host1')
+
+        self.rc.rc_util_api.force_down_host.assert_called_once_with(
+            'host1', False)
+
+    def test_unset_force_down_host_fails(self):
+        self.rc.rc_util_api.force_down_host.side_effect = Exception()
+
+        # The error is only logged.
+        self.rc._unset_force_down_host('host1')
+
+    @mock.patch.object(masakari_controller.threading, 'Thread')
+    def test_unset_on_node_start(self, mock_thread):
+        notification = make_notification('id1', type='rscGroup',
+                                         event_type='1', detail='1')
+
+        self.assertIsNone(self.rc._get_recover_by(notification, mock.Mock()))
+
+        self.assertEqual(self.rc._unset_force_down_host,
+                         mock_thread.call_args[1]['target'])
+        self.assertEqual(('host1', ), mock_thread.call_args[1]['args'])
+        mock_thread.return_value.start.assert_called_once_with()
+
+
+class TestRecoverFailedHost(unittest.TestCase):
+    def setUp(self):
+        self.rc = make_controller()
+        self.prepared = {'primary_ids': {'uuid1': 1}}
+        self.rc.rc_starter.prepare_failed_host.return_value = self.prepared
+        self.rc.compute_service_poller.wait_for_state.return_value = True
+        self.notification_list_dic = {
+            'notification_id': 'id1', 'notification_hostname': 'host1',
+            'notification_cluster_port': '226.11.1.1:4000',
+            'notification_detail': '2'}
+
+    def test_recover_failed_host(self):
+        self.rc._recover_failed_host(self.notification_list_dic)
+
+        self.rc.rc_starter.prepare_failed_host.assert_called_once_with(
+            'id1', 'host1', '226.11.1.1:4000')
+        self.rc.rc_starter.add_failed_host.assert_called_once_with(
+            'id1', 'host1', '226.11.1.1:4000', False, self.prepared)
+        # add_failed_host releases the prepared records.
+        self.assertFalse(self.rc.rc_starter.release_prepared_host.called)
+
+    def test_force_down_skips_wait(self):
+        conf_dic = self.rc.rc_config.get_value('recover_starter')
+        conf_dic['node_force_down'] = 'true'
+        conf_dic['stonith_trusted'] = 'true'
+
+        self.rc._recover_failed_host(self.notification_list_dic)
+
+        self.rc.rc_util_api.force_down_host.assert_called_once_with('host1')
+        self.assertFalse(self.rc.compute_service_poller.wait_for_state.called)
+        self.assertTrue(self.rc.rc_starter.add_failed_host.called)
+
+    def test_release_prepared_host_on_error(self):
+        self.rc.compute_service_poller.wait_for_state.side_effect = \
+            Exception()
+
+        self.rc._recover_failed_host(self.notification_list_dic)
+
+        self.assertFalse(self.rc.rc_starter.add_failed_host.called)
+        self.rc.rc_starter.release_prepared_host.assert_called_once_with(
+            self.prepared)
+
+    def test_nothing_to_recover(self):
+        self.rc.rc_starter.prepare_failed_host.return_value = None
+
+        self.rc._recover_failed_host(self.notification_list_dic)
+
+        self.assertFalse(self.rc.rc_starter.add_failed_host.called)
+        self.assertFalse(self.rc.rc_starter.release_prepared_host.called)
+
+
+class TestLoadNotificationBody(unittest.TestCase):
+    def setUp(self):
+        self.rc = make_controller()
+
+    def test_json_object(self):
+        self.assertEqual({'id': 'id1'},
+                         self.rc._load_notification_body('{"id": "id1"}'))
+
+    def test_json_array(self):
+        self.assertEqual(
+            [{'id': 'id1'}, {'id': 'id2'}],
+            self.rc._load_notification_body(
+                '[{"id": "id1"}, {"id": "id2"}]'))
+
+    def test_ndjson_with_malformed_line(self):
+        self.assertEqual(
+            [{'id': 'id1'}, None, {'id': 'id2'}],
+            self.rc._load_notification_body(
+                '{"id": "id1"}\n{"id": \n\n{"id": "id2"}\n'))
+
+
+@mock.patch.object(masakari_controller, 'dbapi')
+class TestNotificationBatchReciever(unittest.TestCase):
+    def setUp(self):
+        self.rc = make_controller()
+        self.rc._dispatch_notification = mock.Mock()
+        self.rc.rc_util_db.insert_notification_list_db_bulk.side_effect = \
+            lambda notifications, session, controle_ips: [
+                {'notification_id': json_data['id'],
+                 'recover_by': recover_by, 'progress': 0}
+                for json_data, recover_by in notifications]
+        self.start_response = mock.Mock()
+
+        def gethostbyname(hostname):
+            if hostname == 'unknown':
+                raise masakari_controller.socket.gaierror(
+                    -2, 'Name or service not known')
+            return '10.0.0.%s' % hostname[-1]
+
+        patcher = mock.patch.object(masakari_controller.socket,
+                                    'gethostbyname',
+                                    side_effect=gethostbyname)
+        self.mock_gethostbyname = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _post(self, body):
+        ret = self.rc._notification_reciever(make_env(body),
+                                             self.start_response)
+        return json.loads(''.join(ret))
+
+    def test_mixed_batch(self, mock_dbapi):
+        mock_dbapi.get_notification_times_by_hostname_type_since.\
+            return_value = []
+        invalid = make_notification('id4')
+        del invalid['hostname']
+        lines = [
+            json.dumps(make_notification('id1')),
+            '{"id": "broken"',
+            # The duplicate of id1 in the same batch
+            json.dumps(make_notification('id1')),
+            json.dumps(invalid),
+            json.dumps(make_notification('id2', type='rscGroup',
+                                         hostname='host2', event_type='2',
+                                         detail='2')),
+            # The repeated notification of host2 in the same batch
+            json.dumps(make_notification('id3', type='rscGroup',
+                                         hostname='host2', event_type='2',
+                                         detail='2', time='20160101000100'))]
+
+        results = self._post('\n'.join(lines))
+
+        self.start_response.assert_called_once_with(
+            '202 Accepted', [('Content-Type', 'application/json')])
+        self.assertEqual(
+            [{'id': 'id1', 'status': 'accepted'},
+             {'id': None, 'status': 'invalid'},
+             {'id': 'id1', 'status': 'ignored'},
+             {'id': 'id4', 'status': 'invalid'},
+             {'id': 'id2', 'status': 'accepted'},
+             {'id': 'id3', 'status': 'ignored'}],
+            results)
+
+        # The notifications are inserted at once.
+        notifications = self.rc.rc_util_db.\
+            insert_notification_list_db_bulk.call_args[0][0]
+        self.assertEqual([('id1', 1), ('id2', 0)],
+                         [(j['id'], r) for j, r in notifications])
+        self.assertEqual(2, self.rc._dispatch_notification.call_count)
+
+    def test_json_array(self, mock_dbapi):
+        results = self._post(json.dumps([make_notification('id1'),
+                                         make_notification('id2')]))
+
+        self.assertEqual(
+            [{'id': 'id1', 'status': 'accepted'},
+             {'id': 'id2', 'status': 'accepted'}],
+            results)
+
+    def test_malformed_items_in_valid_batch(self, mock_dbapi):
+        bad_time = make_notification('id2', time='2016-01-01 00:00:00')
+        bad_end_time = make_notification('id3')
+        bad_end_time['endTime'] = 'now'
+        unknown_host = make_notification('id4', hostname='unknown')
+
+        results = self._post(json.dumps([
+            make_notification('id1'), bad_time, bad_end_time, unknown_host,
+            make_notification('id5', hostname='host2')]))
+
+        self.start_response.assert_called_once_with(
+            '202 Accepted', [('Content-Type', 'application/json')])
+        self.assertEqual(
+            [{'id': 'id1', 'status': 'accepted'},
+             {'id': 'id2', 'status': 'invalid'},
+             {'id': 'id3', 'status': 'invalid'},
+             {'id': 'id4', 'status': 'invalid'},
+             {'id': 'id5', 'status': 'accepted'}],
+            results)
+
+        # Only the valid notifications are inserted, with the addresses
+        # resolved in the validation.
+        notifications, session, controle_ips = self.rc.rc_util_db.\
+            insert_notification_list_db_bulk.call_args[0]
+        self.assertEqual(['id1', 'id5'], [j['id'] for j, r in notifications])
+        self.assertEqual({'host1': '10.0.0.1', 'host2': '10.0.0.2'},
+                         controle_ips)
+        self.assertEqual(2, self.rc._dispatch_notification.call_count)
+
+    def test_batch_without_valid_notification(self, mock_dbapi):
+        results = self._post('{"id": "broken"\n[1, 2]')
+
+        self.start_response.assert_called_once_with(
+            '400 Bad Request', [('Content-Type', 'application/json')])
+        self.assertEqual([{'id': None, 'status': 'invalid'}] * 2, results)
+        self.assertFalse(
+            self.rc.rc_util_db.insert_notification_list_db_bulk.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import masakari_executor
+import masakari_governor
+
+
+def wait_until(predicate, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestRecoveryControllerExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = masakari_executor.RecoveryControllerExecutor(2)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def test_submit_runs_job_in_named_thread(self):
+        names = []
+
+        def job(arg):
+            names.append((threading.current_thread().name, arg))
+
+        self.executor.submit('Thread:vm_list(1)', job, 'uuid1')
+
+        self.assertTrue(wait_until(
+            lambda: self.executor.get_stats()['completed_cnt'] == 1))
+        self.assertEqual([('Thread:vm_list(1)', 'uuid1')], names)
+
+    def test_concurrency_is_limited_to_worker_cnt(self):
+        for i in range(5):
+            self.executor.submit('job%d' % i, self.release.wait)
+
+        self.assertTrue(wait_until(
+            lambda: self.executor.get_stats()['busy_cnt'] == 2))
+        stats = self.executor.get_stats()
+        self.assertEqual(2, stats['busy_cnt'])
+        self.assertEqual(3, stats['queue_depth'])
+        self.assertEqual(1.0, stats['utilization'])
+        self.assertEqual(5, stats['submitted_cnt'])
+
+        self.release.set()
+        self.assertTrue(wait_until(
+            lambda: self.executor.get_stats()['completed_cnt'] == 5))
+        self.assertEqual(0, self.executor.get_stats()['busy_cnt'])
+
+    def test_failed_job_does_not_stop_worker(self):
+        def failed_job():
+            raise EnvironmentError('failed')
+
+        for i in range(3):
+            self.executor.submit('job%d' % i, failed_job)
+
+        self.assertTrue(wait_until(
+            lambda: self.executor.get_stats()['completed_cnt'] == 3))
+
+    def test_generator_job_gives_thread_back_while_waiting(self):
+        callbacks = []
+        results = []
+
+        def wait(callback):
+            callbacks.append(callback)
+
+        def sub_job(arg):
+            result = yield masakari_executor.Wait(wait)
+            raise masakari_executor.Return((arg, result))
+
+        def waiting_job(arg):
+            results.append((yield sub_job(arg)))
+
+        # More waiting jobs than the worker threads are started at once.
+        for i in range(10):
+            self.executor.submit('waiting%d' % i, waiting_job, i)
+
+        self.assertTrue(wait_until(lambda: len(callbacks) == 10))
+        stats = self.executor.get_stats()
+        self.assertEqual(2, stats['thread_cnt'])
+        self.assertEqual(0, stats['busy_cnt'])
+        self.assertEqual(10, stats['waiting_cnt'])
+        self.assertEqual(0, stats['completed_cnt'])
+
+        for i, callback in enumerate(callbacks):
+            callback('result%d' % i)
+
+        self.assertTrue(wait_until(
+            lambda: self.executor.get_stats()['completed_cnt'] == 10))
+        self.assertEqual(range(10), sorted(arg for arg, result in results))
+        self.assertEqual(sorted('result%d' % i for i in range(10)),
+                         sorted(result for arg, result in results))
+        stats = self.executor.get_stats()
+        self.assertEqual(2, stats['thread_cnt'])
+        self.assertEqual(0, stats['waiting_cnt'])
+
+    def test_generator_job_catches_error_of_sub_job(self):
+        errors = []
+
+        def wait(callback):
+            raise EnvironmentError('registration failed')
+
+        def sub_job():
+            yield masakari_executor.Wait(wait)
+
+        def job():
+            try:
+                yield sub_job()
+            except EnvironmentError as e:
+                errors.append(str(e))
+
+        self.executor.submit('job', job)
+
+        self.assertTrue(wait_until(
+            lambda: self.executor.get_stats()['completed_cnt'] == 1))
+        self.assertEqual(['registration failed'], errors)
+        self.assertEqual(0, self.executor.get_stats()['waiting_cnt'])
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, code):
+        super(FakeHTTPError, self).__init__(code)
+        self.code = code
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    def setUp(self):
+        self.executor = masakari_executor.RecoveryControllerExecutor(
+            4, 2, 6, 10)
+
+    def _measure(self, error=None):
+        def evacuate():
+            if error is not None:
+                raise error
+
+        nova_governor = masakari_governor.NovaApiGovernor(0, 10, 0, 0, 0)
+        try:
+            with self.executor.measuring('Evacuate API'):
+                nova_governor.call('Evacuate API', evacuate)
+        except FakeHTTPError:
+            pass
+
+    def test_increase_by_one_per_limit_successes(self):
+        for i in range(4):
+            self._measure()
+
+        stats = self.executor.get_stats()
+        self.assertEqual(5, stats['concurrency_limit'])
+        self.assertEqual(1, stats['concurrency_increase_cnt'])
+
+    def test_limit_does_not_exceed_max_cnt(self):
+        for i in range(100):
+            self._measure()
+
+        stats = self.executor.get_stats()
+        self.assertEqual(6, stats['concurrency_limit'])
+        # A worker thread is started for each slot added.
+        self.assertEqual(6, stats['thread_cnt'])
+
+    def test_decrease_on_overload_error(self):
+        self._measure(FakeHTTPError(503))
+
+        stats = self.executor.get_stats()
+        self.assertEqual(2, stats['concurrency_limit'])
+        self.assertEqual(1, stats['concurrency_decrease_cnt'])
+
+        # The limit does not go below min_cnt.
+        time.sleep(0.01)
+        self._measure(FakeHTTPError(503))
+        self.assertEqual(2, self.executor.get_stats()['concurrency_limit'])
+
+    def test_no_decrease_on_other_error(self):
+        self._measure(FakeHTTPError(404))
+
+        self.assertEqual(4, self.executor.get_stats()['concurrency_limit'])
+
+    def test_decrease_on_latency(self):
+        self.executor.latency_target = -1
+        self._measure()
+
+        self.assertEqual(2, self.executor.get_stats()['concurrency_limit'])
+
+    def test_no_decrease_on_wait_of_governor(self):
+        self.executor.latency_target = 0.05
+        # The second call waits 0.1 sec for a token while nova answers at
+        # once.
+        nova_governor = masakari_governor.NovaApiGovernor(10, 1, 0, 0, 0)
+        started_at = time.time()
+        with self.executor.measuring('Evacuate API'):
+            nova_governor.call('Evacuate API', lambda: None)
+            nova_governor.call('Evacuate API', lambda: None)
+
+        self.assertGreater(time.time() - started_at, 0.05)
+        stats = self.executor.get_stats()
+        self.assertEqual(4, stats['concurrency_limit'])
+        self.assertEqual(0, stats['concurrency_decrease_cnt'])
+
+    def test_no_adjustment_without_nova_call(self):
+        for i in range(4):
+            with self.executor.measuring('Evacuate API'):
+                pass
+
+        stats = self.executor.get_stats()
+        self.assertEqual(4, stats['concurrency_limit'])
+        self.assertEqual(0, stats['concurrency_increase_cnt'])
+
+    def test_decrease_once_for_calls_started_before(self):
+        executor = masakari_executor.RecoveryControllerExecutor(8, 1, 8, 10)
+        errors = []
+        started = []
+        release = threading.Event()
+
+        def call():
+            try:
+                with executor.measuring('Evacuate API'):
+                    started.append(True)
+                    release.wait()
+                    raise FakeHTTPError(503)
+            except FakeHTTPError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for i in range(3)]
+        for th in threads:
+            th.start()
+        self.assertTrue(wait_until(lambda: len(started) == 3))
+        release.set()
+        for th in threads:
+            th.join(5)
+
+        self.assertEqual(3, len(errors))
+        self.assertEqual(4, executor.get_stats()['concurrency_limit'])
+
+    def test_not_adaptive(self):
+        executor = masakari_executor.RecoveryControllerExecutor(4)
+        with executor.measuring('Evacuate API'):
+            pass
+        try:
+            with executor.measuring('Evacuate API'):
+                raise FakeHTTPError(503)
+        except FakeHTTPError:
+            pass
+
+        self.assertEqual(4, executor.get_stats()['concurrency_limit'])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestRecoveryControllerExecutor)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+import os
+import sys
+import unittest
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from keystoneauth1 import exceptions as ks_exceptions
+
+import masakari_governor
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, code, retry_after=0):
+        super(FakeHTTPError, self).__init__(code)
+        self.code = code
+        self.retry_after = retry_after
+
+
+class TestNovaApiGovernor(unittest.TestCase):
+    def setUp(self):
+        self.governor = masakari_governor.NovaApiGovernor(
+            0, 10, 3, 10, 0.2)
+        patcher = mock.patch('masakari_governor.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retry_on_service_unavailable(self):
+        func = mock.Mock(side_effect=[FakeHTTPError(503), 'server'])
+
+        result = self.governor.call('Server Details API', func, ('uuid',))
+
+        self.assertEqual('server', result)
+        self.assertEqual(2, func.call_count)
+        func.assert_called_with('uuid')
+        self.assertEqual(1, self.governor.get_stats()['retry_cnt'])
+
+    def test_wait_for_retry_after(self):
+        func = mock.Mock(side_effect=[FakeHTTPError(429, 30), 'server'])
+
+        self.governor.call('Server Details API', func)
+
+        self.assertEqual(30, self.sleep.call_args[0][0])
+
+    def test_no_retry_on_other_errors(self):
+        func = mock.Mock(side_effect=FakeHTTPError(404))
+
+        self.assertRaises(FakeHTTPError, self.governor.call,
+                          'Server Details API', func)
+        self.assertEqual(1, func.call_count)
+
+    def test_no_retry_of_non_idempotent_call_on_gateway_timeout(self):
+        func = mock.Mock(side_effect=FakeHTTPError(504))
+
+        self.assertRaises(FakeHTTPError, self.governor.call,
+                          'Server Evacuate API', func, idempotent=False)
+        self.assertEqual(1, func.call_count)
+
+    def test_retry_idempotent_call_on_server_error(self):
+        func = mock.Mock(side_effect=[FakeHTTPError(500), 'server'])
+
+        self.assertEqual('server', self.governor.call(
+            'Server Details API', func))
+        self.assertEqual(2, func.call_count)
+
+    def test_retry_idempotent_call_on_connection_error(self):
+        func = mock.Mock(side_effect=[
+            ks_exceptions.ConnectFailure('connection reset'), 'server'])
+
+        self.assertEqual('server', self.governor.call(
+            'Server Details API', func))
+        self.assertEqual(2, func.call_count)
+
+    def test_retry_idempotent_call_on_keystone_error(self):
+        func = mock.Mock(side_effect=[
+            ks_exceptions.InternalServerError(), 'server'])
+
+        self.assertEqual('server', self.governor.call(
+            'Server Details API', func))
+
+    def test_no_retry_of_non_idempotent_call_on_server_error(self):
+        func = mock.Mock(side_effect=FakeHTTPError(500))
+
+        self.assertRaises(FakeHTTPError, self.governor.call,
+                          'Server Evacuate API', func, idempotent=False)
+        self.assertEqual(1, func.call_count)
+
+    def test_retry_non_idempotent_call_on_service_unavailable(self):
+        func = mock.Mock(side_effect=[FakeHTTPError(503), None])
+
+        self.governor.call('Server Evacuate API', func, idempotent=False)
+
+        self.assertEqual(2, func.call_count)
+
+    def test_max_retry_cnt(self):
+        func = mock.Mock(side_effect=FakeHTTPError(503))
+
+        self.assertRaises(FakeHTTPError, self.governor.call,
+                          'Server Details API', func)
+        self.assertEqual(4, func.call_count)
+
+    def test_retry_budget(self):
+        governor = masakari_governor.NovaApiGovernor(0, 10, 3, 10, 0.01)
+        func = mock.Mock(side_effect=FakeHTTPError(503))
+
+        self.assertRaises(FakeHTTPError, governor.call,
+                          'Server Details API', func)
+        self.assertRaises(FakeHTTPError, governor.call,
+                          'Server Details API', func)
+
+        # The budget of a retry is spent by the first call.
+        self.assertEqual(3, func.call_count)
+        stats = governor.get_stats()
+        self.assertEqual(1, stats['retry_cnt'])
+        self.assertEqual(2, stats['budget_exhausted_cnt'])
+
+    @mock.patch('masakari_governor.time')
+    def test_observe_each_call_without_backoff(self, mock_time):
+        # The backoff between the attempts is not observed. The third time
+        # is taken by the pause for Retry-After.
+        mock_time.time.side_effect = [100.0, 100.5, 100.5, 130.0, 130.2,
+                                      140.0, 140.1]
+        func = mock.Mock(side_effect=[FakeHTTPError(429, 30), 'server'])
+        latencies = []
+
+        with masakari_governor.observing(latencies.append):
+            self.governor.call('Server Details API', func)
+        self.governor.call('Server Details API', lambda: None)
+
+        self.assertEqual(2, len(latencies))
+        self.assertAlmostEqual(0.5, latencies[0])
+        self.assertAlmostEqual(0.2, latencies[1])
+
+
+class TestTokenBucket(unittest.TestCase):
+    @mock.patch('masakari_governor.time.sleep')
+    @mock.patch('masakari_governor.time.time')
+    def test_wait_for_token(self, mock_time, mock_sleep):
+        mock_time.return_value = 100.0
+        bucket = masakari_governor.TokenBucket(2, 1)
+
+        self.assertEqual(0.0, bucket.acquire())
+
+        def sleep(seconds):
+            mock_time.return_value += seconds
+        mock_sleep.side_effect = sleep
+
+        self.assertEqual(0.5, bucket.acquire())
+
+
+if __name__ == '__main__':
+    unittest.main()
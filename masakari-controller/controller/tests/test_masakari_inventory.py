@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import time
+import unittest
+
+import mock
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import fakes as nova_fakes
+import masakari_inventory
+
+
+def fake_server(uuid, host, vm_state='active', task_state=None,
+                status='ACTIVE'):
+    server = nova_fakes.FakeNovaServer(uuid, vm_state, {'HA-Enabled': 'ON'})
+    setattr(server, 'OS-EXT-SRV-ATTR:host', host)
+    setattr(server, 'OS-EXT-STS:task_state', task_state)
+    server.status = status
+    server.flavor = {'id': 'flavor1'}
+    return server
+
+
+class TestInventorySnapshot(unittest.TestCase):
+    def setUp(self):
+        self.rc_util_api = mock.Mock()
+        self.rc_util_api.fetch_all_servers.return_value = [
+            fake_server('uuid1', 'host1'),
+            fake_server('uuid2', 'host1'),
+            fake_server('uuid3', 'host2')]
+        self.inventory = masakari_inventory.InventorySnapshot(
+            self.rc_util_api, 60)
+
+    def _wait_loaded(self):
+        end = time.time() + 5
+        while time.time() < end:
+            if self.inventory.get_stats()['refresh_cnt']:
+                return
+            time.sleep(0.01)
+        self.fail('The snapshot is not loaded.')
+
+    def test_servers_on_host(self):
+        self._wait_loaded()
+
+        servers = self.inventory.get_servers_on_host('host1')
+
+        self.assertEqual(['uuid1', 'uuid2'], [s.id for s in servers])
+        self.assertEqual('active', getattr(servers[0], 'OS-EXT-STS:vm_state'))
+        self.assertEqual({'HA-Enabled': 'ON'}, servers[0].metadata)
+        self.assertEqual([], self.inventory.get_servers_on_host('host3'))
+
+    def test_changes_are_applied(self):
+        self._wait_loaded()
+
+        self.inventory._update([
+            fake_server('uuid1', 'host2', task_state='migrating'),
+            fake_server('uuid2', 'host1', status='DELETED'),
+            fake_server('uuid4', 'host1')], False)
+
+        self.assertEqual(['uuid4'], [
+            s.id for s in self.inventory.get_servers_on_host('host1')])
+        servers = self.inventory.get_servers_on_host('host2')
+        self.assertEqual(['uuid1', 'uuid3'], [s.id for s in servers])
+        self.assertFalse(servers[0].verified)
+        self.assertTrue(servers[1].verified)
+
+
+if __name__ == '__main__':
+    unittest.main()
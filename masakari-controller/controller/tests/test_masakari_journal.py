@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import os
+import sys
+import unittest
+
+import mock
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import masakari_journal
+
+
+@contextlib.contextmanager
+def fake_session_scope(rc_config):
+    yield 'session'
+
+
+class TestRecoveryControllerJournal(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(masakari_journal, 'dbapi')
+        self.dbapi = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dbapi.session_scope = fake_session_scope
+        self.written = []
+        self.dbapi.update_vm_list_by_id_dicts.side_effect = \
+            lambda session, update_vals: self.written.append(
+                dict(update_vals)) or len(update_vals)
+
+        self.journal = masakari_journal.RecoveryControllerJournal(
+            None, 0.5)
+        self.addCleanup(self.journal.stop)
+
+    def test_updates_are_coalesced(self):
+        self.journal.put(1, {'progress': 1, 'update_at': 'time1'})
+        self.journal.put(2, {'progress': 1, 'update_at': 'time1'})
+        self.journal.put(1, {'progress': 2, 'delete_at': 'time2'},
+                         durable=True)
+
+        self.assertEqual([{1: {'progress': 2, 'update_at': 'time1',
+                               'delete_at': 'time2'},
+                           2: {'progress': 1, 'update_at': 'time1'}}],
+                         self.written)
+        stats = self.journal.get_stats()
+        self.assertEqual(3, stats['put_cnt'])
+        self.assertEqual(1, stats['coalesced_cnt'])
+
+    def test_durable_put_raises_when_flush_failed(self):
+        self.dbapi.update_vm_list_by_id_dicts.side_effect = \
+            ValueError('failed')
+
+        self.assertRaises(ValueError, self.journal.put,
+                          1, {'progress': 3}, True)
+        self.assertEqual(1, self.journal.get_stats()['pending_cnt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
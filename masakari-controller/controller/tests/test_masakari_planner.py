@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import masakari_planner
+
+
+class TestPlanFirstFitDecreasing(unittest.TestCase):
+    def test_large_vms_are_placed_first(self):
+        vms = [('small1', (1, 1024)),
+               ('large', (4, 8192)),
+               ('small2', (1, 1024)),
+               ('medium', (2, 4096))]
+        hosts = [('host1', (4, 8192)), ('host2', (4, 8192))]
+
+        placement, unplaced = masakari_planner.plan_first_fit_decreasing(
+            vms, hosts)
+
+        self.assertEqual({'large': 'host1', 'medium': 'host2',
+                          'small1': 'host2', 'small2': 'host2'}, placement)
+        self.assertEqual([], unplaced)
+
+    def test_vm_which_does_not_fit(self):
+        vms = [('vm1', (2, 2048)), ('vm2', (8, 1024))]
+        hosts = [('host1', (4, 4096))]
+
+        placement, unplaced = masakari_planner.plan_first_fit_decreasing(
+            vms, hosts)
+
+        self.assertEqual({'vm1': 'host1'}, placement)
+        self.assertEqual(['vm2'], unplaced)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import os
+import sys
+import threading
+import unittest
+
+import mock
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import fakes as nova_fakes
+import masakari_poller
+
+
+def fake_service(host, state):
+    return mock.Mock(host=host, binary='nova-compute', state=state,
+                     status='enabled')
+
+
+class TestComputeServicePoller(unittest.TestCase):
+    def setUp(self):
+        self.rc_util_api = mock.Mock()
+        self.poller = masakari_poller.ComputeServicePoller(
+            self.rc_util_api, 0.05)
+
+    def test_waiters_share_the_listing(self):
+        self.rc_util_api.fetch_compute_services.side_effect = [
+            [fake_service('host1', 'up'), fake_service('host2', 'up')],
+            [fake_service('host1', 'down'), fake_service('host2', 'down')],
+        ] + [[fake_service('host1', 'down'),
+              fake_service('host2', 'down')]] * 100
+        results = {}
+
+        def wait(hostname):
+            results[hostname] = self.poller.wait_for_state(
+                hostname, 'down', 5)
+
+        threads = [threading.Thread(target=wait, args=(h, ))
+                   for h in ('host1', 'host2')]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+        self.assertEqual({'host1': True, 'host2': True}, results)
+        self.assertEqual(0, self.poller.get_stats()['waiter_cnt'])
+
+    def test_wait_times_out(self):
+        self.rc_util_api.fetch_compute_services.return_value = [
+            fake_service('host1', 'up')]
+
+        self.assertFalse(self.poller.wait_for_state('host1', 'down', 0.2))
+        self.assertEqual(0, self.poller.get_stats()['waiter_cnt'])
+
+
+class TestInstanceStatePoller(unittest.TestCase):
+    def setUp(self):
+        self.rc_util_api = mock.Mock()
+        self.poller = masakari_poller.InstanceStatePoller(
+            self.rc_util_api, 0.05)
+
+    def test_waiters_share_the_listing(self):
+        self.rc_util_api.fetch_servers_changed_since.side_effect = [
+            [nova_fakes.FakeNovaServer('uuid1', 'active'),
+             nova_fakes.FakeNovaServer('uuid2', 'active')],
+        ] + [[nova_fakes.FakeNovaServer('uuid1', 'stopped'),
+              nova_fakes.FakeNovaServer('uuid2', 'stopped')]] * 100
+        results = {}
+        done = threading.Event()
+
+        def callback(uuid, result):
+            results[uuid] = result
+            if len(results) == 2:
+                done.set()
+
+        for uuid in ('uuid1', 'uuid2'):
+            self.poller.watch_state(
+                uuid, 'stopped', 5,
+                lambda result, uuid=uuid: callback(uuid, result))
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual({'uuid1': True, 'uuid2': True}, results)
+        self.assertEqual(0, self.poller.get_stats()['waiter_cnt'])
+
+    def test_listing_window_is_bounded(self):
+        self.rc_util_api.fetch_servers_changed_since.return_value = [
+            nova_fakes.FakeNovaServer('uuid1', 'active')]
+        started_at = datetime.datetime.utcnow()
+        results = []
+        done = threading.Event()
+
+        def callback(result):
+            results.append(result)
+            done.set()
+
+        self.poller.watch_state('uuid1', 'stopped', 0.5, callback)
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual([None], results)
+
+        sinces = [c[0][0] for c in self.rc_util_api.
+                  fetch_servers_changed_since.call_args_list]
+        slack = datetime.timedelta(
+            seconds=masakari_poller._CHANGES_SINCE_SLACK_SEC)
+        # The first listing covers the wait from its registration, and the
+        # others only from the previous listing.
+        self.assertLessEqual(sinces[0], started_at - slack +
+                             datetime.timedelta(seconds=0.1))
+        self.assertEqual(sorted(sinces), sinces)
+        self.assertGreater(sinces[-1] - sinces[0],
+                           datetime.timedelta(seconds=0.3))
+
+    def test_watch_evacuation(self):
+        self.rc_util_api.fetch_servers_changed_since.side_effect = [
+            [nova_fakes.FakeNovaServer('uuid1', 'active',
+                                       task_state='rebuilding', host='node1'),
+             nova_fakes.FakeNovaServer('uuid2', 'active',
+                                       task_state='rebuilding', host='node1')],
+        ] + [[nova_fakes.FakeNovaServer('uuid1', 'active', host='node2'),
+              nova_fakes.FakeNovaServer('uuid2', 'error', host='node1')]] * 100
+        results = {}
+        done = threading.Event()
+
+        def callback(uuid, result):
+            results[uuid] = result
+            if len(results) == 2:
+                done.set()
+
+        for uuid in ('uuid1', 'uuid2'):
+            self.poller.watch_evacuation(
+                uuid, 'node2', 5,
+                lambda result, uuid=uuid: callback(uuid, result))
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual({'uuid1': 'done', 'uuid2': 'error'}, results)
+        stats = self.poller.get_stats()
+        self.assertEqual(1, stats['evacuation_done_cnt'])
+        self.assertEqual(1, stats['evacuation_error_cnt'])
+
+    def test_watch_evacuation_timeout(self):
+        self.rc_util_api.fetch_servers_changed_since.return_value = [
+            nova_fakes.FakeNovaServer('uuid1', 'active',
+                                      task_state='rebuilding', host='node1')]
+
+        results = []
+        done = threading.Event()
+
+        def callback(result):
+            results.append(result)
+            done.set()
+
+        self.poller.watch_evacuation('uuid1', 'node2', 0.2, callback)
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual([None], results)
+        self.assertEqual(
+            1, self.poller.get_stats()['evacuation_timeout_cnt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
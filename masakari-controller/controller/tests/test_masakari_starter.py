@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import os
+import sys
+import unittest
+
+import mock
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+from db import models
+import fakes as nova_fakes
+import masakari_config
+import masakari_starter
+import masakari_util
+
+
+def make_starter():
+    sample_config = os.path.dirname(os.path.abspath(__file__)) +\
+        '/masakari-controller-test.conf'
+    rc_starter = masakari_starter.RecoveryControllerStarter.__new__(
+        masakari_starter.RecoveryControllerStarter)
+    rc_starter.rc_config = masakari_config.RecoveryControllerConfig(
+        sample_config)
+    rc_starter.rc_worker = mock.Mock()
+    rc_starter.rc_util = masakari_util.RecoveryControllerUtil()
+    rc_starter.rc_util_db = masakari_util.RecoveryControllerUtilDb(
+        rc_starter.rc_config)
+    rc_starter.rc_util_api = mock.Mock()
+    rc_starter.rc_executor = mock.Mock()
+    rc_starter.rc_inventory = mock.Mock()
+    rc_starter.in_flight_vm_list = masakari_util.InFlightIds()
+    return rc_starter
+
+
+def fake_server(id):
+    return mock.Mock(id=id, verified=True)
+
+
+def fake_hypervisor(host, vcpus, vcpus_used, memory_mb, memory_mb_used):
+    return mock.Mock(service={'host': host}, vcpus=vcpus,
+                     vcpus_used=vcpus_used, memory_mb=memory_mb,
+                     memory_mb_used=memory_mb_used)
+
+
+class TestPlanEvacuation(unittest.TestCase):
+    def setUp(self):
+        self.rc_starter = make_starter()
+
+        eng = create_engine('sqlite://')
+        models.Base.metadata.create_all(eng)
+        self.session = sessionmaker(bind=eng)()
+        now = datetime.datetime(2016, 1, 1, 0, 0, 0)
+        # host4 is not a hypervisor and host2 is too small for any VM.
+        for id, hostname in ((1, 'host4'), (2, 'host2'), (3, 'host3')):
+            self.session.add(models.ReserveList(
+                id=id, cluster_port='port1', hostname=hostname, deleted=0,
+                create_at=now + datetime.timedelta(seconds=id)))
+        self.session.commit()
+
+        self.servers = [nova_fakes.FakeNovaServer('vm1', 'active'),
+                        nova_fakes.FakeNovaServer('vm2', 'active')]
+        self.rc_starter.rc_util_api.fetch_server_resources.return_value = {
+            'vm1': (2, 2048), 'vm2': (4, 4096)}
+        self.rc_starter.rc_util_api.fetch_hypervisor_free_resources.\
+            return_value = {'host1': (2, 2048), 'host2': (1, 1024),
+                            'host3': (4, 4096)}
+
+    def tearDown(self):
+        self.session.close()
+
+    def _deleted(self):
+        return self.session.query(models.ReserveList.hostname,
+                                  models.ReserveList.deleted).order_by(
+            models.ReserveList.id).all()
+
+    def test_only_useful_reserve_host_is_claimed(self):
+        placement = self.rc_starter._plan_evacuation(
+            self.session, 'host0', 'port1', 'host1', self.servers)
+
+        self.assertEqual({'vm1': 'host1', 'vm2': 'host3'}, placement)
+        # The reserve hosts which take no VM are left in the pool.
+        self.assertEqual([('host4', 0), ('host2', 0), ('host3', 1)],
+                         self._deleted())
+
+    def test_overcommitted_recover_to_takes_all_vms(self):
+        # All the physical vcpus of host1 are used, but it still has room
+        # with the cpu_allocation_ratio of 16.
+        util_api = masakari_util.RecoveryControllerUtilApi.__new__(
+            masakari_util.RecoveryControllerUtilApi)
+        util_api.rc_config = self.rc_starter.rc_config
+        util_api.governor = mock.Mock()
+        util_api.governor.call.side_effect = lambda name, func: func()
+        util_api.nova_client = mock.Mock()
+        util_api.nova_client.hypervisors.list.return_value = [
+            fake_hypervisor('host1', 4, 4, 8192, 6144),
+            fake_hypervisor('host3', 4, 0, 8192, 0)]
+        self.rc_starter.rc_util_api.fetch_hypervisor_free_resources = \
+            util_api.fetch_hypervisor_free_resources
+
+        placement = self.rc_starter._plan_evacuation(
+            self.session, 'host0', 'port1', 'host1', self.servers)
+
+        self.assertEqual({'vm1': 'host1', 'vm2': 'host1'}, placement)
+        # No reserve host is taken from the pool.
+        self.assertEqual([('host4', 0), ('host2', 0), ('host3', 0)],
+                         self._deleted())
+
+    def test_claimed_reserve_host_is_released_on_error(self):
+        plan = masakari_starter.planner.plan_first_fit_decreasing
+        calls = []
+
+        def fail_after_claim(vms, hosts):
+            calls.append(hosts)
+            if len(calls) == 4:
+                raise Exception('planner error')
+            return plan(vms, hosts)
+
+        with mock.patch.object(masakari_starter.planner,
+                               'plan_first_fit_decreasing',
+                               side_effect=fail_after_claim):
+            placement = self.rc_starter._plan_evacuation(
+                self.session, 'host0', 'port1', 'host1', self.servers)
+
+        self.assertEqual({}, placement)
+        self.assertEqual([('host4', 0), ('host2', 0), ('host3', 0)],
+                         self._deleted())
+
+
+class TestPrepareFailedHost(unittest.TestCase):
+    def setUp(self):
+        self.rc_starter = make_starter()
+
+        eng = create_engine('sqlite://')
+        models.Base.metadata.create_all(eng)
+        self.session = sessionmaker(bind=eng)()
+        now = datetime.datetime(2016, 1, 1, 0, 0, 0)
+        self.session.add(models.NotificationList(
+            id=1, notification_id='id1', recover_to='host1', progress=1,
+            create_at=now))
+        self.session.add(models.ReserveList(
+            id=1, cluster_port='port1', hostname='host1', deleted=0,
+            create_at=now))
+        self.session.commit()
+
+        # vm2 was migrated onto the failed host after the snapshot was
+        # refreshed, and vm3 was migrated away.
+        self.rc_starter.rc_inventory.get_servers_on_host.return_value = [
+            fake_server('vm1'),
+            fake_server('vm3')]
+        self.rc_starter.rc_util_api.fetch_servers_on_hypervisor.\
+            return_value = [fake_server('vm1'),
+                            fake_server('vm2')]
+
+    def tearDown(self):
+        self.session.close()
+
+    def _prepare(self):
+        return self.rc_starter._prepare_failed_host(
+            self.session, 'id1', 'host0', 'port1', False)
+
+    def _reconcile(self, prepared):
+        self.rc_starter._reconcile_failed_host(
+            self.session, 'id1', 'host0', prepared)
+
+    def _progresses(self):
+        return sorted((r.uuid, r.progress)
+                      for r in self.session.query(models.VmList))
+
+    def test_prepared_from_snapshot(self):
+        prepared = self._prepare()
+
+        self.assertTrue(prepared['from_snapshot'])
+        self.assertEqual(['vm1', 'vm3'], prepared['vm_list'])
+        self.assertFalse(
+            self.rc_starter.rc_util_api.fetch_servers_on_hypervisor.called)
+
+    def test_snapshot_is_reconciled_with_nova(self):
+        prepared = self._prepare()
+        self._reconcile(prepared)
+
+        self.assertEqual(['vm1', 'vm2'], prepared['vm_list'])
+        self.assertEqual(['vm1', 'vm2'], sorted(prepared['primary_ids']))
+        self.assertEqual(['vm1', 'vm2'], sorted(prepared['vm_infos']))
+        # The record of vm3 moved away is superseded.
+        self.assertEqual([('vm1', 0), ('vm2', 0), ('vm3', 4)],
+                         self._progresses())
+        self.assertEqual(
+            sorted(prepared['primary_ids'].values()),
+            sorted(self.rc_starter.in_flight_vm_list.snapshot()))
+
+    def test_snapshot_is_used_when_nova_fails(self):
+        self.rc_starter.rc_util_api.fetch_servers_on_hypervisor.\
+            side_effect = Exception('nova error')
+
+        prepared = self._prepare()
+        self._reconcile(prepared)
+
+        self.assertEqual(['vm1', 'vm3'], prepared['vm_list'])
+        self.assertEqual([('vm1', 0), ('vm3', 0)], self._progresses())
+
+    def test_servers_are_listed_from_nova_without_snapshot(self):
+        self.rc_starter.rc_inventory.get_servers_on_host.return_value = None
+
+        prepared = self._prepare()
+
+        self.assertFalse(prepared['from_snapshot'])
+        self.assertEqual(['vm1', 'vm2'], prepared['vm_list'])
+
+    def test_empty_snapshot_is_checked_with_nova(self):
+        self.rc_starter.rc_inventory.get_servers_on_host.return_value = []
+
+        prepared = self._prepare()
+
+        self.assertFalse(prepared['from_snapshot'])
+        self.assertEqual(['vm1', 'vm2'], prepared['vm_list'])
+
+    def test_error_without_snapshot(self):
+        self.rc_starter.rc_util_api.fetch_servers_on_hypervisor.\
+            side_effect = Exception('nova error')
+        self.rc_starter.rc_inventory.get_servers_on_host.return_value = None
+
+        self.assertRaises(Exception, self._prepare)
+
+
+class TestReleasePreparedHost(unittest.TestCase):
+    def setUp(self):
+        self.rc_starter = make_starter()
+        self.prepared = {'vm_infos': {}, 'vm_list': ['uuid1'],
+                         'recover_tos': None, 'primary_ids': {'uuid1': 1}}
+        self.rc_starter.in_flight_vm_list.add(1)
+
+    def test_release_once(self):
+        # The recovery job holds the record as well.
+        self.rc_starter.in_flight_vm_list.add(1)
+
+        self.rc_starter.release_prepared_host(self.prepared)
+        self.rc_starter.release_prepared_host(self.prepared)
+
+        self.assertEqual([1], self.rc_starter.in_flight_vm_list.snapshot())
+
+    @mock.patch.object(masakari_starter.dbapi, 'session_scope')
+    def test_add_failed_host_releases_on_error(self, mock_session_scope):
+        mock_session_scope.side_effect = Exception('db error')
+
+        self.rc_starter.add_failed_host('id1', 'host1', 'port1', False,
+                                        self.prepared)
+
+        self.assertEqual([], self.rc_starter.in_flight_vm_list.snapshot())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import os
+import sys
+import unittest
+
+import mock
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# FIXEME(masa) Adding python path is temporal hack. After setting up tox
+# test tool with virtualenv, throw away it.
+sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+from db import models
+import masakari_config
+import masakari_util
+
+
+def make_notification(id, type, hostname, cluster_port='port1'):
+    return {
+        'id': id, 'type': type, 'regionID': 'RegionOne',
+        'hostname': hostname, 'uuid': 'uuid-' + id,
+        'time': '20160101000000', 'eventID': '1', 'eventType': '2',
+        'detail': '2', 'startTime': '20160101000000', 'endTime': None,
+        'tzname': 'UTC', 'daylight': '0', 'cluster_port': cluster_port}
+
+
+class TestInsertNotificationListDbBulk(unittest.TestCase):
+    def setUp(self):
+        sample_config = os.path.dirname(os.path.abspath(__file__)) +\
+            '/masakari-controller-test.conf'
+        rc_config = masakari_config.RecoveryControllerConfig(sample_config)
+        self.rc_util_db = masakari_util.RecoveryControllerUtilDb(rc_config)
+
+        eng = create_engine('sqlite://')
+        models.Base.metadata.create_all(eng)
+        self.session = sessionmaker(bind=eng)()
+        now = datetime.datetime(2016, 1, 1, 0, 0, 0)
+        for id, cluster_port, hostname, seconds in (
+                (1, 'port1', 'host1', 0),
+                (2, 'port1', 'host3', 10),
+                (3, 'port2', 'host4', 0)):
+            self.session.add(models.ReserveList(
+                id=id, cluster_port=cluster_port, hostname=hostname,
+                deleted=0,
+                create_at=now + datetime.timedelta(seconds=seconds)))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    @mock.patch.object(masakari_util.socket, 'gethostbyname')
+    def test_mixed_batch(self, mock_gethostbyname):
+        mock_gethostbyname.side_effect = lambda h: '10.0.0.%s' % h[-1]
+        notifications = [
+            (make_notification('id1', 'rscGroup', 'host1'), 0),
+            (make_notification('id2', 'rscGroup', 'host2'), 0),
+            (make_notification('id3', 'VM', 'host2'), 1),
+            (make_notification('id4', 'rscGroup', 'host5', 'port3'), 0)]
+
+        with mock.patch.object(
+                masakari_util.dbapi,
+                'get_reserve_list_candidates_by_cluster_ports',
+                wraps=masakari_util.dbapi.
+                get_reserve_list_candidates_by_cluster_ports) as candidates:
+            result = self.rc_util_db.insert_notification_list_db_bulk(
+                notifications, self.session)
+
+        # The reserve nodes and the addresses are looked up once for the
+        # batch.
+        self.assertEqual(1, candidates.call_count)
+        self.assertEqual(3, mock_gethostbyname.call_count)
+
+        # host1 fails in the batch, so it is not a reserve node.
+        self.assertEqual(
+            [('id1', 'host3', 0, '10.0.0.1'), ('id2', 'host3', 0, '10.0.0.2'),
+             ('id3', None, 0, '10.0.0.2'), ('id4', None, 3, '10.0.0.5')],
+            [(r['notification_id'], r['recover_to'], r['progress'],
+              r['controle_ip']) for r in result])
+        self.assertEqual(
+            ['id1', 'id2', 'id3', 'id4'],
+            [r.notification_id for r in self.session.query(
+                models.NotificationList).order_by(
+                    models.NotificationList.id)])
+        self.assertEqual(
+            [('host1', 1), ('host3', 0), ('host4', 0)],
+            self.session.query(models.ReserveList.hostname,
+                               models.ReserveList.deleted).order_by(
+                models.ReserveList.id).all())
+
+    @mock.patch.object(masakari_util.socket, 'gethostbyname')
+    def test_resolved_addresses_are_reused(self, mock_gethostbyname):
+        mock_gethostbyname.side_effect = lambda h: '10.0.0.%s' % h[-1]
+        notifications = [
+            (make_notification('id1', 'VM', 'host1'), 1),
+            (make_notification('id2', 'VM', 'host2'), 1)]
+
+        result = self.rc_util_db.insert_notification_list_db_bulk(
+            notifications, self.session, {'host1': '10.0.1.1'})
+
+        mock_gethostbyname.assert_called_once_with('host2')
+        self.assertEqual(['10.0.1.1', '10.0.0.2'],
+                         [r['controle_ip'] for r in result])
+
+
+class TestUpdateVmListDb(unittest.TestCase):
+    def setUp(self):
+        sample_config = os.path.dirname(os.path.abspath(__file__)) +\
+            '/masakari-controller-test.conf'
+        rc_config = masakari_config.RecoveryControllerConfig(sample_config)
+        self.rc_util_db = masakari_util.RecoveryControllerUtilDb(rc_config)
+        self.rc_util_db.rc_journal = None
+
+        eng = create_engine('sqlite://')
+        models.Base.metadata.create_all(eng)
+        self.session = sessionmaker(bind=eng)()
+        self.session.add(models.VmList(
+            id=1, uuid='uuid1', progress=1, deleted=0,
+            create_at=datetime.datetime(2016, 1, 1, 0, 0, 0)))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_recovery_sec_is_recorded_with_end_of_progress(self):
+        self.rc_util_db.update_vm_list_db(
+            self.session, 'progress', 2, 1, recovery_sec=95)
+        self.session.commit()
+
+        row = self.session.query(models.VmList).one()
+        self.assertEqual(2, row.progress)
+        self.assertEqual(95, row.recovery_sec)
+        self.assertIsNotNone(row.delete_at)
+
+
+class TestRecoveryControllerUtilApi(unittest.TestCase):
+    def setUp(self):
+        sample_config = os.path.dirname(os.path.abspath(__file__)) +\
+            '/masakari-controller-test.conf'
+        self.rc_config = masakari_config.RecoveryControllerConfig(
+            sample_config)
+        self.conf_dic = self.rc_config.get_value('recover_starter')
+
+        for target, attribute in (
+                (masakari_util.RecoveryControllerUtilApi,
+                 '_fetch_project_id'),
+                (masakari_util.nova_client, 'Client'),
+                (masakari_util.threading, 'Thread')):
+            patcher = mock.patch.object(target, attribute)
+            setattr(self, 'mock_' + attribute.strip('_'), patcher.start())
+            self.addCleanup(patcher.stop)
+        self.mock_fetch_project_id.return_value = 'project1'
+
+        patcher = mock.patch.object(masakari_util, '_UTIL_API', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _pool_maxsize(self, util_api):
+        return util_api.auth_session.session.get_adapter(
+            'http://nova').poolmanager.connection_pool_kw['maxsize']
+
+    def test_util_api_is_shared(self):
+        util_api = masakari_util.get_util_api(self.rc_config)
+
+        self.assertIs(util_api, masakari_util.get_util_api(self.rc_config))
+        # The nova clients share the keystone session.
+        for call in self.mock_Client.call_args_list:
+            self.assertIs(util_api.auth_session, call[1]['session'])
+
+    def test_pool_size(self):
+        self.conf_dic['semaphore_multiplicity'] = '4'
+        self.conf_dic['adaptive_concurrency'] = 'false'
+
+        util_api = masakari_util.RecoveryControllerUtilApi(self.rc_config)
+
+        self.assertEqual(4 + masakari_util._API_POOL_EXTRA_SIZE,
+                         util_api.pool_size)
+        self.assertEqual(util_api.pool_size, self._pool_maxsize(util_api))
+
+    def test_pool_size_with_adaptive_concurrency(self):
+        self.conf_dic['semaphore_multiplicity'] = '4'
+        self.conf_dic['adaptive_concurrency'] = 'true'
+        self.conf_dic['adaptive_concurrency_max'] = '30'
+
+        util_api = masakari_util.RecoveryControllerUtilApi(self.rc_config)
+
+        self.assertEqual(30 + masakari_util._API_POOL_EXTRA_SIZE,
+                         util_api.pool_size)
+
+    def test_token_is_refreshed_early(self):
+        util_api = masakari_util.RecoveryControllerUtilApi(self.rc_config)
+
+        self.assertEqual(masakari_util._TOKEN_REFRESH_MARGIN_SEC,
+                         util_api.auth_session.auth.MIN_TOKEN_LIFE_SECONDS)
+        self.assertEqual(util_api._refresh_token,
+                         self.mock_Thread.call_args[1]['target'])
+        self.mock_Thread.return_value.start.assert_called_once_with()
+
+    @mock.patch.object(masakari_util.time, 'sleep')
+    def test_refresh_token(self, mock_sleep):
+        util_api = masakari_util.RecoveryControllerUtilApi(self.rc_config)
+        util_api.auth_session = mock.Mock()
+        util_api.auth_session.get_token.side_effect = [
+            Exception('keystone error'), 'token']
+
+        # The loop continues after an error.
+        mock_sleep.side_effect = [None, StopIteration()]
+        self.assertRaises(StopIteration, util_api._refresh_token)
+
+        self.assertEqual(2, util_api.auth_session.get_token.call_count)
+        mock_sleep.assert_called_with(
+            masakari_util._TOKEN_REFRESH_INTERVAL_SEC)
+
+    def test_authenticate(self):
+        util_api = masakari_util.RecoveryControllerUtilApi(self.rc_config)
+        util_api.auth_session = mock.Mock()
+
+        util_api.authenticate()
+
+        util_api.auth_session.get_token.assert_called_once_with()
+
+
+class TestFetchHypervisorFreeResources(unittest.TestCase):
+    def setUp(self):
+        sample_config = os.path.dirname(os.path.abspath(__file__)) +\
+            '/masakari-controller-test.conf'
+        rc_config = masakari_config.RecoveryControllerConfig(sample_config)
+        self.conf_dic = rc_config.get_value('recover_starter')
+        self.util_api = masakari_util.RecoveryControllerUtilApi.__new__(
+            masakari_util.RecoveryControllerUtilApi)
+        self.util_api.rc_config = rc_config
+        self.util_api.governor = mock.Mock()
+        self.util_api.governor.call.side_effect = \
+            lambda name, func: func()
+        self.util_api.nova_client = mock.Mock()
+        self.util_api.nova_client.hypervisors.list.return_value = [
+            mock.Mock(service={'host': 'host1'}, vcpus=8, vcpus_used=20,
+                      memory_mb=16384, memory_mb_used=20480)]
+
+    def test_allocation_ratios(self):
+        self.conf_dic['cpu_allocation_ratio'] = '16.0'
+        self.conf_dic['ram_allocation_ratio'] = '1.5'
+
+        self.assertEqual(
+            {'host1': (8 * 16 - 20, 16384 * 3 / 2 - 20480)},
+            self.util_api.fetch_hypervisor_free_resources())
+
+    def test_no_overcommit(self):
+        self.conf_dic['cpu_allocation_ratio'] = '1.0'
+        self.conf_dic['ram_allocation_ratio'] = '1.0'
+
+        self.assertEqual(
+            {'host1': (8 - 20, 16384 - 20480)},
+            self.util_api.fetch_hypervisor_free_resources())
+
+
+class TestDoInstanceShow(unittest.TestCase):
+    @mock.patch.object(masakari_util.governor.time, 'sleep')
+    def test_transient_error_is_retried(self, mock_sleep):
+        util_api = masakari_util.RecoveryControllerUtilApi.__new__(
+            masakari_util.RecoveryControllerUtilApi)
+        util_api.governor = masakari_util.governor.NovaApiGovernor(
+            0, 10, 3, 10, 0.2)
+        util_api.nova_client = mock.Mock()
+        util_api.nova_client.servers.get.side_effect = [
+            masakari_util.exceptions.ClientException(500),
+            'server']
+
+        self.assertEqual('server', util_api.do_instance_show('uuid1'))
+        self.assertEqual(2, util_api.nova_client.servers.get.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,17 +28,63 @@ sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 import fakes as nova_fakes
 import masakari_config
+import masakari_executor
 import masakari_util
 import masakari_worker
 
+
+def run_job(job):
+    """
+    Run the generator job of the recovery executor in this thread. The
+    fake waits call the callback back before they return.
+    """
+    value = None
+    error = None
+    while True:
+        try:
+            if error is not None:
+                yielded = job.throw(*error)
+            else:
+                yielded = job.send(value)
+        except StopIteration:
+            return None
+        except masakari_executor.Return as e:
+            return e.value
+
+        value, error = None, None
+        if isinstance(yielded, masakari_executor.Wait):
+            results = []
+            yielded.func(*(yielded.args + (results.append, )))
+            value = results[0]
+        else:
+            try:
+                value = run_job(yielded)
+            except Exception:
+                error = sys.exc_info()
+
+
+def returning(value):
+    raise masakari_executor.Return(value)
+    yield
+
+
 class TestRecoveryControllerWorker(unittest.TestCase):
     def setUp(self):
         
         sample_config = os.path.dirname(os.path.abspath(__file__)) +\
             '/masakari-controller-test.conf'
         rc_config = masakari_config.RecoveryControllerConfig(sample_config)
-        with mock.patch('masakari_util.RecoveryControllerUtilApi') as mock_api:
+        with mock.patch('masakari_util.get_util_api') as mock_api:
             self.worker = masakari_worker.RecoveryControllerWorker(rc_config)
+        self.worker.rc_state_poller = mock.Mock()
+        self.is_stopped = True
+        self.worker.rc_state_poller.watch_state.side_effect = (
+            lambda uuid, vm_state, timeout, callback:
+            callback(self.is_stopped))
+        self.evacuation_results = []
+        self.worker.rc_state_poller.watch_evacuation.side_effect = (
+            lambda uuid, target_host, timeout, callback:
+            callback(self.evacuation_results.pop(0)))
         
     def tearDown(self):
         pass
@@ -49,8 +95,8 @@ class TestRecoveryControllerWorker(unittest.TestCase):
 
         expected_ret = self.worker.STATUS_NORMAL
 
-        ret = self.worker._do_node_accident_vm_recovery(
-            'uuid1', 'resized', 'node1')
+        ret = run_job(self.worker._do_node_accident_vm_recovery(
+            'uuid1', 'resized', 'node1'))
 
         self.assertEqual(expected_ret, ret)
         (self.worker.rc_util_api.do_instance_reset.
@@ -60,24 +106,77 @@ class TestRecoveryControllerWorker(unittest.TestCase):
         self.worker.rc_util_api.do_instance_evacuate.return_value = None
         expected_ret = self.worker.STATUS_NORMAL
 
-        ret = self.worker._do_node_accident_vm_recovery(
-            'uuid1', 'active', 'node1')
+        ret = run_job(self.worker._do_node_accident_vm_recovery(
+            'uuid1', 'active', 'node1'))
         self.assertEqual(expected_ret, ret)
         (self.worker.rc_util_api.do_instance_evacuate.
          assert_called_with('uuid1', 'node1'))
 
-        ret = self.worker._do_node_accident_vm_recovery(
-            'uuid2', 'stopped', 'node1')
+        ret = run_job(self.worker._do_node_accident_vm_recovery(
+            'uuid2', 'stopped', 'node1'))
         self.assertEqual(expected_ret, ret)
         (self.worker.rc_util_api.do_instance_evacuate.
          assert_called_with('uuid2', 'node1'))
 
+    def _enable_evacuation_tracking(self):
+        conf_dic = self.worker.rc_config.get_value('recover_starter')
+        conf_dic['evacuation_tracking'] = 'true'
+        conf_dic['evacuation_max_retry_cnt'] = '1'
+
+    def test_do_node_accident_vm_recovery_waits_for_evacuation(self):
+        self._enable_evacuation_tracking()
+        self.evacuation_results = ['done']
+
+        ret = run_job(self.worker._do_node_accident_vm_recovery(
+            'uuid1', 'active', 'node1'))
+
+        self.assertEqual(self.worker.STATUS_NORMAL, ret)
+        (self.worker.rc_state_poller.watch_evacuation.
+         assert_called_with('uuid1', 'node1', 600, mock.ANY))
+
+    def test_do_node_accident_vm_recovery_with_evacuation_timeout(self):
+        self._enable_evacuation_tracking()
+        self.evacuation_results = [None]
+
+        ret = run_job(self.worker._do_node_accident_vm_recovery(
+            'uuid1', 'active', 'node1'))
+
+        self.assertEqual(self.worker.STATUS_ERROR, ret)
+
+    def test_do_node_accident_vm_recovery_retries_failed_evacuation(self):
+        self._enable_evacuation_tracking()
+        self.evacuation_results = ['error', 'done']
+        error_server = nova_fakes.FakeNovaServer(
+            'uuid1', 'error', host='failed_node')
+        self.worker.rc_util_api.do_instance_show.return_value = error_server
+
+        ret = run_job(self.worker._do_node_accident_vm_recovery(
+            'uuid1', 'active', 'node1'))
+
+        self.assertEqual(self.worker.STATUS_NORMAL, ret)
+        self.assertEqual(
+            2, self.worker.rc_util_api.do_instance_evacuate.call_count)
+
+    def test_do_node_accident_vm_recovery_with_error_on_target(self):
+        self._enable_evacuation_tracking()
+        self.evacuation_results = ['error']
+        error_server = nova_fakes.FakeNovaServer(
+            'uuid1', 'error', host='node1')
+        self.worker.rc_util_api.do_instance_show.return_value = error_server
+
+        ret = run_job(self.worker._do_node_accident_vm_recovery(
+            'uuid1', 'active', 'node1'))
+
+        self.assertEqual(self.worker.STATUS_ERROR, ret)
+        self.assertEqual(
+            1, self.worker.rc_util_api.do_instance_evacuate.call_count)
+
     def test_do_process_accident_vm_recovery_with_stopped(self):
         self.worker.rc_util_api.do_instance_reset.return_value = None
         expected_ret = self.worker.STATUS_NORMAL
 
-        ret = self.worker._do_process_accident_vm_recovery(
-            'uuid1', 'stopped')
+        ret = run_job(self.worker._do_process_accident_vm_recovery(
+            'uuid1', 'stopped'))
         self.assertEqual(expected_ret, ret)
         (self.worker.rc_util_api.do_instance_reset.
          assert_called_with('uuid1', 'stopped'))
@@ -86,37 +185,81 @@ class TestRecoveryControllerWorker(unittest.TestCase):
     def test_do_process_accident_vm_recovery_with_resized(self):
         self.worker.rc_util_api.do_instance_reset.return_value = None
         self.worker.rc_util_api.do_instance_stop.return_value = None
-        stopped_server = nova_fakes.FakeNovaServer('uuid1', 'stopped', {})
-        self.worker.rc_util_api.do_instance_show.return_value = stopped_server
         self.worker.rc_util_api.do_instance_start.return_value = None
 
         expected_ret = self.worker.STATUS_NORMAL
 
-        ret = self.worker._do_process_accident_vm_recovery(
-            'uuid1', 'resized')
+        ret = run_job(self.worker._do_process_accident_vm_recovery(
+            'uuid1', 'resized'))
 
         self.assertEqual(expected_ret, ret)
         (self.worker.rc_util_api.do_instance_reset.
          assert_called_with('uuid1', 'active'))
         self.worker.rc_util_api.do_instance_stop.assert_called_with('uuid1')
-        self.worker.rc_util_api.do_instance_show.assert_called_with('uuid1')
+        (self.worker.rc_state_poller.watch_state.
+         assert_called_with('uuid1', 'stopped', mock.ANY, mock.ANY))
         self.worker.rc_util_api.do_instance_start.assert_called_with('uuid1')
 
     def test_do_process_accident_vm_recovery_with_active(self):
         self.worker.rc_util_api.do_instance_stop.return_value = None
-        stopped_server = nova_fakes.FakeNovaServer('uuid1', 'stopped', {})
-        self.worker.rc_util_api.do_instance_show.return_value = stopped_server
         self.worker.rc_util_api.do_instance_start.return_value = None
         expected_ret = self.worker.STATUS_NORMAL
 
-        ret = self.worker._do_process_accident_vm_recovery(
-            'uuid1', 'active')
+        ret = run_job(self.worker._do_process_accident_vm_recovery(
+            'uuid1', 'active'))
 
         self.assertEqual(expected_ret, ret)
         self.worker.rc_util_api.do_instance_stop.assert_called_with('uuid1')
-        self.worker.rc_util_api.do_instance_show.assert_called_with('uuid1')
+        (self.worker.rc_state_poller.watch_state.
+         assert_called_with('uuid1', 'stopped', mock.ANY, mock.ANY))
         self.worker.rc_util_api.do_instance_start.assert_called_with('uuid1')
 
+    def test_do_process_accident_vm_recovery_not_stopped(self):
+        self.is_stopped = None
+
+        ret = run_job(self.worker._do_process_accident_vm_recovery(
+            'uuid1', 'active'))
+
+        self.assertEqual(self.worker.STATUS_ERROR, ret)
+        self.assertFalse(self.worker.rc_util_api.do_instance_start.called)
+
+    @mock.patch.object(masakari_worker, 'dbapi')
+    def test_recovery_instance_with_vm_info(self, mock_dbapi):
+        self.worker.rc_util_db = mock.Mock()
+        self.worker._get_vmha_param = mock.Mock(return_value=(0, 'node1'))
+        self.worker._execute_recovery = mock.Mock(
+            return_value=returning(self.worker.STATUS_NORMAL))
+        active_server = nova_fakes.FakeNovaServer(
+            'uuid1', 'active', {'HA-Enabled': 'off'})
+
+        run_job(self.worker.recovery_instance('uuid1', 1,
+                                              vm_info=active_server))
+
+        self.assertFalse(self.worker.rc_util_api.do_instance_show.called)
+        self.worker._execute_recovery.assert_called_with(
+            'uuid1', 'active', 'OFF', 0, 'node1')
+        self.worker.rc_util_db.update_vm_list_db.assert_called_with(
+            mock.ANY, 'progress', 2, 1, recovery_sec=0)
+
+    @mock.patch.object(masakari_worker, 'dbapi')
+    @mock.patch.object(masakari_worker, 'time')
+    def test_recovery_instance_records_recovery_sec(self, mock_time,
+                                                   mock_dbapi):
+        # The recovery ends when the evacuation completes, 95 seconds
+        # after it started.
+        mock_time.time.side_effect = [1000.0, 1001.0, 1095.0, 1095.0]
+        self._enable_evacuation_tracking()
+        self.evacuation_results = ['done']
+        self.worker.rc_util_db = mock.Mock()
+        self.worker._get_vmha_param = mock.Mock(return_value=(0, 'node1'))
+        active_server = nova_fakes.FakeNovaServer('uuid1', 'active')
+
+        run_job(self.worker.recovery_instance('uuid1', 1,
+                                              vm_info=active_server))
+
+        self.worker.rc_util_db.update_vm_list_db.assert_called_with(
+            mock.ANY, 'progress', 2, 1, recovery_sec=95)
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(
@@ -17,14 +17,15 @@ Definition of interfaces to access database and helper methods
  to handle SQLAlchemy session
 """
 
-from sqlalchemy import engine, create_engine, or_
+from sqlalchemy import engine, create_engine, event, or_
+from sqlalchemy import bindparam, pool
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql.expression import desc
 from models import NotificationList, VmList, ReserveList
 from models import Base
+import migration
 from sqlalchemy_utils.functions import database_exists, create_database
 from sqlalchemy import asc
-from sqlalchemy.orm import scoped_session
 from sqlalchemy import distinct
 import sqlalchemy.exc as dbexc
 from contextlib import contextmanager
@@ -33,6 +34,8 @@ import sys
 import traceback
 import syslog
 from functools import wraps
+import random
+import threading
 import time
 parentdir = os.path.abspath(os.path.join(os.path.dirname(__file__),
                                          os.path.pardir))
@@ -50,6 +53,56 @@ import controller.masakari_config as config
 
 _SESSION = sessionmaker()
 
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+_POOL_STATS_LOCK = threading.Lock()
+_SESSION_STATS = {'opened_cnt': 0, 'closed_cnt': 0}
+
+# The number of the values in an IN clause of a statement
+_IN_CLAUSE_SIZE = 1000
+
+# Retries of the statements failed with a deadlock or a lock wait timeout.
+# _LOCK_RETRY_MAX_CNT is replaced by lock_retry_max_cnt in [db] section when
+# the engine is created.
+_LOCK_RETRY_MAX_CNT = 5
+_LOCK_RETRY_BASE_SEC = 0.5
+_LOCK_RETRY_MAX_SEC = 8.0
+_RETRY_STATS_LOCK = threading.Lock()
+_RETRY_STATS = {}
+_POOL_STATS = {'checkout_cnt': 0,
+               'checkin_cnt': 0,
+               'checkout_wait_total_sec': 0.0,
+               'checkout_wait_max_sec': 0.0}
+
+
+class _TimedQueuePool(pool.QueuePool):
+    """
+    QueuePool which measures the time to check out a connection. It
+    includes the wait for a free connection, up to pool_timeout, and the
+    pre-ping. Only the public connect() is wrapped.
+    """
+
+    def connect(self):
+        start = time.time()
+        try:
+            return super(_TimedQueuePool, self).connect()
+        finally:
+            wait = time.time() - start
+            with _POOL_STATS_LOCK:
+                _POOL_STATS['checkout_wait_total_sec'] += wait
+                _POOL_STATS['checkout_wait_max_sec'] = max(
+                    _POOL_STATS['checkout_wait_max_sec'], wait)
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    with _POOL_STATS_LOCK:
+        _POOL_STATS['checkout_cnt'] += 1
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    with _POOL_STATS_LOCK:
+        _POOL_STATS['checkin_cnt'] += 1
+
 
 @contextmanager
 def _sqlalchemy_error():
@@ -76,29 +129,79 @@ def _session_handle(fn):
     return wrapped
 
 
+def _lock_retry_wait(retry_cnt):
+    """
+    Return the seconds to wait before the retry, chosen at random between
+    zero and the exponential backoff (full jitter) so that the threads
+    failed together do not retry together.
+    """
+    backoff = min(_LOCK_RETRY_MAX_SEC, _LOCK_RETRY_BASE_SEC * 2 ** retry_cnt)
+    return random.uniform(0, backoff)
+
+
+def _count_retry(name, key):
+    with _RETRY_STATS_LOCK:
+        stats = _RETRY_STATS.setdefault(
+            name, {'retry_cnt': 0, 'exhausted_cnt': 0})
+        stats[key] += 1
+
+
 def _retry_on_deadlock(fn):
-    """Decorator to retry a DB API call if Deadlock was received."""
+    """
+    Decorator to retry a DB API call if Deadlock was received.
+    The call is retried up to lock_retry_max_cnt times, then the error is
+    raised. The other errors are raised without retrying.
+    """
     lock_messages_error = ['Deadlock found', 'Lock wait timeout exceeded']
 
     @wraps(fn)
     def wrapped(*args, **kwargs):
+        retry_cnt = 0
         while True:
             try:
                 return fn(*args, **kwargs)
             except dbexc.OperationalError as e:
-                if any(msg in e.message for msg in lock_messages_error):
-                    # msg = ("Deadlock detected when running %s Retrying..." %
-                    #        (fn.__name__))
-                    # rc_util.syslogout(msg, syslog.LOG_WARNING)
-                    # Retry!
-                    time.sleep(0.5)
-                    continue
+                if not any(msg in str(e) for msg in lock_messages_error):
+                    raise
+                if retry_cnt >= _LOCK_RETRY_MAX_CNT:
+                    _count_retry(fn.__name__, 'exhausted_cnt')
+                    raise
+                _count_retry(fn.__name__, 'retry_cnt')
+                time.sleep(_lock_retry_wait(retry_cnt))
+                retry_cnt += 1
     return wrapped
 
 
+def get_retry_stats():
+    """
+    Return the numbers of the deadlock retries for each DB API call in the
+    dictionary type.
+    """
+    with _RETRY_STATS_LOCK:
+        return dict((name, dict(stats))
+                    for name, stats in _RETRY_STATS.items())
+
+
 def get_engine(rc_config):
+    """
+    Return the engine shared in the process. It is created with the
+    configuration at the first call.
+    """
+    global _ENGINE
+
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            _ENGINE = _create_engine(rc_config)
+    return _ENGINE
+
+
+def _create_engine(rc_config):
+    global _LOCK_RETRY_MAX_CNT
+
     # Connect db
     conf_db_dic = rc_config.get_value('db')
+    _LOCK_RETRY_MAX_CNT = int(conf_db_dic.get(
+        "lock_retry_max_cnt") or _LOCK_RETRY_MAX_CNT)
     """
     Possible values for db drivername is,
      'drizzle',
@@ -135,25 +238,93 @@ def get_engine(rc_config):
             port=conf_db_dic.get("port", None),
             query=query
         )
-        eng = create_engine(dburl)
+        eng = create_engine(
+            dburl,
+            poolclass=_TimedQueuePool,
+            pool_size=int(conf_db_dic.get("pool_size", 10)),
+            max_overflow=int(conf_db_dic.get("max_overflow", 20)),
+            pool_timeout=int(conf_db_dic.get("pool_timeout", 30)),
+            pool_recycle=int(conf_db_dic.get("pool_recycle", 3600)),
+            pool_pre_ping=str(conf_db_dic.get(
+                "pool_pre_ping", "true")).lower() == "true")
     else:
         eng = create_engine('sqlite:////tmp/msakari.db', echo=True)
+    event.listen(eng, 'checkout', _on_checkout)
+    event.listen(eng, 'checkin', _on_checkin)
     return eng
 
 
-def create_tables():
-    eng = get_engine()
+def get_pool_stats():
+    """
+    Return the statistics of the connection pool in the dictionary type.
+    """
+    with _POOL_STATS_LOCK:
+        stats = dict(_POOL_STATS)
+    stats['checked_out_cnt'] = stats['checkout_cnt'] - stats['checkin_cnt']
+    if stats['checkout_cnt']:
+        stats['checkout_wait_avg_sec'] = \
+            stats['checkout_wait_total_sec'] / stats['checkout_cnt']
+    else:
+        stats['checkout_wait_avg_sec'] = 0.0
+
+    eng = _ENGINE
+    if eng is not None and isinstance(eng.pool, pool.QueuePool):
+        stats['pool_size'] = eng.pool.size()
+        stats['overflow'] = eng.pool.overflow()
+    return stats
+
+
+def create_tables(rc_config=None):
+    """
+    Create the database and the tables, or upgrade the tables of an
+    existing database to the latest schema version.
+    """
+    if rc_config is None:
+        rc_config = config.RecoveryControllerConfig()
+    eng = get_engine(rc_config)
     if not database_exists(eng.url):
         create_database(eng.url)
-    # Create all tables in the engine
-    Base.metadata.create_all(eng)
+    # Create all tables in the engine, or apply the migrations
+    return migration.upgrade(eng)
 
 
-def get_session(engine):
-    with _sqlalchemy_error():
-        session_fac = sessionmaker(bind=engine)
-        thread_local_session = scoped_session(session_fac)
-    return thread_local_session()
+@contextmanager
+def session_scope(rc_config=None):
+    """
+    Provide a session for a unit of work. The session is rolled back if
+    the block raises an error, and is always closed at the end of the block.
+    :param rc_config: RecoveryControllerConfig object. It can be omitted
+     after the engine has been created.
+    """
+    if rc_config is None:
+        eng = _ENGINE
+        if eng is None:
+            raise RuntimeError("The engine has not been created yet.")
+    else:
+        eng = get_engine(rc_config)
+
+    session = _SESSION(bind=eng)
+    with _POOL_STATS_LOCK:
+        _SESSION_STATS['opened_cnt'] += 1
+    try:
+        yield session
+    except:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        with _POOL_STATS_LOCK:
+            _SESSION_STATS['closed_cnt'] += 1
+
+
+def get_session_stats():
+    """
+    Return the statistics of the sessions in the dictionary type.
+    """
+    with _POOL_STATS_LOCK:
+        stats = dict(_SESSION_STATS)
+    stats['open_cnt'] = stats['opened_cnt'] - stats['closed_cnt']
+    return stats
 
 
 @_session_handle
@@ -173,6 +344,29 @@ def get_all_notification_list_by_notification_id(session, notification_id):
     return res
 
 
+@_session_handle
+def exists_notification_list_by_notification_id(session, notification_id):
+    # SELECT id FROM notification_list
+    #   WHERE notification_id = :notification_id LIMIT 1
+    with _sqlalchemy_error():
+        res = session.query(NotificationList.id).filter_by(
+            notification_id=notification_id).first()
+    return res is not None
+
+
+@_session_handle
+def get_recent_notification_ids(session, since, limit):
+    # SELECT notification_id,notification_time FROM notification_list
+    #   WHERE notification_time >= :since
+    #   ORDER BY notification_time desc LIMIT :limit
+    with _sqlalchemy_error():
+        res = session.query(NotificationList.notification_id,
+                            NotificationList.notification_time).filter(
+            NotificationList.notification_time >= since).order_by(
+            desc(NotificationList.notification_time)).limit(limit).all()
+    return res
+
+
 @_retry_on_deadlock
 @_session_handle
 def get_all_notification_list_by_id_for_update(
@@ -196,6 +390,21 @@ def get_all_notification_list_by_hostname_type(
     return res
 
 
+@_session_handle
+def get_notification_times_by_hostname_type_since(
+        session, notification_hostname, since):
+    # SELECT notification_time FROM notification_list \
+    #   WHERE notification_hostname = :notification_hostname AND \
+    #   notification_type = 'rscGroup' AND notification_time >= :since
+    with _sqlalchemy_error():
+        res = [row.notification_time for row in session.query(
+            NotificationList.notification_time).
+            filter_by(notification_hostname=notification_hostname).
+            filter_by(notification_type='rscGroup').
+            filter(NotificationList.notification_time >= since)]
+    return res
+
+
 @_retry_on_deadlock
 @_session_handle
 def add_notification_list(session, create_at, update_at,
@@ -243,6 +452,17 @@ def add_notification_list(session, create_at, update_at,
     return notification_list
 
 
+@_retry_on_deadlock
+@_session_handle
+def add_notification_list_bulk(session, rows):
+    # INSERT INTO notification_list (create_at, ..., recover_to)
+    #   VALUES (...), (...), ...
+    with _sqlalchemy_error():
+        res = session.execute(
+            NotificationList.__table__.insert().values(rows))
+    return res.rowcount
+
+
 @_retry_on_deadlock
 @_session_handle
 def update_notification_list_by_notification_id(session,
@@ -305,6 +525,37 @@ def get_vm_list_by_uuid_and_progress_sorted(session, notification_uuid):
     return res
 
 
+@_retry_on_deadlock
+@_session_handle
+def supersede_reprocessing_vm_list(session, update_at):
+    """
+    Pick the vm_list records to be reprocessed at startup, and mark the
+    others as superseded(progress=4) in one transaction.
+    For each uuid, only the first record in progress=0 or 1 ordered by
+    recover_by ASC, create_at DESC is reprocessed.
+    :returns: The vm_list records to be reprocessed
+    """
+    # SELECT id, uuid FROM vm_list WHERE progress = 0 OR progress = 1
+    #   ORDER BY uuid, recover_by ASC, create_at DESC
+    with _sqlalchemy_error():
+        rows = session.query(VmList.id, VmList.uuid).filter(or_(
+            VmList.progress == 0, VmList.progress == 1)).order_by(
+                VmList.uuid, asc(VmList.recover_by),
+                desc(VmList.create_at)).all()
+
+    superseded = []
+    kept = []
+    for row in rows:
+        if kept and kept[-1].uuid == row.uuid:
+            superseded.append(row.id)
+        else:
+            kept.append(row)
+
+    _update_progress_by_ids(session, VmList, superseded, 4, update_at,
+                            [0, 1])
+    return kept
+
+
 @_session_handle
 def get_vm_list_by_id(session, id):
     # sql = "SELECT recover_by, recover_to " \
@@ -335,6 +586,34 @@ def update_vm_list_by_id_dict(session, id, update_val):
     return res
 
 
+@_retry_on_deadlock
+@_session_handle
+def update_vm_list_by_id_dicts(session, update_vals):
+    """
+    Update many vm_list records in one transaction.
+    :param update_vals: The dictionary of id and the dictionary of the
+     columns to be updated
+    """
+    # UPDATE vm_list SET :key = :value WHERE id = :id, executed for each
+    # set of the updated columns
+    # The names of the bind parameters must differ from the column names.
+    groups = {}
+    for id, update_val in update_vals.items():
+        params = dict(('_' + key, value)
+                      for key, value in update_val.items())
+        params['_id'] = id
+        groups.setdefault(tuple(sorted(update_val)), []).append(params)
+
+    res = 0
+    with _sqlalchemy_error():
+        for keys, params in groups.items():
+            stmt = VmList.__table__.update().where(
+                VmList.id == bindparam('_id')).values(
+                    dict((key, bindparam('_' + key)) for key in keys))
+            res += session.execute(stmt, params).rowcount
+    return res
+
+
 @_retry_on_deadlock
 @_session_handle
 def add_vm_list(session, create_at, deleted, uuid, progress, retry_cnt,
@@ -352,6 +631,63 @@ def add_vm_list(session, create_at, deleted, uuid, progress, retry_cnt,
     return vm_list
 
 
+@_session_handle
+def get_vm_list_uuids_in_progress(session, uuids):
+    # SELECT DISTINCT uuid FROM vm_list
+    #   WHERE uuid IN (:uuids) AND (progress = 0 OR progress = 1)
+    res = set()
+    with _sqlalchemy_error():
+        for i in range(0, len(uuids), _IN_CLAUSE_SIZE):
+            res.update(row.uuid for row in session.query(
+                VmList.uuid).filter(
+                VmList.uuid.in_(uuids[i:i + _IN_CLAUSE_SIZE])).filter(
+                or_(VmList.progress == 0, VmList.progress == 1)).distinct())
+    return res
+
+
+@_retry_on_deadlock
+@_session_handle
+def add_vm_list_bulk(session, create_at, notification_id, uuids, retry_cnt,
+                     recover_to, recover_by, recover_tos=None):
+    """
+    Insert vm_list records of the uuids for the notification with one
+    executemany, and read back their ids.
+    recover_tos overrides recover_to for the uuids in it.
+    :returns: The dictionary of uuid and id of the inserted record
+    """
+    # INSERT INTO vm_list ( create_at, deleted, uuid, progress, retry_cnt,
+    #   notification_id, recover_to, recover_by ) VALUES ( ... ), ...
+    if not uuids:
+        return {}
+    # DATETIME column of MySQL does not keep microseconds, so they are
+    # dropped to read back the records by create_at.
+    create_at = create_at.replace(microsecond=0)
+    rows = [{'create_at': create_at,
+             'deleted': 0,
+             'uuid': uuid,
+             'progress': 0,
+             'retry_cnt': retry_cnt,
+             'notification_id': notification_id,
+             'recover_to': (recover_tos or {}).get(uuid, recover_to),
+             'recover_by': recover_by} for uuid in uuids]
+    with _sqlalchemy_error():
+        session.execute(VmList.__table__.insert(), rows)
+
+    # SELECT id, uuid FROM vm_list
+    #   WHERE notification_id = :notification_id AND create_at = :create_at
+    #   AND uuid IN (:uuids) ORDER BY id
+    res = {}
+    with _sqlalchemy_error():
+        for i in range(0, len(uuids), _IN_CLAUSE_SIZE):
+            for row in session.query(VmList.id, VmList.uuid).filter_by(
+                    notification_id=notification_id,
+                    create_at=create_at).filter(
+                    VmList.uuid.in_(uuids[i:i + _IN_CLAUSE_SIZE])).order_by(
+                    VmList.id):
+                res[row.uuid] = row.id
+    return res
+
+
 @_session_handle
 def get_all_reserve_list_by_hostname_not_deleted(session, hostname):
     # SELECT * FROM reserve_list WHERE deleted=0 AND hostname=:hostname
@@ -362,18 +698,69 @@ def get_all_reserve_list_by_hostname_not_deleted(session, hostname):
 
 
 @_session_handle
-def get_one_reserve_list_by_cluster_port_for_update(session, cluster_port,
-                                                    notification_hostname):
+def get_reserve_list_candidates(session, cluster_port,
+                                notification_hostname):
     # SELECT id,hostname FROM reserve_list
     #   WHERE deleted=0 and cluster_port=:cluster_port
     #   and hostname!=:notification_hostname
-    #   ORDER by create_at asc limit 1 FOR UPDATE
+    #   ORDER by create_at asc
+    # The rows are not locked. A candidate is taken with
+    # claim_reserve_list_by_id.
     with _sqlalchemy_error():
         res = session.query(
-            ReserveList).with_for_update().filter_by(deleted=0).filter_by(
-                cluster_port=cluster_port).filter(
+            ReserveList.id, ReserveList.hostname).filter_by(
+                deleted=0).filter_by(cluster_port=cluster_port).filter(
                     ReserveList.hostname != notification_hostname).order_by(
-                        asc(ReserveList.create_at)).first()
+                        asc(ReserveList.create_at), ReserveList.id).all()
+    return res
+
+
+@_session_handle
+def get_reserve_list_candidates_by_cluster_ports(session, cluster_ports,
+                                                 excluded_hostnames):
+    # SELECT id,cluster_port,hostname FROM reserve_list
+    #   WHERE deleted=0 and cluster_port IN (:cluster_ports)
+    #   and hostname NOT IN (:excluded_hostnames)
+    #   ORDER by create_at asc
+    # The candidates of a batch of notifications are got at once.
+    if not cluster_ports:
+        return []
+    with _sqlalchemy_error():
+        query = session.query(
+            ReserveList.id, ReserveList.cluster_port,
+            ReserveList.hostname).filter_by(deleted=0).filter(
+                ReserveList.cluster_port.in_(cluster_ports))
+        if excluded_hostnames:
+            query = query.filter(
+                ~ReserveList.hostname.in_(excluded_hostnames))
+        res = query.order_by(asc(ReserveList.create_at),
+                             ReserveList.id).all()
+    return res
+
+
+@_retry_on_deadlock
+@_session_handle
+def claim_reserve_list_by_id(session, reserve_id, delete_at):
+    # UPDATE reserve_list SET deleted=1, delete_at=:delete_at
+    #   WHERE id=:reserve_id AND deleted=0
+    # Returns 1 if the reserve host is taken by this call, 0 if it was
+    # taken by another one.
+    res = session.query(ReserveList).filter_by(id=reserve_id).\
+        filter_by(deleted=0).update({'delete_at': delete_at, 'deleted': 1},
+                                    synchronize_session=False)
+    return res
+
+
+@_retry_on_deadlock
+@_session_handle
+def release_reserve_list_by_hostname(session, cluster_port, hostname):
+    # UPDATE reserve_list SET deleted=0, delete_at=NULL
+    #   WHERE cluster_port=:cluster_port AND hostname=:hostname AND deleted=1
+    # Gives back the reserve host taken with claim_reserve_list_by_id.
+    res = session.query(ReserveList).filter_by(
+        cluster_port=cluster_port).filter_by(hostname=hostname).\
+        filter_by(deleted=1).update({'delete_at': None, 'deleted': 0},
+                                    synchronize_session=False)
     return res
 
 
@@ -387,6 +774,21 @@ def update_reserve_list_by_hostname_as_deleted(session, hostname, delete_at):
     return res
 
 
+@_retry_on_deadlock
+@_session_handle
+def update_reserve_list_by_hostnames_as_deleted(session, hostnames,
+                                                delete_at):
+    # UPDATE reserve_list SET deleted=1, delete_at=:delete_at
+    #   WHERE hostname IN (:hostnames) AND deleted=0
+    if not hostnames:
+        return 0
+    res = session.query(ReserveList).filter(
+        ReserveList.hostname.in_(hostnames)).filter_by(deleted=0).\
+        update({'delete_at': delete_at, 'deleted': 1},
+               synchronize_session=False)
+    return res
+
+
 @_retry_on_deadlock
 @_session_handle
 def update_reserve_list_by_cluster_port_as_deleted(session, delete_at,
@@ -398,30 +800,23 @@ def update_reserve_list_by_cluster_port_as_deleted(session, delete_at,
     return res
 
 
-@_session_handle
-def get_old_records_notification(session, border_time):
-    # sql = "SELECT id FROM notification_list " \
-    #       "WHERE progress = 0 AND create_at < '%s'" \
-    #       % (border_time_str)
-    with _sqlalchemy_error():
-        res = session.query(NotificationList).filter(
-            NotificationList.progress == 0,
-            NotificationList.create_at < border_time).all()
-    return res
-
-
 @_retry_on_deadlock
 @_session_handle
-def delete_expired_notification(session, update_at, delete_at, id):
-    # sql = "UPDATE notification_list " \
-    #       "SET progress = %d, update_at = '%s', delete_at = '%s' " \
-    #       "WHERE id = '%s'" \
-    #       % (4, datetime.datetime.now(),
-    #          datetime.datetime.now(), row.get("id"))
-    res = session.query(NotificationList).filter_by(
-        id=id).update(
-            {'progress': 4, 'update_at': update_at, 'delete_at': delete_at}
-    )
+def expire_old_records_notification(session, border_time, update_at,
+                                    exclude_ids=None):
+    # UPDATE notification_list SET progress = 4, update_at = :update_at,
+    #   delete_at = :update_at
+    #   WHERE progress = 0 AND create_at < :border_time
+    #   AND notification_id NOT IN (:exclude_ids)
+    query = session.query(NotificationList).filter(
+        NotificationList.progress == 0,
+        NotificationList.create_at < border_time)
+    if exclude_ids:
+        query = query.filter(
+            ~NotificationList.notification_id.in_(exclude_ids))
+    res = query.update(
+        {'progress': 4, 'update_at': update_at, 'delete_at': update_at},
+        synchronize_session=False)
     return res
 
 
@@ -499,6 +894,74 @@ def get_notification_list_distinct_hostname(session):
     return res
 
 
+def _update_progress_by_ids(session, model, ids, progress, update_at,
+                            current_progress):
+    # UPDATE <table> SET progress=:progress, update_at=:update_at,
+    #   delete_at=:update_at
+    #   WHERE id IN (:ids) AND progress IN (:current_progress)
+    # The ids are split so that the statement does not get too long.
+    res = 0
+    for i in range(0, len(ids), _IN_CLAUSE_SIZE):
+        res += session.query(model).filter(
+            model.id.in_(ids[i:i + _IN_CLAUSE_SIZE])).filter(
+            model.progress.in_(current_progress)).update(
+            {'progress': progress,
+             'update_at': update_at,
+             'delete_at': update_at},
+            synchronize_session=False)
+    return res
+
+
+@_retry_on_deadlock
+@_session_handle
+def supersede_reprocessing_records(session, update_at):
+    """
+    Pick the notifications to be reprocessed at startup, and mark the
+    others as superseded(progress=4) in one transaction.
+    For each notification_uuid of the VM recovery notifications and then
+    for each notification_hostname of the node recovery notifications, only
+    the newest notification in progress=0 is reprocessed.
+    :returns: The notifications to be reprocessed
+    """
+    # SELECT id, notification_id, notification_hostname,
+    #   notification_uuid, notification_cluster_port, recover_by
+    #   FROM notification_list WHERE progress = 0
+    #   ORDER BY create_at DESC, id DESC
+    # ROW_NUMBER() is not used because MySQL 5.x does not support it.
+    with _sqlalchemy_error():
+        rows = session.query(
+            NotificationList.id,
+            NotificationList.notification_id,
+            NotificationList.notification_hostname,
+            NotificationList.notification_uuid,
+            NotificationList.notification_cluster_port,
+            NotificationList.recover_by).filter_by(progress=0).order_by(
+                desc(NotificationList.create_at),
+                desc(NotificationList.id)).all()
+
+    superseded = set()
+    kept = []
+    for key, recover_by in (('notification_uuid', 1),
+                            ('notification_hostname', 0)):
+        rows = [row for row in rows if row.id not in superseded]
+        keys = set(getattr(row, key) for row in rows
+                   if row.recover_by == recover_by)
+        seen = set()
+        for row in rows:
+            value = getattr(row, key)
+            if value not in keys:
+                continue
+            if value in seen:
+                superseded.add(row.id)
+            else:
+                seen.add(value)
+                kept.append(row)
+
+    _update_progress_by_ids(session, NotificationList, sorted(superseded),
+                            4, update_at, [0])
+    return [row for row in kept if row.id not in superseded]
+
+
 @_retry_on_deadlock
 @_session_handle
 def update_notification_list_dict(session, notification_id, update_val):
@@ -508,15 +971,20 @@ def update_notification_list_dict(session, notification_id, update_val):
     return res
 
 
+@_retry_on_deadlock
 @_session_handle
-def get_old_records_vm_list(session, create_at, update_at):
-    # sql = "SELECT id FROM vm_list " \
-    #       "WHERE (progress = 0 AND create_at < '%s') " \
-    #       "OR (progress = 1 AND update_at < '%s')" \
-    #       % (border_time_str, border_time_str)
-    with _sqlalchemy_error():
-        res = session.query(VmList).filter(
-            VmList.progress == 0,
-            VmList.create_at < create_at,
-            VmList.update_at < update_at).all()
+def expire_old_records_vm_list(session, border_time, update_at,
+                               exclude_ids=None):
+    # UPDATE vm_list SET progress = 4, update_at = :update_at,
+    #   delete_at = :update_at
+    #   WHERE progress = 0 AND create_at < :border_time
+    #   AND id NOT IN (:exclude_ids)
+    query = session.query(VmList).filter(
+        VmList.progress == 0,
+        VmList.create_at < border_time)
+    if exclude_ids:
+        query = query.filter(~VmList.id.in_(exclude_ids))
+    res = query.update(
+        {'progress': 4, 'update_at': update_at, 'delete_at': update_at},
+        synchronize_session=False)
     return res
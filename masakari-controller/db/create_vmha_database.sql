@@ -25,7 +25,11 @@ progress int ,
 recover_by int ,
 iscsi_ip varchar( 16),
 controle_ip varchar( 16),
-recover_to varchar( 256)
+recover_to varchar( 256),
+index notification_list_notification_id_idx (notification_id(255)),
+index notification_list_hostname_type_time_idx
+  (notification_hostname(255), notification_type, notification_time),
+index notification_list_progress_recover_by_idx (progress, recover_by)
 );
 
 desc notification_list;
@@ -42,7 +46,9 @@ progress int ,
 retry_cnt int ,
 notification_id varchar( 256),
 recover_to varchar( 256),
-recover_by int
+recover_by int,
+recovery_sec int,
+index vm_list_uuid_progress_create_at_idx (uuid, progress, create_at)
 );
 
 desc vm_list;
@@ -57,8 +63,19 @@ update_at datetime ,
 delete_at datetime ,
 deleted int ,
 cluster_port varchar( 64),
-hostname  varchar( 256)
+hostname  varchar( 256),
+index reserve_list_cluster_port_deleted_idx (cluster_port, deleted),
+index reserve_list_hostname_deleted_idx (hostname(255), deleted)
 );
 
 desc reserve_list;
 
+create table schema_version
+(
+version int primary key,
+description varchar( 256),
+applied_at datetime
+);
+
+insert into schema_version values (2, 'Create tables', now());
+
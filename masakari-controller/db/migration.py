@@ -0,0 +1,149 @@
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Versioned schema migrations for masakari database.
+The applied versions are recorded in schema_version table.
+Version 1 is the schema created by create_vmha_database.sql before
+schema_version table was introduced.
+"""
+
+import datetime
+
+from sqlalchemy import func, inspect
+from models import Base, NotificationList, VmList, ReserveList
+from models import SchemaVersion
+
+
+def _add_indexes(eng, indexes):
+    """
+    Add the indexes which do not exist yet.
+    On MySQL the indexes are added with ALGORITHM=INPLACE, LOCK=NONE so that
+    the controller can keep writing to the tables during the migration.
+    """
+    inspector = inspect(eng)
+    for index in indexes:
+        table_name = index.table.name
+        existing = [i['name'] for i in inspector.get_indexes(table_name)]
+        if index.name in existing:
+            continue
+
+        if eng.dialect.name == 'mysql':
+            lengths = index.dialect_kwargs.get('mysql_length') or {}
+            columns = []
+            for column in index.columns:
+                if isinstance(lengths, dict):
+                    length = lengths.get(column.name)
+                else:
+                    length = lengths
+                if length:
+                    columns.append('`%s`(%d)' % (column.name, length))
+                else:
+                    columns.append('`%s`' % column.name)
+            eng.execute(
+                'ALTER TABLE `%s` ADD INDEX `%s` (%s), '
+                'ALGORITHM=INPLACE, LOCK=NONE' % (
+                    table_name, index.name, ', '.join(columns)))
+        else:
+            index.create(eng)
+
+
+def _add_columns(eng, columns):
+    """
+    Add the nullable columns which do not exist yet.
+    On MySQL the columns are added with ALGORITHM=INPLACE, LOCK=NONE.
+    """
+    inspector = inspect(eng)
+    for column in columns:
+        table_name = column.table.name
+        existing = [c['name'] for c in inspector.get_columns(table_name)]
+        if column.name in existing:
+            continue
+
+        column_type = column.type.compile(dialect=eng.dialect)
+        if eng.dialect.name == 'mysql':
+            eng.execute(
+                'ALTER TABLE `%s` ADD COLUMN `%s` %s, '
+                'ALGORITHM=INPLACE, LOCK=NONE' % (
+                    table_name, column.name, column_type))
+        else:
+            eng.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                table_name, column.name, column_type))
+
+
+def _upgrade_to_2(eng):
+    indexes = []
+    for model in (NotificationList, VmList, ReserveList):
+        indexes.extend(model.__table__.indexes)
+    _add_indexes(eng, sorted(indexes, key=lambda i: i.name))
+
+
+def _upgrade_to_3(eng):
+    _add_columns(eng, [VmList.__table__.c.recovery_sec])
+
+
+# (version, description, upgrade function)
+MIGRATIONS = [
+    (2, 'Add indexes for the lookups of notification_list, vm_list and '
+        'reserve_list', _upgrade_to_2),
+    (3, 'Add recovery_sec to vm_list', _upgrade_to_3),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(eng):
+    """
+    Return the schema version of the database, or None if the tables are
+    not created yet.
+    """
+    inspector = inspect(eng)
+    table_names = inspector.get_table_names()
+    if SchemaVersion.__tablename__ in table_names:
+        version = eng.execute(
+            SchemaVersion.__table__.select().with_only_columns(
+                [func.max(SchemaVersion.version)])).scalar()
+        if version is not None:
+            return version
+    if NotificationList.__tablename__ in table_names:
+        return 1
+    return None
+
+
+def _stamp(eng, version, description):
+    eng.execute(SchemaVersion.__table__.insert().values(
+        version=version, description=description,
+        applied_at=datetime.datetime.now()))
+
+
+def upgrade(eng):
+    """
+    Create the tables, or apply the migrations which are not applied yet.
+    :returns: The schema version after the upgrade
+    """
+    current = get_version(eng)
+    if current is None:
+        Base.metadata.create_all(eng)
+        _stamp(eng, LATEST_VERSION, 'Create tables')
+        return LATEST_VERSION
+
+    SchemaVersion.__table__.create(eng, checkfirst=True)
+    for version, description, upgrade_fn in MIGRATIONS:
+        if version <= current:
+            continue
+        upgrade_fn(eng)
+        _stamp(eng, version, description)
+        current = version
+
+    return current
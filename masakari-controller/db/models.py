@@ -15,7 +15,7 @@
 """
 SQLAlchemy model for masakari data.
 """
-from sqlalchemy import Column, Integer, DateTime, String
+from sqlalchemy import Column, Integer, DateTime, Index, String
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -36,6 +36,18 @@ class NotificationList(Base, HasId, HasAudit):
     """ Represents a notification sent from monitors """
 
     __tablename__ = 'notification_list'
+    # MySQL can not index the whole varchar(256) columns in utf8, so only
+    # the first 255 characters are indexed.
+    __table_args__ = (
+        Index('notification_list_notification_id_idx', 'notification_id',
+              mysql_length=255),
+        Index('notification_list_hostname_type_time_idx',
+              'notification_hostname', 'notification_type',
+              'notification_time',
+              mysql_length={'notification_hostname': 255}),
+        Index('notification_list_progress_recover_by_idx',
+              'progress', 'recover_by'),
+    )
 
     notification_id = Column(String(256))
     notification_type = Column(String(16))
@@ -62,6 +74,10 @@ class VmList(Base, HasId, HasAudit):
     """ Represents a nova instance to recovery from failures """
 
     __tablename__ = 'vm_list'
+    __table_args__ = (
+        Index('vm_list_uuid_progress_create_at_idx',
+              'uuid', 'progress', 'create_at'),
+    )
 
     uuid = Column(String(64))
     progress = Column(Integer)
@@ -69,11 +85,28 @@ class VmList(Base, HasId, HasAudit):
     notification_id = Column(String(256))
     recover_to = Column(String(256))
     recover_by = Column(Integer)
+    # The seconds from the start to the end of the recovery
+    recovery_sec = Column(Integer)
 
 
 class ReserveList(Base, HasId, HasAudit):
     """ Represents a hypervisor reserved for failure handling """
     __tablename__ = 'reserve_list'
+    __table_args__ = (
+        Index('reserve_list_cluster_port_deleted_idx',
+              'cluster_port', 'deleted'),
+        Index('reserve_list_hostname_deleted_idx', 'hostname', 'deleted',
+              mysql_length={'hostname': 255}),
+    )
 
     cluster_port = Column(String(64))
-    hostname = Column(String(256))
\ No newline at end of file
+    hostname = Column(String(256))
+
+
+class SchemaVersion(Base):
+    """ Represents a schema version applied by db/migration.py """
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(256))
+    applied_at = Column(DateTime)
@@ -0,0 +1,41 @@
+# Copyright(c) 2016 Nippon Telegraph and Telephone Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import os
+parentdir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                         os.path.pardir))
+sys.path = [parentdir] + sys.path
+
+from controller import masakari_config as config
+from db import api as dbapi
+from db import migration
+
+# Usage: python upgrade_tables.py [path of masakari-controller.conf]
+try:
+    if len(sys.argv) > 1:
+        rc_config = config.RecoveryControllerConfig(sys.argv[1])
+    else:
+        rc_config = config.RecoveryControllerConfig()
+    eng = dbapi.get_engine(rc_config)
+    print "Current schema version: ", migration.get_version(eng)
+    version = migration.upgrade(eng)
+except Exception as e:
+    # error handling
+    print "failed to upgrade tables."
+    print "Exception: ", e
+    sys.exit(2)
+
+print "Successfully upgraded tables to schema version", version
+sys.exit(0)